@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+
+import sys
+import asyncio
+sys.path.insert(0, "../..")
+from nxsugarpy import *
+
+if __name__ == "__main__":
+    s = AsyncService("root:root@localhost", "test.nxsugar.asyncsrv", {"pulls": 2, "maxThreads": 4, "maxTasks": 2000})
+    s.setLogLevel(DebugLevel)
+    s.setStatsPeriod(5)
+
+    # A coroutine method: waiting does not hold a thread
+    async def wait(task):
+        try:
+            t = float(task.params["t"])
+        except:
+            return None, newJsonRpcErr(ErrInvalidParams)
+        await asyncio.sleep(t)
+        return t, None
+    s.addMethod("wait", wait)
+
+    # A coroutine method calling another nexus service without blocking
+    async def fib(task):
+        return await asyncTaskPush(task.nexusConn, "test.nxsugar.fibsrv.fib", task.params, timeout=30)
+    s.addMethod("fib", fib)
+
+    # Regular methods are still run by the worker threads
+    def hello(task):
+        return "hello", None
+    s.addMethod("hello", hello)
+
+    # Serve
+    s.serve()
@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+
+# Compares the JSON log line encoder with the string concatenation and
+# per-line strict_rfc3339 timestamp that nxsugarpy used before
+
+from __future__ import print_function
+import sys
+import json
+import time
+sys.path.insert(0, "../..")
+import nxsugarpy
+from nxsugarpy.log import *
+
+log = sys.modules["nxsugarpy.log"]
+
+def oldEncode(level, path, fields, msg):
+    import strict_rfc3339
+    jsonData = json.dumps(fields)
+    return '{"time": "' + strict_rfc3339.now_to_rfc3339_utcoffset() + '", "level": "' + level + '", "path": "' + path + '", "msg": "' + msg + '", "data": ' + jsonData + '}'
+
+def bench(f, n):
+    fields = {"type": "pull", "path": "test.nxsugar.fibsrv", "method": "fib", "params": {"v": 1000, "t": 0.5}, "tags": {"@user": "root"}, "connid": "a1b2c3d4e5"}
+    msg = 'pull 1: task[ path=test.nxsugar.fibsrv method=fib params={"v": 1000} tags={"@user": "root"} ]'
+    t0 = time.time()
+    for _ in range(n):
+        f(InfoLevel, "fibsrv", fields, msg)
+    return (time.time() - t0) * 1e6 / n
+
+if __name__ == "__main__":
+    n = 100000
+    setJSONOutput(True)
+    valid = True
+    try:
+        json.loads(oldEncode(InfoLevel, "svc", {}, 'say "hi"'))
+    except ValueError:
+        valid = False
+    print("json backend: {0}".format(log._fastjson.__name__ if log._fastjson != None else "json"))
+    try:
+        old = bench(oldEncode, n)
+        print("old encoder: {0:.2f}us/line (escapes msg: {1})".format(old, valid))
+    except ImportError:
+        old = None
+        print("old encoder: strict_rfc3339 not installed")
+    new = bench(log._encode, n)
+    json.loads(log._encode(InfoLevel, "svc", {}, 'say "hi"'))
+    print("new encoder: {0:.2f}us/line (escapes msg: True)".format(new))
+    if old != None:
+        print("speedup: {0:.2f}x".format(old / new))
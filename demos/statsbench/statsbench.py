@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+
+# Compares the sharded Stats counters with a single lock Stats like the one
+# nxsugarpy used before, with many threads doing the ~8 add calls made per task
+
+from __future__ import print_function
+import sys
+import time
+import threading
+sys.path.insert(0, "../..")
+from nxsugarpy.stats import Stats
+
+class LockedStats(object):
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.taskPullsDone = 0
+        self.tasksPulled = 0
+        self.tasksServed = 0
+        self.tasksRunning = 0
+        self.threadsUsed = 0
+
+    def _add(self, name, n):
+        self._lock.acquire()
+        setattr(self, name, getattr(self, name) + n)
+        self._lock.release()
+
+    def addTaskPullsDone(self, n):
+        self._add("taskPullsDone", n)
+
+    def addTasksPulled(self, n):
+        self._add("tasksPulled", n)
+
+    def addTasksServed(self, n):
+        self._add("tasksServed", n)
+
+    def addTasksRunning(self, n):
+        self._add("tasksRunning", n)
+
+    def addThreadsUsed(self, n):
+        self._add("threadsUsed", n)
+
+def task(stats):
+    stats.addThreadsUsed(1)
+    stats.addTaskPullsDone(1)
+    stats.addTasksPulled(1)
+    stats.addTasksRunning(1)
+    stats.addTasksServed(1)
+    stats.addThreadsUsed(-1)
+    stats.addTasksRunning(-1)
+    stats.addTasksPulled(0)
+
+def run(stats, threads, tasks):
+    start = threading.Event()
+    def worker():
+        start.wait()
+        for _ in range(tasks):
+            task(stats)
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    for w in workers:
+        w.start()
+    t0 = time.time()
+    start.set()
+    for w in workers:
+        w.join()
+    elapsed = time.time() - t0
+    assert stats.tasksServed == threads * tasks
+    return elapsed
+
+if __name__ == "__main__":
+    tasks = 5000
+    for threads in [1, 8, 64, 128]:
+        locked = run(LockedStats(), threads, tasks)
+        sharded = run(Stats(), threads, tasks)
+        total = threads * tasks
+        print("threads={0:<4} locked={1:.3f}s ({2:.2f}us/task) sharded={3:.3f}s ({4:.2f}us/task) speedup={5:.2f}x".format(threads, locked, locked * 1e6 / total, sharded, sharded * 1e6 / total, locked / sharded))
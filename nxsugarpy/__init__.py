@@ -24,3 +24,7 @@ from .service import *
 from .server import *
 from .errors import *
 from .log import *
+
+import sys
+if sys.version_info >= (3, 5):
+    from .asyncservice import *
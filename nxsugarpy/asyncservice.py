@@ -0,0 +1,469 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+#    nxsugarpy, a Python library for building nexus services with python
+#    Copyright (C) 2016 by the nxsugarpy team
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Lesser General Public License as published
+#    by the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU Lesser General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+
+import pynexus as nxpy
+from nxsugarpy.log import *
+from nxsugarpy.errors import *
+from nxsugarpy.stats import monotonicTime
+from nxsugarpy.pool import BulkheadRun, BulkheadBusy
+from nxsugarpy.service import Service, _populateOpts, _taskMetadata, _isMockTask, _setTaskDeadline, _taskExpired, _taskPriority, _defMethodWrapper
+
+import asyncio
+import threading
+import traceback
+
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    from Queue import Full, Empty
+except ImportError:
+    from queue import Full, Empty
+
+_waiters = None
+_waitersLock = threading.Lock()
+
+def _waiterPool():
+    global _waiters
+    with _waitersLock:
+        if _waiters == None:
+            _waiters = ThreadPoolExecutor(max_workers=64)
+        return _waiters
+
+async def _channelGet(loop, channel):
+    # A response already put by the reader thread is taken right away, the
+    # rest are waited for on get() by a shared pool of waiter threads, so the
+    # event loop is never blocked
+    try:
+        return channel.get_nowait()
+    except Empty:
+        pass
+    return await loop.run_in_executor(_waiterPool(), channel.get)
+
+async def asyncExecute(conn, method, params):
+    taskId, channel, err = conn.executeNoWait(method, params)
+    if err != None:
+        return None, err
+    try:
+        res = await _channelGet(asyncio.get_event_loop(), channel)
+    finally:
+        conn.delId(taskId)
+        # Frees the waiter when the request is cancelled before its response
+        channel.put(None)
+    if "error" in res:
+        return None, res["error"]
+    return res["result"], None
+
+async def asyncTaskPull(conn, prefix, timeout=0):
+    message = {"prefix": prefix}
+    if timeout > 0:
+        message["timeout"] = timeout
+    res, err = await asyncExecute(conn, "task.pull", message)
+    if err != None:
+        return None, err
+    return nxpy.Task(conn, res["taskid"], res["path"], res["method"], res["params"], res["tags"], res["prio"], res["detach"], res["user"]), None
+
+async def asyncTaskPush(conn, method, params, timeout=0, priority=0, ttl=0, detach=False):
+    message = {"method": method, "params": params}
+    if priority != 0:
+        message["prio"] = priority
+    if ttl != 0:
+        message["ttl"] = ttl
+    if detach:
+        message["detach"] = True
+    if timeout > 0:
+        message["timeout"] = timeout
+    return await asyncExecute(conn, "task.push", message)
+
+async def asyncSendResult(task, result):
+    if getattr(task, "local", False):
+        return task.sendResult(result)
+    return await asyncExecute(task.nexusConn, "task.result", {"taskid": task.taskId, "result": result})
+
+async def asyncSendError(task, code, message, data):
+    if getattr(task, "local", False):
+        return task.sendError(code, message, data)
+    if code < 0 and code in ErrStr:
+        if message != "":
+            message = "%s:[%s]" % (ErrStr[code], message)
+        else:
+            message = ErrStr[code]
+    return await asyncExecute(task.nexusConn, "task.error", {"taskid": task.taskId, "code": code, "message": message, "data": data})
+
+async def _maybeAwait(r):
+    if asyncio.iscoroutine(r):
+        await r
+
+class AsyncService(Service):
+    # Pulls and coroutine methods run on one event loop; regular methods are
+    # still executed by the worker pool so they can block freely
+    def __init__(self, url, path, opts = {}):
+        opts = _populateOpts(opts)
+        super(AsyncService, self).__init__(url, path, opts)
+        self.maxTasks = opts["maxTasks"]
+
+        self._loop = None
+        self._tasksSem = None
+        self._threadsSemAsync = None
+        self._asyncTasks = set()
+
+    def setMaxTasks(self, maxTasks):
+        self.maxTasks = maxTasks
+
+    def _wrapMethod(self, f):
+        if asyncio.iscoroutinefunction(f):
+            return _defAsyncMethodWrapper(f)
+        return _defMethodWrapper(f)
+
+    def _startPullers(self):
+        if self.maxTasks < self.pulls:
+            self.maxTasks = self.pulls
+        self._loop = asyncio.new_event_loop()
+        self._asyncTasks = set()
+        worker = threading.Thread(target=self._runLoop)
+        worker.daemon = True
+        worker.start()
+        return [worker]
+
+    def _pullsAutoscaled(self):
+        # Pulls are coroutines here, idle ones cost next to nothing
+        return False
+
+    def _runLoop(self):
+        asyncio.set_event_loop(self._loop)
+        try:
+            self._loop.run_until_complete(self._serveAsync())
+        finally:
+            self._loop.close()
+
+    async def _serveAsync(self):
+        self._tasksSem = asyncio.Semaphore(self.maxTasks)
+        self._threadsSemAsync = asyncio.Semaphore(self.maxThreads)
+        await asyncio.gather(*[self._taskPullAsync(i+1) for i in range(self.pulls)])
+        for method in self._allMethods():
+            if method.batcher != None:
+                self._startBatchAsync(0, method, method.batcher.flush())
+        await self._drainAsync()
+
+    async def _drainAsync(self):
+        while len(self._asyncTasks) > 0:
+            await asyncio.wait(list(self._asyncTasks))
+
+    async def _taskPullAsync(self, i):
+        while True:
+            if self._isStopping():
+                return
+            await self._tasksSem.acquire()
+            if self._isStopping():
+                self._tasksSem.release()
+                return
+
+            # Make a task pull
+            self._stats.addTaskPullsDone(1)
+            conn = self._pullConn(i)
+            task, err = await asyncTaskPull(conn, self.path, self.pullTimeout)
+            if err != None:
+                self._tasksSem.release()
+                if isNexusErrCode(err, ErrTimeout):
+                    self._stats.addTaskPullsTimeouts(1)
+                    continue
+                if await self._loop.run_in_executor(None, self._replaceConn, i, conn, err):
+                    continue
+
+                if not self._isStopping() or not (isNexusErrCode(err, ErrCancel) or isNexusErrCode(err, ErrConnClosed)):
+                    errReason = errToStr(err)
+                    self.logWithFields(ErrorLevel, {"type": "pull_error"}, "pull {0}: pulling task: {1}", i, errReason)
+                    try:
+                        self._cmdQueue.put_nowait(("connection_ended", errReason))
+                    except Full:
+                        log(PanicLevel, "queue", "cmdQueue is full")
+                        pass
+                self._closeConn(i, conn)
+                return
+
+            # A task has been pulled
+            self._stats.addTasksPulled(1)
+            pulledAt = monotonicTime()
+
+            # Get method or global handler
+            method = self._handler
+            if method == None:
+                if task.method not in self._methods:
+                    await asyncSendError(task, ErrMethodNotFound, "", None)
+                    self._stats.addTasksMethodNotFound(1)
+                    self._tasksSem.release()
+                    continue
+                method = self._methods[task.method]
+            if self._replySender != None:
+                task.replySender = self._replySender
+                task.replyMethod = method.name
+
+            # Log the task
+            if not method.disablePullLog:
+                self._logPull(i, method, task)
+
+            # Tasks still waiting when their deadline passes are dropped before running
+            _setTaskDeadline(task, pulledAt)
+
+            # Answer from the results cache
+            cacheKey, cached = self._cacheLookup(method, task)
+            if cached != None:
+                await _sendResponseAsync(task, cached[0], cached[1])
+                self._stats.addTasksServed(1)
+                self._tasksSem.release()
+                continue
+
+            # Wait for the response of an identical task already running
+            flightKey, joined = self._flightJoin(method, task)
+            if joined:
+                self._tasksSem.release()
+                continue
+
+            # Queue the task into the method's next batch, it keeps its task slot until the batch is done
+            if method.batcher != None and not _isMockTask(task):
+                batch = method.batcher.add((task, pulledAt, cacheKey, flightKey))
+                if batch != None:
+                    self._startBatchAsync(i, method, batch)
+                continue
+
+            # Respect the method's own concurrency limit
+            state = self._bulkheadEnter(i, method, task, pulledAt, cacheKey, flightKey)
+            if state == BulkheadBusy:
+                await asyncSendError(task, ErrBusy, ErrStr[ErrBusy], None)
+                await self._flightDoneAsync(method, task, flightKey, {"code": ErrBusy, "message": ErrStr[ErrBusy]})
+            if state != BulkheadRun:
+                self._tasksSem.release()
+                continue
+
+            # Execute the task
+            t = self._loop.create_task(self._taskDispatchAsync(i, method, task, pulledAt, cacheKey, flightKey))
+            self._asyncTasks.add(t)
+            t.add_done_callback(self._asyncTasks.discard)
+
+    async def _taskDispatchAsync(self, n, method, task, pulledAt, cacheKey, flightKey):
+        try:
+            if asyncio.iscoroutinefunction(method.f):
+                await self._runBulkheadedAsync(n, method, task, pulledAt, cacheKey, flightKey)
+            elif method.inline:
+                # Trivial methods skip the worker pool, but still leave the loop since they reply synchronously
+                await self._loop.run_in_executor(None, self._runInline, n, method, task, cacheKey, flightKey)
+            else:
+                await self._taskExecuteThreaded(n, method, task, pulledAt, cacheKey, flightKey)
+        finally:
+            self._tasksSem.release()
+
+    async def _runBulkheadedAsync(self, n, method, task, pulledAt, cacheKey, flightKey):
+        while True:
+            if self._observeWait(method, pulledAt):
+                await asyncSendError(task, ErrOverloaded, ErrStr[ErrOverloaded], None)
+                await self._flightDoneAsync(method, task, flightKey, {"code": ErrOverloaded, "message": ErrStr[ErrOverloaded]})
+            else:
+                self._stats.addTasksRunning(1)
+                await self._runTaskAsync(n, method, task, cacheKey, flightKey)
+                self._stats.addTasksRunning(-1)
+            queued = self._bulkheadLeave(method)
+            if queued == None:
+                break
+            n, task, pulledAt, cacheKey, flightKey = queued
+
+    def _runBulkheaded(self, n, method, task, pulledAt=None, cacheKey=None, flightKey=None):
+        if asyncio.iscoroutinefunction(method.f):
+            asyncio.run_coroutine_threadsafe(self._runBulkheadedAsync(n, method, task, pulledAt, cacheKey, flightKey), self._loop).result()
+        else:
+            super(AsyncService, self)._runBulkheaded(n, method, task, pulledAt, cacheKey, flightKey)
+
+    async def _acquireWorkerAsync(self):
+        # The pool limit can be below maxThreads when it is tuned at runtime,
+        # so wait for a slot off the loop when none is free
+        if not self._workerPool.tryAcquire():
+            await self._loop.run_in_executor(None, self._workerPool.acquire)
+        self._stats.addThreadsUsed(1)
+
+    async def _taskExecuteThreaded(self, n, method, task, pulledAt, cacheKey, flightKey):
+        future = self._loop.create_future()
+        def run():
+            try:
+                self._taskExecute(n, method, task, pulledAt, cacheKey, flightKey)
+            finally:
+                self._loop.call_soon_threadsafe(future.set_result, None)
+        if self._dispatchQueue != None:
+            # maxTasks already bounds the queue, so never block the loop on it
+            priority = _taskPriority(method, task)
+            self._dispatchQueue.put((run, (), priority, pulledAt), priority, False)
+            await future
+            return
+        # The asyncio semaphore bounds how many tasks wait on a pool slot at once
+        await self._threadsSemAsync.acquire()
+        try:
+            await self._acquireWorkerAsync()
+            self._workerPool.submit(run)
+            await future
+        finally:
+            self._threadsSemAsync.release()
+
+    def _dispatchBatch(self, method, batch):
+        if len(batch) == 0:
+            return
+        try:
+            self._loop.call_soon_threadsafe(self._startBatchAsync, 0, method, batch)
+        except RuntimeError:
+            self.logWithFields(ErrorLevel, {"type": "batch_lost"}, "lost batch of {0} tasks: event loop is closed", len(batch))
+
+    def _startBatchAsync(self, n, method, batch):
+        if len(batch) == 0:
+            return
+        t = self._loop.create_task(self._batchDispatchAsync(n, method, batch))
+        self._asyncTasks.add(t)
+        t.add_done_callback(self._asyncTasks.discard)
+
+    async def _batchDispatchAsync(self, n, method, batch):
+        try:
+            await self._threadsSemAsync.acquire()
+            try:
+                await self._acquireWorkerAsync()
+                future = self._loop.create_future()
+                def run():
+                    try:
+                        self._batchExecute(n, method, batch)
+                    finally:
+                        self._loop.call_soon_threadsafe(future.set_result, None)
+                self._workerPool.submit(run)
+                await future
+            finally:
+                self._threadsSemAsync.release()
+        finally:
+            for _ in batch:
+                self._tasksSem.release()
+
+    def _runLocalTask(self, n, method, task, cacheKey):
+        if asyncio.iscoroutinefunction(method.f):
+            asyncio.run_coroutine_threadsafe(self._runTaskAsync(n, method, task, cacheKey), self._loop).result()
+        else:
+            super(AsyncService, self)._runLocalTask(n, method, task, cacheKey)
+
+    async def _runTaskAsync(self, n, method, task, cacheKey=None, flightKey=None):
+        if _taskExpired(task):
+            self._stats.addTasksExpired(1)
+            await asyncSendError(task, ErrTtlExpired, "", None)
+            await self._flightDoneAsync(method, task, flightKey, {"code": ErrTtlExpired, "message": ErrStr[ErrTtlExpired]})
+            return
+        try:
+            metadata = _taskMetadata(task)
+            started = monotonicTime()
+            # Pre and post actions are regular functions that may block, keep them off the loop
+            if self._preaction != None:
+                await self._loop.run_in_executor(None, self._runPreaction, n, task)
+            handlerStarted = monotonicTime()
+
+            # Pact: return mock
+            if "pact" in metadata and metadata["pact"]:
+                await self._sendPactAsync(method, task, metadata)
+            else:
+                # Validate input schema
+                if method.inSchema != None:
+                    self.log(InfoLevel, "not implemented: we should check the following input schema here: {0}", method.inSchema)
+                    # Implement json schema validation!
+
+                # Execute the task
+                errReturned = False
+                if "testing" in metadata and metadata["testing"]:
+                    if method.testf == None:
+                        await asyncSendError(task, ErrTestingMethodNotProvided, ErrStr[ErrTestingMethodNotProvided], None)
+                        errReturned = True
+                    elif asyncio.iscoroutinefunction(method.testf):
+                        await method.testf(task)
+                    else:
+                        await self._loop.run_in_executor(None, method.testf, task)
+                else:
+                    await _maybeAwait(method.f(task))
+
+                self._logResponse(n, method, task)
+                if not errReturned:
+                    self._checkResponseSchemas(method, task)
+                    self._cacheStore(method, task, cacheKey)
+
+            handlerDone = monotonicTime()
+            if self._postaction != None:
+                await self._loop.run_in_executor(None, self._runPostaction, n, task)
+            self._observeTask(method, started, handlerStarted, handlerDone, monotonicTime())
+            self._stats.addTasksServed(1)
+
+        except Exception:
+            self._stats.addTaskPanic(1)
+            tbck = traceback.format_exc()
+            self.logWithFields(ErrorLevel, {"type": "task_exception"}, "pull {0}: panic serving task: {1}", n, tbck)
+            await asyncSendError(task, ErrInternal, tbck, None)
+            await self._flightDoneAsync(method, task, flightKey, {"code": ErrInternal, "message": tbck})
+            return
+        await self._flightDoneAsync(method, task, flightKey)
+
+    async def _flightDoneAsync(self, method, task, flightKey, failErr=None):
+        waiters, res, err = self._flightLeave(method, task, flightKey, failErr)
+        for waiter in waiters:
+            await _sendResponseAsync(waiter, res, err)
+        if failErr == None:
+            self._stats.addTasksServed(len(waiters))
+
+    async def _sendPactAsync(self, method, task, metadata):
+        for pact in method.pacts:
+            if isinstance(pact.input, dict):
+                pact.input["@metadata"] = metadata
+                if pact.input == task.params:
+                    await asyncSendResult(task, pact.output)
+                    return
+        await asyncSendError(task, ErrPactNotDefined, ErrStr[ErrPactNotDefined], None)
+
+    def _waitWorkers(self):
+        self._flushBatches()
+        try:
+            asyncio.run_coroutine_threadsafe(self._drainAsync(), self._loop).result()
+        except RuntimeError:
+            pass
+        super(AsyncService, self)._waitWorkers()
+
+    def _logMap(self):
+        m = super(AsyncService, self)._logMap()
+        m["mode"] = "asyncio"
+        m["maxTasks"] = self.maxTasks
+        return m
+
+    def _logStatsMap(self):
+        m = super(AsyncService, self)._logStatsMap()
+        m["tasksMax"] = self.maxTasks
+        return m
+
+def _defAsyncMethodWrapper(f):
+    async def wrapped(task):
+        res, err = await f(task)
+        await _sendResponseAsync(task, res, err)
+    return wrapped
+
+async def _sendResponseAsync(task, res, err):
+    if res != None:
+        task.tags["@local-response-result"] = res
+    if err != None:
+        task.tags["@local-response-error"] = err
+    if "@local-repliedTo" in task.tags:
+        return
+    if err != None:
+        err = formatAsJsonRpcErr(err)
+        await asyncSendError(task, err["code"], err["message"], err["data"])
+    else:
+        await asyncSendResult(task, res)
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+#    nxsugarpy, a Python library for building nexus services with python
+#    Copyright (C) 2016 by the nxsugarpy team
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Lesser General Public License as published
+#    by the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU Lesser General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+
+import threading
+import traceback
+
+from nxsugarpy.log import *
+from nxsugarpy.stats import monotonicTime
+
+class Batcher(object):
+    # Collects items until maxBatch of them are pending or the oldest one has
+    # waited maxWait seconds; full batches are handed back to the caller of
+    # add() and timed out ones to the dispatch function from the flush thread
+    def __init__(self, maxBatch=100, maxWait=0.005):
+        if maxBatch < 1:
+            maxBatch = 1
+        if maxWait < 0:
+            maxWait = 0
+        self.maxBatch = maxBatch
+        self.maxWait = maxWait
+        self._cond = threading.Condition(threading.Lock())
+        self._items = []
+        self._deadline = None
+        self._dispatch = None
+        self._stopped = True
+
+    def start(self, dispatch):
+        with self._cond:
+            if not self._stopped:
+                return
+            self._dispatch = dispatch
+            self._stopped = False
+        worker = threading.Thread(target=self._run)
+        worker.daemon = True
+        worker.start()
+
+    def stop(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+
+    def add(self, item):
+        # Returns the batch to run when this item fills it
+        with self._cond:
+            self._items.append(item)
+            if len(self._items) >= self.maxBatch:
+                return self._take()
+            if len(self._items) == 1:
+                self._deadline = monotonicTime() + self.maxWait
+                self._cond.notify()
+            return None
+
+    def flush(self):
+        with self._cond:
+            return self._take()
+
+    def pending(self):
+        with self._cond:
+            return len(self._items)
+
+    def _take(self):
+        items = self._items
+        self._items = []
+        self._deadline = None
+        return items
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._stopped and (self._deadline == None or monotonicTime() < self._deadline):
+                    if self._deadline == None:
+                        self._cond.wait()
+                    else:
+                        self._cond.wait(max(self._deadline - monotonicTime(), 0))
+                if self._stopped:
+                    return
+                items = self._take()
+            try:
+                self._dispatch(items)
+            except Exception:
+                log(ErrorLevel, "batch", "panic dispatching batch: {0}", traceback.format_exc())
@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+#    nxsugarpy, a Python library for building nexus services with python
+#    Copyright (C) 2016 by the nxsugarpy team
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Lesser General Public License as published
+#    by the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU Lesser General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+
+import hashlib
+import json
+import threading
+
+from collections import OrderedDict
+from nxsugarpy.stats import monotonicTime
+
+def canonicalParams(params, excludeMetadata=True, excludeKeys=[]):
+    if isinstance(params, dict) and (excludeMetadata or len(excludeKeys) > 0):
+        params = dict((k, v) for k, v in params.items() if not (excludeMetadata and k == "@metadata") and k not in excludeKeys)
+    return json.dumps(params, sort_keys=True, separators=(",", ":"), default=str)
+
+def paramsKey(params, excludeMetadata=True, excludeKeys=[]):
+    return hashlib.sha1(canonicalParams(params, excludeMetadata, excludeKeys).encode("utf-8")).digest()
+
+class ResultCache(object):
+    def __init__(self, maxEntries=1024, maxBytes=0, ttl=0, cacheErrors=False, errorTtl=0, excludeMetadata=True, excludeKeys=[]):
+        self.maxEntries = maxEntries
+        self.maxBytes = maxBytes
+        self.ttl = ttl
+        self.cacheErrors = cacheErrors
+        self.errorTtl = errorTtl
+        if self.errorTtl <= 0:
+            self.errorTtl = ttl
+        self.excludeMetadata = excludeMetadata
+        self.excludeKeys = excludeKeys
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._bytes = 0
+
+    def key(self, params):
+        return paramsKey(params, self.excludeMetadata, self.excludeKeys)
+
+    def get(self, key):
+        # Returns (found, result, err, evicted)
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry == None:
+                return False, None, None, 0
+            res, err, expires, size = entry
+            if expires != None and monotonicTime() >= expires:
+                self._bytes -= size
+                return False, None, None, 1
+            self._entries[key] = entry
+            return True, res, err, 0
+
+    def put(self, key, res, err):
+        # Returns how many entries were evicted to make room
+        if err != None and not self.cacheErrors:
+            return 0
+        ttl = self.ttl
+        if err != None:
+            ttl = self.errorTtl
+        expires = None
+        if ttl > 0:
+            expires = monotonicTime() + ttl
+        size = 0
+        if self.maxBytes > 0:
+            size = len(key) + len(json.dumps([res, err], separators=(",", ":"), default=str))
+            if size > self.maxBytes:
+                return 0
+        evicted = 0
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old != None:
+                self._bytes -= old[3]
+            self._entries[key] = (res, err, expires, size)
+            self._bytes += size
+            while len(self._entries) > 0 and ((self.maxEntries > 0 and len(self._entries) > self.maxEntries) or (self.maxBytes > 0 and self._bytes > self.maxBytes)):
+                _, entry = self._entries.popitem(last=False)
+                self._bytes -= entry[3]
+                evicted += 1
+        return evicted
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+class SingleFlight(object):
+    # Groups concurrent tasks with the same key so only the first one (the
+    # leader) runs the handler and the rest wait for its response
+    def __init__(self, excludeMetadata=True, excludeKeys=[]):
+        self.excludeMetadata = excludeMetadata
+        self.excludeKeys = excludeKeys
+        self._lock = threading.Lock()
+        self._flights = {}
+
+    def key(self, params):
+        return paramsKey(params, self.excludeMetadata, self.excludeKeys)
+
+    def join(self, key, task):
+        # Returns True when the task is the leader and must run the handler
+        with self._lock:
+            waiters = self._flights.get(key)
+            if waiters == None:
+                self._flights[key] = []
+                return True
+            waiters.append(task)
+            return False
+
+    def leave(self, key):
+        # Returns the tasks that joined the leader's flight
+        with self._lock:
+            return self._flights.pop(key, [])
+
+    def __len__(self):
+        with self._lock:
+            return len(self._flights)
@@ -20,10 +20,10 @@
 ##############################################################################
 
 from .server import *
+from .server import _forkContext
 from .service import *
 from .log import *
 import json
-import getopt
 import sys
 from six import string_types
 
@@ -32,12 +32,25 @@ _configServer = {
     "user": "",
     "pass": "",
     "log-level": InfoLevel,
+    "log-async": False,
+    "log-buffer": 8192,
+    "log-overflow": OverflowDrop,
+    "log-file": "",
+    "log-file-max-size": 0,
+    "log-file-backups": 3,
+    "log-time-ms": False,
     "graceful-exit": 20,
     "testing": False,
     "pulls": 1,
     "pull-timeout": 3600,
     "max-threads": 4,
+    "min-threads": -1,
+    "thread-idle-timeout": 60,
     "stats-period": 1800,
+    "workers": 1,
+    "thread-budget": 0,
+    "connections": 1,
+    "reconnect": False,
     "version": "",
     "services": {},
 }
@@ -54,22 +67,42 @@ _config = {}
 def usage():
     print('''Usage of {0}:\n  -c, --config string\n  \tJSON configuration file (default "config.json")\n  --production\n  \tEnables Production mode'''.format(sys.argv[0]))
 
-try:
-    opts, args = getopt.getopt(sys.argv[1:], "hc:", ["help", "config=", "production"])
-except getopt.GetoptError as e:
-    print(str(e))
-    usage()
-    sys.exit(2)
-for o, a in opts:
-    if o in ("-h", "--help"):
-        usage()
-        sys.exit()
-    elif o == "--production":
-        productionMode = True
-    elif o in ("-c", "--config"):
-        configFile = a
+def _parseArgs(args):
+    # Arguments other than ours are left to the program, so importing
+    # nxsugarpy from a test runner or a script with its own flags works.
+    # Returns the long options it doesn't know, which may be mistyped ones
+    global productionMode, configFile
+    args = list(args)
+    unknown = []
+    while len(args) > 0:
+        o = args.pop(0)
+        if o in ("-h", "--help"):
+            usage()
+            sys.exit()
+        elif o == "--production":
+            productionMode = True
+        elif o in ("-c", "--config"):
+            if len(args) == 0:
+                print("option {0} requires argument".format(o))
+                usage()
+                sys.exit(2)
+            configFile = args.pop(0)
+        elif o.startswith("--config="):
+            configFile = o[len("--config="):]
+        elif o.startswith("-c") and not o.startswith("--"):
+            configFile = o[2:]
+        elif o.startswith("--") and o != "--":
+            unknown.append(o)
+    return unknown
+
+def _warnUnknownArgs(unknown):
+    for o in unknown:
+        logWithFields(WarnLevel, "config", {"type": "unknown_option", "option": o}, "ignoring unknown option {0}", o)
+
+_unknownArgs = _parseArgs(sys.argv[1:])
 
 setJSONOutput(productionMode)
+_warnUnknownArgs(_unknownArgs)
 
 def _parseConfig():
     global _configParsed, _config, _configServer
@@ -91,8 +124,11 @@ def _parseConfig():
 
                 if "url" not in server:
                     return MissingConfigErr.format("server.url"), {"type": "missing_param"}
-                if not isinstance(server["url"], string_types):
-                    return InvalidConfigErr.format("server.url", "must be string"), {"type": "invalid_param"}
+                if isinstance(server["url"], list):
+                    if len(server["url"]) == 0 or not all(isinstance(u, string_types) for u in server["url"]):
+                        return InvalidConfigErr.format("server.url", "must be string or list of strings"), {"type": "invalid_param"}
+                elif not isinstance(server["url"], string_types):
+                    return InvalidConfigErr.format("server.url", "must be string or list of strings"), {"type": "invalid_param"}
                 _configServer["url"] = server["url"]
                 if "user" not in server:
                     return MissingConfigErr.format("server.user"), {"type": "missing_param"}
@@ -110,6 +146,48 @@ def _parseConfig():
                     if server["log-level"] not in _logLevels:
                         return InvalidConfigErr.format("server.log-level", "must be one of [debug info warn error fatal panic]"), {"type": "invalid_param"}
                     _configServer["log-level"] = server["log-level"]
+                if "log-async" in server:
+                    try:
+                        _configServer["log-async"] = bool(server["log-async"])
+                    except:
+                        return InvalidConfigErr.format("server.log-async", "must be bool"), {"type": "invalid_param"}
+                if "log-buffer" in server:
+                    try:
+                        lb = int(server["log-buffer"])
+                        if lb < 1:
+                            return InvalidConfigErr.format("server.log-buffer", "must be positive"), {"type": "invalid_param"}
+                        _configServer["log-buffer"] = lb
+                    except:
+                        return InvalidConfigErr.format("server.log-buffer", "must be int"), {"type": "invalid_param"}
+                if "log-overflow" in server:
+                    if server["log-overflow"] not in [OverflowDrop, OverflowBlock]:
+                        return InvalidConfigErr.format("server.log-overflow", "must be one of [drop block]"), {"type": "invalid_param"}
+                    _configServer["log-overflow"] = server["log-overflow"]
+                if "log-file" in server:
+                    if not isinstance(server["log-file"], string_types):
+                        return InvalidConfigErr.format("server.log-file", "must be string"), {"type": "invalid_param"}
+                    _configServer["log-file"] = server["log-file"]
+                if "log-file-max-size" in server:
+                    try:
+                        ms = int(server["log-file-max-size"])
+                        if ms < 0:
+                            return InvalidConfigErr.format("server.log-file-max-size", "must be positive or 0"), {"type": "invalid_param"}
+                        _configServer["log-file-max-size"] = ms
+                    except:
+                        return InvalidConfigErr.format("server.log-file-max-size", "must be int"), {"type": "invalid_param"}
+                if "log-file-backups" in server:
+                    try:
+                        lb = int(server["log-file-backups"])
+                        if lb < 0:
+                            return InvalidConfigErr.format("server.log-file-backups", "must be positive or 0"), {"type": "invalid_param"}
+                        _configServer["log-file-backups"] = lb
+                    except:
+                        return InvalidConfigErr.format("server.log-file-backups", "must be int"), {"type": "invalid_param"}
+                if "log-time-ms" in server:
+                    try:
+                        _configServer["log-time-ms"] = bool(server["log-time-ms"])
+                    except:
+                        return InvalidConfigErr.format("server.log-time-ms", "must be bool"), {"type": "invalid_param"}
                 if "graceful-exit" in server:
                     try:
                         ge = float(server["graceful-exit"])
@@ -147,6 +225,22 @@ def _parseConfig():
                         _configServer["max-threads"] = mt
                     except:
                         return InvalidConfigErr.format("server.max-threads", "must be int"), {"type": "invalid_param"}
+                if "min-threads" in server:
+                    try:
+                        mt = int(server["min-threads"])
+                        if mt < 0:
+                            return InvalidConfigErr.format("server.min-threads", "must be positive or 0"), {"type": "invalid_param"}
+                        _configServer["min-threads"] = mt
+                    except:
+                        return InvalidConfigErr.format("server.min-threads", "must be int"), {"type": "invalid_param"}
+                if "thread-idle-timeout" in server:
+                    try:
+                        it = float(server["thread-idle-timeout"])
+                        if it <= 0:
+                            return InvalidConfigErr.format("server.thread-idle-timeout", "must be positive"), {"type": "invalid_param"}
+                        _configServer["thread-idle-timeout"] = it
+                    except:
+                        return InvalidConfigErr.format("server.thread-idle-timeout", "must be float"), {"type": "invalid_param"}
                 if "stats-period" in server:
                     try:
                         sp = float(server["stats-period"])
@@ -155,6 +249,37 @@ def _parseConfig():
                         _configServer["stats-period"] = sp
                     except:
                         return InvalidConfigErr.format("server.stats-period", "must be float"), {"type": "invalid_param"}
+                if "workers" in server:
+                    try:
+                        w = int(server["workers"])
+                        if w < 1:
+                            return InvalidConfigErr.format("server.workers", "must be positive"), {"type": "invalid_param"}
+                        if w > 1 and _forkContext() == None:
+                            return InvalidConfigErr.format("server.workers", "requires fork, which is not available on this platform"), {"type": "invalid_param"}
+                        _configServer["workers"] = w
+                    except:
+                        return InvalidConfigErr.format("server.workers", "must be int"), {"type": "invalid_param"}
+                if "connections" in server:
+                    try:
+                        cn = int(server["connections"])
+                        if cn < 1:
+                            return InvalidConfigErr.format("server.connections", "must be positive"), {"type": "invalid_param"}
+                        _configServer["connections"] = cn
+                    except:
+                        return InvalidConfigErr.format("server.connections", "must be int"), {"type": "invalid_param"}
+                if "reconnect" in server:
+                    try:
+                        _configServer["reconnect"] = bool(server["reconnect"])
+                    except:
+                        return InvalidConfigErr.format("server.reconnect", "must be bool"), {"type": "invalid_param"}
+                if "thread-budget" in server:
+                    try:
+                        tb = int(server["thread-budget"])
+                        if tb < 0:
+                            return InvalidConfigErr.format("server.thread-budget", "must be positive or 0"), {"type": "invalid_param"}
+                        _configServer["thread-budget"] = tb
+                    except:
+                        return InvalidConfigErr.format("server.thread-budget", "must be int"), {"type": "invalid_param"}
                 if "version" in server:
                     try:
                         _configServer["version"] = str(server["version"])
@@ -174,6 +299,30 @@ def _parseConfig():
                         "pulls": _configServer["pulls"],
                         "pull-timeout": _configServer["pull-timeout"],
                         "max-threads": _configServer["max-threads"],
+                        "min-threads": _configServer["min-threads"],
+                        "thread-idle-timeout": _configServer["thread-idle-timeout"],
+                        "mode": "threads",
+                        "max-tasks": 1024,
+                        "batch-concurrency": 1,
+                        "min-pulls": -1,
+                        "max-pulls": -1,
+                        "pulls-scale-interval": 5,
+                        "adaptive-threads": False,
+                        "adaptive-min-threads": 1,
+                        "adaptive-interval": 1,
+                        "shed-target": 0,
+                        "shed-interval": 0.1,
+                        "priority-dispatch": False,
+                        "priority-aging": 1,
+                        "priority-queue-size": 0,
+                        "reply-senders": 0,
+                        "reply-queue-size": 1024,
+                        "reply-batch-size": 32,
+                        "reconnect": _configServer["reconnect"],
+                        "reconnect-min-delay": 0.5,
+                        "reconnect-max-delay": 30,
+                        "budget-weight": 1,
+                        "budget-min-threads": 0,
                         "version": _configServer["version"],
                     }
 
@@ -218,6 +367,187 @@ def _parseConfig():
                             sc["max-threads"] = mt
                         except:
                             return InvalidConfigErr.format("services." + name + ".max-threads", "must be int"), {"type": "invalid_param"}
+                    if "min-threads" in opts:
+                        try:
+                            mt = int(opts["min-threads"])
+                            if mt < 0:
+                                return InvalidConfigErr.format("services." + name + ".min-threads", "must be positive or 0"), {"type": "invalid_param"}
+                            sc["min-threads"] = mt
+                        except:
+                            return InvalidConfigErr.format("services." + name + ".min-threads", "must be int"), {"type": "invalid_param"}
+                    if "thread-idle-timeout" in opts:
+                        try:
+                            it = float(opts["thread-idle-timeout"])
+                            if it <= 0:
+                                return InvalidConfigErr.format("services." + name + ".thread-idle-timeout", "must be positive"), {"type": "invalid_param"}
+                            sc["thread-idle-timeout"] = it
+                        except:
+                            return InvalidConfigErr.format("services." + name + ".thread-idle-timeout", "must be float"), {"type": "invalid_param"}
+                    if "mode" in opts:
+                        if opts["mode"] not in ["threads", "asyncio"]:
+                            return InvalidConfigErr.format("services." + name + ".mode", "must be one of [threads asyncio]"), {"type": "invalid_param"}
+                        if opts["mode"] == "asyncio" and AsyncService == None:
+                            return InvalidConfigErr.format("services." + name + ".mode", "asyncio requires python 3.5 or newer"), {"type": "invalid_param"}
+                        sc["mode"] = opts["mode"]
+                    if "max-tasks" in opts:
+                        try:
+                            mt = int(opts["max-tasks"])
+                            if mt < 1:
+                                return InvalidConfigErr.format("services." + name + ".max-tasks", "must be positive"), {"type": "invalid_param"}
+                            sc["max-tasks"] = mt
+                        except:
+                            return InvalidConfigErr.format("services." + name + ".max-tasks", "must be int"), {"type": "invalid_param"}
+                    if "batch-concurrency" in opts:
+                        try:
+                            bc = int(opts["batch-concurrency"])
+                            if bc < 1:
+                                return InvalidConfigErr.format("services." + name + ".batch-concurrency", "must be positive"), {"type": "invalid_param"}
+                            sc["batch-concurrency"] = bc
+                        except:
+                            return InvalidConfigErr.format("services." + name + ".batch-concurrency", "must be int"), {"type": "invalid_param"}
+                    if "min-pulls" in opts:
+                        try:
+                            mp = int(opts["min-pulls"])
+                            if mp < 1:
+                                return InvalidConfigErr.format("services." + name + ".min-pulls", "must be positive"), {"type": "invalid_param"}
+                            sc["min-pulls"] = mp
+                        except:
+                            return InvalidConfigErr.format("services." + name + ".min-pulls", "must be int"), {"type": "invalid_param"}
+                    if "max-pulls" in opts:
+                        try:
+                            mp = int(opts["max-pulls"])
+                            if mp < 1:
+                                return InvalidConfigErr.format("services." + name + ".max-pulls", "must be positive"), {"type": "invalid_param"}
+                            sc["max-pulls"] = mp
+                        except:
+                            return InvalidConfigErr.format("services." + name + ".max-pulls", "must be int"), {"type": "invalid_param"}
+                    if "pulls-scale-interval" in opts:
+                        try:
+                            it = float(opts["pulls-scale-interval"])
+                            if it <= 0:
+                                return InvalidConfigErr.format("services." + name + ".pulls-scale-interval", "must be positive"), {"type": "invalid_param"}
+                            sc["pulls-scale-interval"] = it
+                        except:
+                            return InvalidConfigErr.format("services." + name + ".pulls-scale-interval", "must be float"), {"type": "invalid_param"}
+                    if "adaptive-threads" in opts:
+                        try:
+                            sc["adaptive-threads"] = bool(opts["adaptive-threads"])
+                        except:
+                            return InvalidConfigErr.format("services." + name + ".adaptive-threads", "must be bool"), {"type": "invalid_param"}
+                    if "adaptive-min-threads" in opts:
+                        try:
+                            mt = int(opts["adaptive-min-threads"])
+                            if mt < 1:
+                                return InvalidConfigErr.format("services." + name + ".adaptive-min-threads", "must be positive"), {"type": "invalid_param"}
+                            sc["adaptive-min-threads"] = mt
+                        except:
+                            return InvalidConfigErr.format("services." + name + ".adaptive-min-threads", "must be int"), {"type": "invalid_param"}
+                    if "adaptive-interval" in opts:
+                        try:
+                            it = float(opts["adaptive-interval"])
+                            if it <= 0:
+                                return InvalidConfigErr.format("services." + name + ".adaptive-interval", "must be positive"), {"type": "invalid_param"}
+                            sc["adaptive-interval"] = it
+                        except:
+                            return InvalidConfigErr.format("services." + name + ".adaptive-interval", "must be float"), {"type": "invalid_param"}
+                    if "shed-target" in opts:
+                        try:
+                            st = float(opts["shed-target"])
+                            if st < 0:
+                                return InvalidConfigErr.format("services." + name + ".shed-target", "must be positive or 0"), {"type": "invalid_param"}
+                            sc["shed-target"] = st
+                        except:
+                            return InvalidConfigErr.format("services." + name + ".shed-target", "must be float"), {"type": "invalid_param"}
+                    if "shed-interval" in opts:
+                        try:
+                            si = float(opts["shed-interval"])
+                            if si <= 0:
+                                return InvalidConfigErr.format("services." + name + ".shed-interval", "must be positive"), {"type": "invalid_param"}
+                            sc["shed-interval"] = si
+                        except:
+                            return InvalidConfigErr.format("services." + name + ".shed-interval", "must be float"), {"type": "invalid_param"}
+                    if "priority-dispatch" in opts:
+                        try:
+                            sc["priority-dispatch"] = bool(opts["priority-dispatch"])
+                        except:
+                            return InvalidConfigErr.format("services." + name + ".priority-dispatch", "must be bool"), {"type": "invalid_param"}
+                    if "priority-aging" in opts:
+                        try:
+                            pa = float(opts["priority-aging"])
+                            if pa <= 0:
+                                return InvalidConfigErr.format("services." + name + ".priority-aging", "must be positive"), {"type": "invalid_param"}
+                            sc["priority-aging"] = pa
+                        except:
+                            return InvalidConfigErr.format("services." + name + ".priority-aging", "must be float"), {"type": "invalid_param"}
+                    if "priority-queue-size" in opts:
+                        try:
+                            pq = int(opts["priority-queue-size"])
+                            if pq < 0:
+                                return InvalidConfigErr.format("services." + name + ".priority-queue-size", "must be positive or 0"), {"type": "invalid_param"}
+                            sc["priority-queue-size"] = pq
+                        except:
+                            return InvalidConfigErr.format("services." + name + ".priority-queue-size", "must be int"), {"type": "invalid_param"}
+                    if "reply-senders" in opts:
+                        try:
+                            rs = int(opts["reply-senders"])
+                            if rs < 0:
+                                return InvalidConfigErr.format("services." + name + ".reply-senders", "must be positive or 0"), {"type": "invalid_param"}
+                            sc["reply-senders"] = rs
+                        except:
+                            return InvalidConfigErr.format("services." + name + ".reply-senders", "must be int"), {"type": "invalid_param"}
+                    if "reply-queue-size" in opts:
+                        try:
+                            rq = int(opts["reply-queue-size"])
+                            if rq <= 0:
+                                return InvalidConfigErr.format("services." + name + ".reply-queue-size", "must be positive"), {"type": "invalid_param"}
+                            sc["reply-queue-size"] = rq
+                        except:
+                            return InvalidConfigErr.format("services." + name + ".reply-queue-size", "must be int"), {"type": "invalid_param"}
+                    if "reply-batch-size" in opts:
+                        try:
+                            rb = int(opts["reply-batch-size"])
+                            if rb <= 0:
+                                return InvalidConfigErr.format("services." + name + ".reply-batch-size", "must be positive"), {"type": "invalid_param"}
+                            sc["reply-batch-size"] = rb
+                        except:
+                            return InvalidConfigErr.format("services." + name + ".reply-batch-size", "must be int"), {"type": "invalid_param"}
+                    if "reconnect" in opts:
+                        try:
+                            sc["reconnect"] = bool(opts["reconnect"])
+                        except:
+                            return InvalidConfigErr.format("services." + name + ".reconnect", "must be bool"), {"type": "invalid_param"}
+                    if "reconnect-min-delay" in opts:
+                        try:
+                            rd = float(opts["reconnect-min-delay"])
+                            if rd <= 0:
+                                return InvalidConfigErr.format("services." + name + ".reconnect-min-delay", "must be positive"), {"type": "invalid_param"}
+                            sc["reconnect-min-delay"] = rd
+                        except:
+                            return InvalidConfigErr.format("services." + name + ".reconnect-min-delay", "must be float"), {"type": "invalid_param"}
+                    if "reconnect-max-delay" in opts:
+                        try:
+                            rd = float(opts["reconnect-max-delay"])
+                            if rd <= 0:
+                                return InvalidConfigErr.format("services." + name + ".reconnect-max-delay", "must be positive"), {"type": "invalid_param"}
+                            sc["reconnect-max-delay"] = rd
+                        except:
+                            return InvalidConfigErr.format("services." + name + ".reconnect-max-delay", "must be float"), {"type": "invalid_param"}
+                    if "budget-weight" in opts:
+                        try:
+                            bw = float(opts["budget-weight"])
+                            if bw <= 0:
+                                return InvalidConfigErr.format("services." + name + ".budget-weight", "must be positive"), {"type": "invalid_param"}
+                            sc["budget-weight"] = bw
+                        except:
+                            return InvalidConfigErr.format("services." + name + ".budget-weight", "must be float"), {"type": "invalid_param"}
+                    if "budget-min-threads" in opts:
+                        try:
+                            bm = int(opts["budget-min-threads"])
+                            if bm < 0:
+                                return InvalidConfigErr.format("services." + name + ".budget-min-threads", "must be positive or 0"), {"type": "invalid_param"}
+                            sc["budget-min-threads"] = bm
+                        except:
+                            return InvalidConfigErr.format("services." + name + ".budget-min-threads", "must be int"), {"type": "invalid_param"}
                     if "version" in opts:
                         try:
                             sc["version"] = str(opts["version"])
@@ -229,6 +559,17 @@ def _parseConfig():
                 _config = d
                 _configParsed = True
 
+                if _configServer["log-file"] != "":
+                    if _configServer["log-file-max-size"] > 0 and _configServer["workers"] > 1:
+                        return InvalidConfigErr.format("server.log-file-max-size", "log file rotation is not supported with several workers"), {"type": "invalid_param"}
+                    try:
+                        setLogFile(_configServer["log-file"], _configServer["log-file-max-size"], _configServer["log-file-backups"])
+                    except Exception as e:
+                        return InvalidConfigErr.format("server.log-file", str(e)), {"type": "invalid_param"}
+                setLogTimeMillis(_configServer["log-time-ms"])
+                if _configServer["log-async"]:
+                    setAsyncOutput(True, _configServer["log-buffer"], _configServer["log-overflow"])
+
         except Exception as e:
             return "can't open config file ({0}): {1}".format(configFile, str(e)), {"type": "config_file"}
 
@@ -254,11 +595,17 @@ class ServerFromConfig(Server):
         self.pulls = _configServer["pulls"]
         self.pullTimeout = _configServer["pull-timeout"]
         self.maxThreads = _configServer["max-threads"]
+        self.minThreads = _configServer["min-threads"]
+        self.threadIdleTimeout = _configServer["thread-idle-timeout"]
         self.logLevel = _configServer["log-level"]
         self.statsPeriod = _configServer["stats-period"]
         self.gracefulExit = _configServer["graceful-exit"]
         self.testing = _configServer["testing"]
         self.version = _configServer["version"]
+        self.workers = _configServer["workers"]
+        self.threadBudget = _configServer["thread-budget"]
+        self.connections = _configServer["connections"]
+        self.reconnect = _configServer["reconnect"]
 
     def addService(self, name):
         global _configServer
@@ -268,7 +615,10 @@ class ServerFromConfig(Server):
             return None, err
 
         svc = _configServer["services"][name]
-        s = Service(self.url, svc["path"])
+        if svc["mode"] == "asyncio":
+            s = AsyncService(self.url, svc["path"], {"maxTasks": svc["max-tasks"]})
+        else:
+            s = Service(self.url, svc["path"])
 
         s.user = self.user
         s.password = self.password
@@ -281,6 +631,28 @@ class ServerFromConfig(Server):
         s.pulls = svc["pulls"]
         s.pullTimeout = svc["pull-timeout"]
         s.maxThreads = svc["max-threads"]
+        s.minThreads = svc["min-threads"]
+        s.threadIdleTimeout = svc["thread-idle-timeout"]
+        s.batchConcurrency = svc["batch-concurrency"]
+        s.minPulls = svc["min-pulls"]
+        s.maxPulls = svc["max-pulls"]
+        s.pullsScaleInterval = svc["pulls-scale-interval"]
+        s.adaptiveThreads = svc["adaptive-threads"]
+        s.adaptiveMinThreads = svc["adaptive-min-threads"]
+        s.adaptiveInterval = svc["adaptive-interval"]
+        s.shedTarget = svc["shed-target"]
+        s.shedInterval = svc["shed-interval"]
+        s.priorityDispatch = svc["priority-dispatch"]
+        s.priorityAging = svc["priority-aging"]
+        s.priorityQueueSize = svc["priority-queue-size"]
+        s.replySenders = svc["reply-senders"]
+        s.replyQueueSize = svc["reply-queue-size"]
+        s.replyBatchSize = svc["reply-batch-size"]
+        s.reconnect = svc["reconnect"]
+        s.reconnectMinDelay = svc["reconnect-min-delay"]
+        s.reconnectMaxDelay = max(svc["reconnect-max-delay"], svc["reconnect-min-delay"])
+        s.budgetWeight = svc["budget-weight"]
+        s.budgetMinThreads = svc["budget-min-threads"]
         s.version = svc["version"]
 
         self._services[name] = s
@@ -293,34 +665,74 @@ def newServiceFromConfig(name):
     except Exception as er:
         return None, str(er)
 
-class ServiceFromConfig(Service):
-    def __init__(self, name):
-        global _configServer
-        err, errM = _parseConfig()
-        if err != None:
-            logWithFields(ErrorLevel, "config", errM, err)
-            raise Exception(err)
+def _serviceConfig(name):
+    global _configServer
+    err, errM = _parseConfig()
+    if err != None:
+        logWithFields(ErrorLevel, "config", errM, err)
+        raise Exception(err)
 
-        if name not in _configServer["services"]:
-            err = MissingConfigErr.format("services."+name)
-            logWithFields(ErrorLevel, "config", {"type": "missing_param"}, err)
-            raise Exception(err)
+    if name not in _configServer["services"]:
+        err = MissingConfigErr.format("services."+name)
+        logWithFields(ErrorLevel, "config", {"type": "missing_param"}, err)
+        raise Exception(err)
 
-        svc = _configServer["services"][name]
+    return _configServer["services"][name]
+
+def _configureService(s, name, svc):
+    s.user = _configServer["user"]
+    s.password = _configServer["pass"]
+    s.statsPeriod = _configServer["stats-period"]
+    s.gracefulExit = _configServer["graceful-exit"]
+    s.logLevel = _configServer["log-level"]
+    s.testing = _configServer["testing"]
+    s.name = name
+    s.description = svc["description"]
+    s.pulls = svc["pulls"]
+    s.pullTimeout = svc["pull-timeout"]
+    s.maxThreads = svc["max-threads"]
+    s.minThreads = svc["min-threads"]
+    s.threadIdleTimeout = svc["thread-idle-timeout"]
+    s.batchConcurrency = svc["batch-concurrency"]
+    s.minPulls = svc["min-pulls"]
+    s.maxPulls = svc["max-pulls"]
+    s.pullsScaleInterval = svc["pulls-scale-interval"]
+    s.adaptiveThreads = svc["adaptive-threads"]
+    s.adaptiveMinThreads = svc["adaptive-min-threads"]
+    s.adaptiveInterval = svc["adaptive-interval"]
+    s.shedTarget = svc["shed-target"]
+    s.shedInterval = svc["shed-interval"]
+    s.priorityDispatch = svc["priority-dispatch"]
+    s.priorityAging = svc["priority-aging"]
+    s.priorityQueueSize = svc["priority-queue-size"]
+    s.replySenders = svc["reply-senders"]
+    s.replyQueueSize = svc["reply-queue-size"]
+    s.replyBatchSize = svc["reply-batch-size"]
+    s.reconnect = svc["reconnect"]
+    s.reconnectMinDelay = svc["reconnect-min-delay"]
+    s.reconnectMaxDelay = max(svc["reconnect-max-delay"], svc["reconnect-min-delay"])
+    s.budgetWeight = svc["budget-weight"]
+    s.budgetMinThreads = svc["budget-min-threads"]
+    s.version = svc["version"]
+
+class ServiceFromConfig(Service):
+    def __new__(cls, name):
+        # Services in asyncio mode are built as AsyncServiceFromConfig
+        if cls is ServiceFromConfig and AsyncService != None and _serviceConfig(name)["mode"] == "asyncio":
+            return AsyncServiceFromConfig(name)
+        return super(ServiceFromConfig, cls).__new__(cls)
+
+    def __init__(self, name):
+        svc = _serviceConfig(name)
         super(ServiceFromConfig, self).__init__(_configServer["url"], svc["path"])
+        _configureService(self, name, svc)
 
-        self.user = _configServer["user"]
-        self.password = _configServer["pass"]
-        self.statsPeriod = _configServer["stats-period"]
-        self.gracefulExit = _configServer["graceful-exit"]
-        self.logLevel = _configServer["log-level"]
-        self.testing = _configServer["testing"]
-        self.name = name
-        self.description = svc["description"]
-        self.pulls = svc["pulls"]
-        self.pullTimeout = svc["pull-timeout"]
-        self.maxThreads = svc["max-threads"]
-        self.version = svc["version"]
+if AsyncService != None:
+    class AsyncServiceFromConfig(AsyncService):
+        def __init__(self, name):
+            svc = _serviceConfig(name)
+            super(AsyncServiceFromConfig, self).__init__(_configServer["url"], svc["path"], {"maxTasks": svc["max-tasks"]})
+            _configureService(self, name, svc)
 
 def getConfig():
     err, errM = _parseConfig()
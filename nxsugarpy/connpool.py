@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+#    nxsugarpy, a Python library for building nexus services with python
+#    Copyright (C) 2016 by the nxsugarpy team
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Lesser General Public License as published
+#    by the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU Lesser General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+
+import pynexus as nxpy
+import threading
+
+from nxsugarpy.log import *
+from nxsugarpy.errors import *
+from nxsugarpy.stats import monotonicTime
+
+def connDead(conn, err=None, timeout=5):
+    # pynexus cancels a connection for good once any of its workers fails, and
+    # from then on every request on it fails with ErrConnClosed. Any other
+    # error is told apart by whether the connection still answers a ping
+    if err != None and isNexusErrCode(err, ErrConnClosed):
+        return True
+    return conn.ping(timeout) != None
+
+class ConnPool(object):
+    # Connections to nexus shared by the services of a server, so pulls and
+    # replies are spread over several sockets and reader threads, and over
+    # several nexus nodes when there are many endpoints. Dead ones are dialed
+    # again by whoever finds out first, failing over to another node while
+    # theirs is down
+    def __init__(self, endpoints, size, downFor=5):
+        self.endpoints = endpoints
+        self.size = max(size, 1)
+        self.downFor = downFor
+        self.replaced = 0
+        self.onDown = None
+        self.onUp = None
+        self._down = False
+        self._lock = threading.Lock()
+        self._dialLock = threading.Lock()
+        self._conns = []
+        self._connEndpoints = []
+        self._dead = set()
+        self._downUntil = [0] * len(endpoints)
+        self._closed = False
+
+    def dial(self):
+        for slot in range(self.size):
+            conn, e, errs = self._dialAny(slot)
+            if errs != None:
+                self.close()
+                return errs
+            with self._lock:
+                self._conns.append(conn)
+                self._connEndpoints.append(e)
+        return None
+
+    def _dialAny(self, slot):
+        # Tries the slot's own endpoint first and then the next ones, leaving
+        # the ones that failed lately for last
+        n = len(self.endpoints)
+        now = monotonicTime()
+        order = [(slot + k) % n for k in range(n)]
+        order = [e for e in order if self._downUntil[e] <= now] + [e for e in order if self._downUntil[e] > now]
+        errs = None
+        for e in order:
+            conn, errs = self._dial(e)
+            if errs == None:
+                self._downUntil[e] = 0
+                return conn, e, None
+            self._downUntil[e] = monotonicTime() + self.downFor
+        return None, -1, errs
+
+    def _dial(self, e):
+        connurl, showurl = self.endpoints[e]
+        try:
+            conn = nxpy.Client(connurl)
+        except Exception as ex:
+            errs = "can't connect to nexus server ({0}): {1}".format(showurl, str(ex))
+            logWithFields(ErrorLevel, "server", {"type": "connection_error"}, errs)
+            return None, errs
+        if not conn.is_version_compatible:
+            logWithFields(WarnLevel, "server", {"type": "incompatible_version"}, "connecting to an incompatible version of nexus at ({0}): client ({1}) server ({2})", showurl, nxpy.__version__, conn.nexus_version)
+        if not conn.is_logged:
+            errs = "can't login to nexus server ({0}) as ({1}): {2}".format(showurl, conn.username, errToStr(conn.login_error))
+            logWithFields(ErrorLevel, "server", {"type": "login_error"}, errs)
+            conn.close()
+            return None, errs
+        return conn, None
+
+    def conn(self, i):
+        with self._lock:
+            return self._conns[i % len(self._conns)]
+
+    def replace(self, i, dead):
+        # Returns the connection to use instead of dead and whether it was just
+        # dialed, as someone else may have replaced it already
+        with self._dialLock:
+            with self._lock:
+                if self._closed:
+                    return None, False, "connection pool closed"
+                slot = i % len(self._conns)
+                current = self._conns[slot]
+                if current is dead:
+                    # Its node failed the keepalive pings or dropped us, try the others first
+                    self._downUntil[self._connEndpoints[slot]] = monotonicTime() + self.downFor
+                    self._dead.add(dead)
+                if current not in self._dead:
+                    return current, False, None
+            if not self._down:
+                self._down = True
+                if self.onDown != None:
+                    self.onDown()
+            conn, e, errs = self._dialAny(slot)
+            if errs != None:
+                return None, False, errs
+            with self._lock:
+                if self._closed:
+                    conn.close()
+                    return None, False, "connection pool closed"
+                self._conns[slot] = conn
+                self._connEndpoints[slot] = e
+                self._dead.discard(current)
+                self.replaced += 1
+            if self.alive() == self.size:
+                self._down = False
+                if self.onUp != None:
+                    self.onUp()
+        current.close()
+        dead.close()
+        return conn, True, None
+
+    def discard(self, i, dead):
+        # Closes a connection that failed and couldn't be replaced, leaving the
+        # rest of the pool to the other pullers. Whoever uses its slot next
+        # dials it again
+        with self._lock:
+            if not self._closed and self._conns[i % len(self._conns)] is dead:
+                self._downUntil[self._connEndpoints[i % len(self._conns)]] = monotonicTime() + self.downFor
+                self._dead.add(dead)
+        dead.close()
+
+    def alive(self):
+        with self._lock:
+            return len([conn for conn in self._conns if conn not in self._dead])
+
+    def health(self):
+        # Returns how many live connections each endpoint has, and whether it is marked down
+        now = monotonicTime()
+        with self._lock:
+            r = {}
+            for e, (_, showurl) in enumerate(self.endpoints):
+                r[showurl] = {"conns": 0, "down": self._downUntil[e] > now}
+            for conn, e in zip(self._conns, self._connEndpoints):
+                if conn not in self._dead:
+                    r[self.endpoints[e][1]]["conns"] += 1
+            return r
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            conns = list(self._conns)
+        for conn in conns:
+            conn.close()
@@ -41,6 +41,8 @@ ErrNotSupported             = -32099
 # nxsugar errors
 ErrTestingMethodNotProvided = 20000
 ErrPactNotDefined           = 20001
+ErrBusy                     = 20002
+ErrOverloaded               = 20003
 
 #
 ErrStr = {
@@ -66,6 +68,8 @@ ErrStr = {
     # nxsugar errors
     ErrTestingMethodNotProvided: "Testing method not provided",
     ErrPactNotDefined:           "Pact not defined for provided input",
+    ErrBusy:                     "Method is busy, try again later",
+    ErrOverloaded:               "Service is overloaded, try again later",
 }
 
 def newJsonRpcErr(code, message="", data=None):
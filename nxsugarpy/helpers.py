@@ -76,3 +76,18 @@ def parseNexusUrl(url, user="", password=""):
         else:
             port = 1717
     return scheme, user, password, host, port
+
+def nexusEndpoints(url, user="", password=""):
+    # The url can be a list of nexus urls or a comma separated string of them.
+    # Returns the user, the password and the (connurl, showurl) of each endpoint
+    if isinstance(url, (list, tuple)):
+        urls = list(url)
+    else:
+        urls = [u.strip() for u in url.split(",") if u.strip() != ""]
+    if len(urls) == 0:
+        urls = [""]
+    endpoints = []
+    for u in urls:
+        scheme, user, password, host, port = parseNexusUrl(u, user, password)
+        endpoints.append(("{0}://{1}:{2}@{3}:{4}".format(scheme, user, password, host, port), "{0}://{1}:{2}".format(scheme, host, port)))
+    return user, password, endpoints
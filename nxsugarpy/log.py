@@ -20,9 +20,23 @@
 ##############################################################################
 
 from __future__ import print_function
+import os
 import sys
-import strict_rfc3339
+import time
+import atexit
+import threading
 import json
+import math
+import random
+from collections import deque
+
+try:
+    import orjson as _fastjson
+except ImportError:
+    try:
+        import ujson as _fastjson
+    except ImportError:
+        _fastjson = None
 
 PanicLevel  = "panic"
 FatalLevel  = "fatal"
@@ -31,12 +45,234 @@ WarnLevel   = "warn"
 InfoLevel   = "info"
 DebugLevel  = "debug"
 
+OverflowDrop  = "drop"
+OverflowBlock = "block"
+
+_levelNums = {
+    PanicLevel: 5,
+    FatalLevel: 4,
+    ErrorLevel: 3,
+    WarnLevel:  2,
+    InfoLevel:  1,
+    DebugLevel: 0,
+}
+
 _jsonEnabled = False
 _level = 0
+_prefixes = {}
+_tsCache = (None, "", None, "")
+_tsMillis = False
+_file = None
+_writer = None
 
 def _eprint(*args, **kwargs):
     print(*args, file=sys.stderr, **kwargs)
 
+def _output(line):
+    if _writer != None:
+        _writer.write(line + "\n")
+    elif _file != None:
+        _file.write(line + "\n")
+    else:
+        print(line, file=sys.stderr)
+
+class _RotatingFile(object):
+    def __init__(self, path, maxSize=0, backups=3):
+        self.path = path
+        self.maxSize = maxSize
+        self.backups = backups
+        self._lock = threading.Lock()
+        self._f = open(path, "a")
+        self._size = self._f.tell()
+
+    def write(self, data):
+        # Nothing is left buffered once the lock is released, so forks can't copy it
+        with self._lock:
+            if self.maxSize > 0 and self._size > 0 and self._size + len(data) > self.maxSize:
+                self._rotate()
+            self._f.write(data)
+            self._f.flush()
+            self._size += len(data)
+
+    def flush(self):
+        with self._lock:
+            self._f.flush()
+
+    def close(self):
+        with self._lock:
+            self._f.close()
+
+    def _reopenAfterFork(self):
+        # The lock was held across the fork, so the child takes a new one and
+        # its own file handle
+        self._lock = threading.Lock()
+        self._f.close()
+        self._f = open(self.path, "a")
+        self._size = self._f.tell()
+
+    def _rotate(self):
+        self._f.close()
+        if self.backups > 0:
+            for i in range(self.backups - 1, 0, -1):
+                src = "{0}.{1}".format(self.path, i)
+                if os.path.exists(src):
+                    os.rename(src, "{0}.{1}".format(self.path, i + 1))
+            os.rename(self.path, self.path + ".1")
+            self._f = open(self.path, "a")
+        else:
+            self._f = open(self.path, "w")
+        self._size = 0
+
+class _StderrOut(object):
+    def write(self, data):
+        sys.stderr.write(data)
+
+    def flush(self):
+        sys.stderr.flush()
+
+# Lines are queued in a bounded buffer and written in large chunks by a
+# background thread, so a slow consumer doesn't stall the caller
+class _AsyncWriter(object):
+    def __init__(self, out, bufferSize=8192, overflow=OverflowDrop):
+        self.out = out
+        self.bufferSize = bufferSize
+        self.overflow = overflow
+        self.dropped = 0
+        self._reported = 0
+        self._buf = deque()
+        self._cond = threading.Condition()
+        self._writing = False
+        self._closed = False
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def write(self, line):
+        with self._cond:
+            if len(self._buf) >= self.bufferSize:
+                if self.overflow != OverflowBlock:
+                    self.dropped += 1
+                    return
+                while len(self._buf) >= self.bufferSize and not self._closed:
+                    self._cond.wait()
+            self._buf.append(line)
+            if len(self._buf) == 1:
+                self._cond.notify_all()
+
+    def flush(self, timeout=None):
+        with self._cond:
+            self._cond.notify_all()
+            if timeout == None:
+                while len(self._buf) > 0 or self._writing:
+                    self._cond.wait()
+            else:
+                end = time.time() + timeout
+                while len(self._buf) > 0 or self._writing:
+                    left = end - time.time()
+                    if left <= 0:
+                        return False
+                    self._cond.wait(left)
+        return True
+
+    def close(self, timeout=None):
+        self.flush(timeout)
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join(timeout)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while len(self._buf) == 0 and not self._closed:
+                    self._cond.wait()
+                if len(self._buf) == 0 and self._closed:
+                    return
+                chunk = "".join(self._buf)
+                self._buf.clear()
+                dropped = self.dropped - self._reported
+                self._reported = self.dropped
+                self._writing = True
+                self._cond.notify_all()
+            if dropped > 0:
+                chunk += _encode(WarnLevel, "log", {"type": "log_drops", "dropped": dropped}, "dropped {0} log lines: log buffer is full".format(dropped)) + "\n"
+            try:
+                self.out.write(chunk)
+                self.out.flush()
+            except Exception:
+                pass
+            with self._cond:
+                self._writing = False
+                self._cond.notify_all()
+
+def setLogFile(path, maxSize=0, backups=3):
+    global _file
+    flushLog()
+    old = _file
+    if path == None or path == "":
+        _file = None
+    else:
+        _file = _RotatingFile(path, maxSize, backups)
+    if _writer != None:
+        _writer.out = _logOut()
+    if old != None:
+        old.close()
+
+def setAsyncOutput(enabled, bufferSize=8192, overflow=OverflowDrop):
+    global _writer
+    old = _writer
+    if enabled:
+        _writer = _AsyncWriter(_logOut(), bufferSize, overflow)
+    else:
+        _writer = None
+    if old != None:
+        old.close(5)
+
+def flushLog(timeout=None):
+    if _writer != None:
+        return _writer.flush(timeout)
+    if _file != None:
+        _file.flush()
+    return True
+
+def getLogDrops():
+    if _writer != None:
+        return _writer.dropped
+    return 0
+
+def _logOut():
+    if _file != None:
+        return _file
+    return _StderrOut()
+
+_forkFile = None
+
+def _lockFileForFork():
+    # Keeps other threads from writing to the log file while forking
+    global _forkFile
+    _forkFile = _file
+    if _forkFile != None:
+        _forkFile._lock.acquire()
+
+def _unlockFileAfterFork():
+    if _forkFile != None:
+        _forkFile._lock.release()
+
+def _restartAfterFork():
+    # The writer thread doesn't survive a fork, so children get their own
+    global _writer
+    if _forkFile != None:
+        _forkFile._reopenAfterFork()
+    if _writer != None:
+        _writer = _AsyncWriter(_logOut(), _writer.bufferSize, _writer.overflow)
+
+def logFileRotates():
+    return _file != None and _file.maxSize > 0
+
+atexit.register(flushLog, 5)
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(before=_lockFileForFork, after_in_parent=_unlockFileAfterFork, after_in_child=_restartAfterFork)
+
 def setJSONOutput(enabled):
     global _jsonEnabled
     if enabled:
@@ -44,23 +280,17 @@ def setJSONOutput(enabled):
     else:
         _jsonEnabled = False
 
+def setLogTimeMillis(enabled):
+    global _tsMillis, _tsCache
+    _tsMillis = bool(enabled)
+    _tsCache = (None, "", None, "")
+
 def setLogLevel(level):
     global _level
     _level = _getLogLevelNum(level)
 
 def _getLogLevelNum(level):
-    if level == PanicLevel:
-        return 5
-    elif level == FatalLevel:
-        return 4
-    elif level == ErrorLevel:
-        return 3
-    elif level == WarnLevel:
-        return 2
-    elif level == InfoLevel:
-        return 1
-    else:
-        return 0
+    return _levelNums.get(level, 0)
 
 def getLogLevel():
     if _level == 5:
@@ -76,18 +306,127 @@ def getLogLevel():
     else:
         return DebugLevel
 
+def isLogLevelEnabled(level):
+    return _level <= _levelNums.get(level, 0)
+
+# Decides which lines of a repeated kind get logged: keeps 1 in every N
+# lines and/or a random fraction of them, and then limits what's left with a
+# token bucket per key, counting the lines it suppresses
+class LogSampler(object):
+    def __init__(self, every=1, rate=1.0, limit=0, burst=0):
+        if every < 1:
+            every = 1
+        if rate > 1:
+            rate = 1.0
+        if limit < 0:
+            limit = 0
+        if burst < 1:
+            burst = max(1, int(math.ceil(limit)))
+        self.every = every
+        self.rate = rate
+        self.limit = limit
+        self.burst = burst
+        self._lock = threading.Lock()
+        self._seen = {}
+        self._buckets = {}
+        self._passthrough = every == 1 and rate >= 1 and limit == 0
+
+    def allow(self, key):
+        if self._passthrough:
+            return True, 0
+        with self._lock:
+            if self.every > 1:
+                seen = self._seen.get(key, 0)
+                self._seen[key] = seen + 1
+                if seen % self.every != 0:
+                    return False, 0
+            if self.rate < 1 and random.random() >= self.rate:
+                return False, 0
+            if self.limit == 0:
+                return True, 0
+            now = time.time()
+            bucket = self._buckets.get(key)
+            if bucket == None:
+                bucket = [float(self.burst), now, 0]
+                self._buckets[key] = bucket
+            bucket[0] = min(float(self.burst), bucket[0] + (now - bucket[1]) * self.limit)
+            bucket[1] = now
+            if bucket[0] < 1:
+                bucket[2] += 1
+                return False, 0
+            bucket[0] -= 1
+            suppressed = bucket[2]
+            bucket[2] = 0
+            return True, suppressed
+
+    def takeSuppressed(self):
+        suppressed = {}
+        with self._lock:
+            for key, bucket in self._buckets.items():
+                if bucket[2] > 0:
+                    suppressed[key] = bucket[2]
+                    bucket[2] = 0
+        return suppressed
+
 def log(level, path, message, *args, **kwargs):
     logWithFields(level, path, {}, message, *args, **kwargs)
 
 def logWithFields(level, path, fields, message, *args, **kwargs):
-    if _level <= _getLogLevelNum(level):
+    if _level <= _levelNums.get(level, 0):
         try:
             msg = message.format(*args, **kwargs)
         except:
             msg = "<invalid format> msg[ {0} ] args[ {1} ] kwargs[ {2} ]".format(message, args, kwargs)
+        _output(_encode(level, path, fields, msg))
+
+def _encode(level, path, fields, msg):
+    # The constant part of a line is built once per level and path
+    key = (_jsonEnabled, level, path)
+    prefix = _prefixes.get(key)
+    if prefix == None:
         if _jsonEnabled:
-            jsonData = json.dumps(fields)
-            print('{"time": "' + strict_rfc3339.now_to_rfc3339_utcoffset() + '", "level": "' + level + '", "path": "' + path + '", "msg": "' + msg + '", "data": ' + jsonData + '}', file=sys.stderr)
+            prefix = '","level":' + _dumps(level) + ',"path":' + _dumps(path) + ',"msg":'
         else:
-            level = level[:4].upper()
-            print('''[{time}] [{level}] [{path}] {message}'''.format(time=strict_rfc3339.now_to_rfc3339_utcoffset(), level=level, path=path, message=msg), file=sys.stderr)
+            prefix = "] [" + level[:4].upper() + "] [" + path + "] "
+        _prefixes[key] = prefix
+    if _jsonEnabled:
+        return '{"time":"' + _timestamp() + prefix + _dumps(msg) + ',"data":' + _dumps(fields) + '}'
+    return "[" + _timestamp() + prefix + msg
+
+def _dumps(obj):
+    if _fastjson != None:
+        try:
+            data = _fastjson.dumps(obj)
+            if isinstance(data, bytes):
+                data = data.decode("utf-8")
+            return data
+        except Exception:
+            pass
+    return json.dumps(obj, separators=(",", ":"), default=str)
+
+def _timestamp():
+    # Formatting a timestamp is expensive, so it is reused within the same second
+    # (or millisecond when sub-second precision is enabled)
+    global _tsCache
+    now = time.time()
+    if _tsMillis:
+        tick = int(now * 1000)
+    else:
+        tick = int(now)
+    cache = _tsCache
+    if cache[0] == tick:
+        return cache[1]
+    if _tsMillis:
+        sec = tick // 1000
+    else:
+        sec = tick
+    if cache[2] == sec:
+        prefix = cache[3]
+    else:
+        prefix = time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(sec))
+    if _tsMillis:
+        ts = "{0}.{1:03d}Z".format(prefix, tick % 1000)
+    else:
+        ts = prefix + "Z"
+    _tsCache = (tick, ts, sec, prefix)
+    return ts
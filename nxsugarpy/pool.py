@@ -0,0 +1,586 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+#    nxsugarpy, a Python library for building nexus services with python
+#    Copyright (C) 2016 by the nxsugarpy team
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Lesser General Public License as published
+#    by the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU Lesser General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+
+from __future__ import absolute_import
+import heapq
+import math
+import multiprocessing
+import pickle
+import signal
+import threading
+import traceback
+
+from nxsugarpy.log import *
+from nxsugarpy.stats import monotonicTime
+from collections import deque
+
+try:
+    from Queue import Queue, Empty, Full
+except ImportError:
+    from queue import Queue, Empty, Full
+
+BulkheadRun, BulkheadQueued, BulkheadBusy = range(3)
+
+class WorkerPool(object):
+    def __init__(self, maxWorkers, minWorkers=None, idleTimeout=60):
+        if maxWorkers < 1:
+            maxWorkers = 1
+        if minWorkers == None or minWorkers > maxWorkers:
+            minWorkers = maxWorkers
+        if minWorkers < 0:
+            minWorkers = 0
+        self.maxWorkers = maxWorkers
+        self.minWorkers = minWorkers
+        self.idleTimeout = idleTimeout
+
+        # Every submitted task owns a slot, so the hand-off queue never holds
+        # more than maxWorkers items and put() never blocks. The number of
+        # slots can be lowered below maxWorkers at runtime with setLimit()
+        self._limit = maxWorkers
+        self._used = 0
+        self._peak = 0
+        self._budget = None
+        self._slotsCond = threading.Condition(threading.Lock())
+        self._queue = Queue(maxWorkers)
+        self._lock = threading.Lock()
+        self._pendingCond = threading.Condition(self._lock)
+        self._workers = 0
+        self._idle = 0
+        self._pending = 0
+        self._closed = False
+
+    def start(self):
+        with self._lock:
+            n = self.minWorkers - self._workers
+            self._workers += max(n, 0)
+        for _ in range(n):
+            self._spawn(False)
+
+    def setBudget(self, budget):
+        # Slots must also be granted by a share of a budget other pools draw from
+        self._budget = budget
+
+    def acquire(self):
+        with self._slotsCond:
+            while self._used >= self._limit:
+                self._slotsCond.wait()
+            self._take()
+        if self._budget != None:
+            self._budget.acquire()
+
+    def tryAcquire(self):
+        with self._slotsCond:
+            if self._used >= self._limit:
+                return False
+            self._take()
+        if self._budget != None and not self._budget.tryAcquire():
+            self._giveBack()
+            return False
+        return True
+
+    def release(self):
+        if self._budget != None:
+            self._budget.release()
+        self._giveBack()
+
+    def _giveBack(self):
+        with self._slotsCond:
+            self._used -= 1
+            self._slotsCond.notify()
+
+    def _take(self):
+        self._used += 1
+        if self._used > self._peak:
+            self._peak = self._used
+
+    def limit(self):
+        with self._slotsCond:
+            return self._limit
+
+    def setLimit(self, limit):
+        limit = max(min(limit, self.maxWorkers), 1)
+        with self._slotsCond:
+            self._limit = limit
+            self._slotsCond.notify_all()
+        return limit
+
+    def takePeak(self):
+        # Returns the most slots used at once since the last call
+        with self._slotsCond:
+            peak = self._peak
+            self._peak = self._used
+            return peak
+
+    def submit(self, f, *args):
+        with self._lock:
+            self._pending += 1
+            spawn = False
+            if self._idle > 0:
+                self._idle -= 1
+            elif self._workers < self.maxWorkers:
+                self._workers += 1
+                spawn = True
+        if spawn:
+            self._spawn(True)
+        self._queue.put((f, args))
+
+    def pending(self):
+        with self._lock:
+            return self._pending
+
+    def workers(self):
+        with self._lock:
+            return self._workers
+
+    def wait(self):
+        with self._pendingCond:
+            while self._pending > 0:
+                self._pendingCond.wait()
+
+    def shutdown(self):
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            n = self._workers
+        for _ in range(n):
+            try:
+                self._queue.put_nowait((None, None))
+            except Full:
+                break
+
+    def _spawn(self, reserved):
+        worker = threading.Thread(target=self._run, args=(reserved,))
+        worker.daemon = True
+        worker.start()
+
+    def _run(self, reserved):
+        timeout = None
+        if self.minWorkers < self.maxWorkers and self.idleTimeout > 0:
+            timeout = self.idleTimeout
+        while True:
+            if not reserved:
+                with self._lock:
+                    self._idle += 1
+            reserved = True
+            try:
+                f, args = self._queue.get(block=True, timeout=timeout)
+            except Empty:
+                # Reap this worker only if there are more idle workers than queued tasks
+                with self._lock:
+                    if self._idle > 0 and self._workers > self.minWorkers:
+                        self._idle -= 1
+                        self._workers -= 1
+                        return
+                continue
+            reserved = False
+            if f == None:
+                with self._lock:
+                    self._workers -= 1
+                return
+            try:
+                f(*args)
+            except Exception:
+                log(ErrorLevel, "pool", "panic running worker task: {0}", traceback.format_exc())
+            with self._pendingCond:
+                self._pending -= 1
+                if self._pending == 0:
+                    self._pendingCond.notify_all()
+
+class AdaptiveLimit(object):
+    # AIMD on the worker limit: while the pool is saturated and handlers run
+    # about as fast as the best seen, grow the limit (doubling it until the
+    # first backoff, then by one); when they slow down past tolerance, shrink
+    # it by backoff. Latency is compared per method against its own baseline
+    # so the traffic mix doesn't skew the gradient
+    def __init__(self, minLimit, maxLimit, tolerance=2.0, backoff=0.9):
+        if maxLimit < 1:
+            maxLimit = 1
+        if minLimit < 1 or minLimit > maxLimit:
+            minLimit = 1
+        self.minLimit = minLimit
+        self.maxLimit = maxLimit
+        self.tolerance = tolerance
+        self.backoff = backoff
+        self.limit = minLimit
+        self.gradient = 1.0
+        self._slowStart = True
+        self._lock = threading.Lock()
+        self._samples = {}
+        self._baselines = {}
+
+    def sample(self, name, secs):
+        with self._lock:
+            s = self._samples.get(name)
+            if s == None:
+                self._samples[name] = [1, secs]
+            else:
+                s[0] += 1
+                s[1] += secs
+
+    def update(self, peak):
+        # Returns the new limit given the most workers used at once since the last update
+        with self._lock:
+            samples = self._samples
+            self._samples = {}
+        count = 0
+        weighted = 0.0
+        for name, (n, total) in samples.items():
+            avg = total / n
+            baseline = self._baselines.get(name)
+            if baseline == None or avg < baseline:
+                baseline = avg
+            else:
+                # Let the baseline follow slow workload changes
+                baseline += (avg - baseline) * 0.01
+            self._baselines[name] = baseline
+            if baseline > 0:
+                weighted += n * avg / baseline
+            else:
+                weighted += n
+            count += n
+        if count == 0:
+            return self.limit
+        self.gradient = weighted / count
+        if self.gradient > self.tolerance:
+            self._slowStart = False
+            self.limit = max(min(int(self.limit * self.backoff), self.limit - 1), self.minLimit)
+        elif peak >= self.limit:
+            if self._slowStart:
+                self.limit = min(self.limit * 2, self.maxLimit)
+            else:
+                self.limit = min(self.limit + 1, self.maxLimit)
+        return self.limit
+
+class CoDel(object):
+    # CoDel-style admission control: once the mean time tasks waited for a
+    # worker stays above target for a whole interval, waiting tasks are shed at a
+    # rate that grows with the square root of the shed count, until an interval
+    # ends with the mean wait back under target
+    def __init__(self, target, interval=0.1):
+        self.target = target
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._waits = 0.0
+        self._samples = 0
+        self._intervalEnd = None
+        self._dropping = False
+        self._dropNext = 0
+        self._count = 0
+
+    def observe(self, wait, now):
+        with self._lock:
+            if self._intervalEnd != None and now >= self._intervalEnd + self.interval:
+                # Nothing waited for a worker in a whole interval, start afresh
+                self._waits = 0.0
+                self._samples = 0
+                self._intervalEnd = None
+                self._dropping = False
+            self._waits += wait
+            self._samples += 1
+            if self._intervalEnd == None:
+                self._intervalEnd = now + self.interval
+            if now < self._intervalEnd:
+                return
+            above = self._waits / self._samples >= self.target
+            self._waits = 0.0
+            self._samples = 0
+            self._intervalEnd = now + self.interval
+            if not above:
+                self._dropping = False
+                return
+            if not self._dropping:
+                self._dropping = True
+                # Pick up near the last shed rate if we stopped shedding only recently
+                if self._count > 2 and now - self._dropNext < 16 * self.interval:
+                    self._count -= 2
+                else:
+                    self._count = 0
+                self._dropNext = now
+
+    def admit(self, now):
+        with self._lock:
+            if not self._dropping or now < self._dropNext:
+                return True
+            self._count += 1
+            self._dropNext = now + self.interval / math.sqrt(self._count)
+            return False
+
+    def shedding(self):
+        with self._lock:
+            return self._dropping
+
+class ThreadBudget(object):
+    # Worker slots shared by the services of a server. A service below its
+    # minimum gets the next free slot, and the rest go to whichever services
+    # need them, split by weight among the ones waiting for a slot
+    def __init__(self, total):
+        self.total = max(total, 1)
+        self._cond = threading.Condition(threading.Lock())
+        self._shares = []
+
+    def share(self, name, weight=1, minimum=0):
+        with self._cond:
+            reserved = sum(s.minimum for s in self._shares)
+            share = BudgetShare(self, name, weight, max(min(minimum, self.total - reserved), 0))
+            self._shares.append(share)
+            return share
+
+    def _remove(self, share):
+        with self._cond:
+            if share in self._shares:
+                self._shares.remove(share)
+            self._cond.notify_all()
+
+    def _canTake(self, share):
+        used = 0
+        reserved = 0
+        waitingWeight = share.weight
+        for s in self._shares:
+            used += s.used
+            if s is not share and s.waiting > 0:
+                reserved += max(s.minimum - s.used, 0)
+                waitingWeight += s.weight
+        if used >= self.total:
+            return False
+        if share.used < share.minimum:
+            return True
+        # Free slots go first to the services waiting below their minimum
+        if used + reserved >= self.total:
+            return False
+        # While other services wait for a slot, don't go over our weighted part of it
+        if waitingWeight > share.weight and share.used >= self.total * share.weight / float(waitingWeight):
+            return False
+        return True
+
+    def _acquire(self, share, block):
+        with self._cond:
+            if not self._canTake(share):
+                if not block:
+                    return False
+                share.waiting += 1
+                while not self._canTake(share):
+                    self._cond.wait()
+                share.waiting -= 1
+            share.used += 1
+            return True
+
+    def _release(self, share):
+        with self._cond:
+            share.used -= 1
+            self._cond.notify_all()
+
+class BudgetShare(object):
+    def __init__(self, budget, name, weight, minimum):
+        self.budget = budget
+        self.name = name
+        self.weight = weight
+        self.minimum = minimum
+        self.used = 0
+        self.waiting = 0
+
+    def acquire(self):
+        self.budget._acquire(self, True)
+
+    def tryAcquire(self):
+        return self.budget._acquire(self, False)
+
+    def release(self):
+        self.budget._release(self)
+
+    def close(self):
+        self.budget._remove(self)
+
+class DispatchQueue(object):
+    # Hands tasks waiting for a worker out by priority, higher first. Waiting
+    # aging seconds is worth one priority level, so low priority tasks still
+    # get their turn under a steady stream of higher priority ones
+    def __init__(self, maxSize=0, aging=1.0):
+        self.maxSize = maxSize
+        self.aging = aging
+        self._cond = threading.Condition(threading.Lock())
+        self._heap = []
+        self._seq = 0
+        self._unfinished = 0
+        self._closed = False
+
+    def put(self, item, priority, block=True):
+        with self._cond:
+            while block and self.maxSize > 0 and len(self._heap) >= self.maxSize and not self._closed:
+                self._cond.wait()
+            heapq.heappush(self._heap, (monotonicTime() - priority * self.aging, self._seq, item))
+            self._seq += 1
+            self._unfinished += 1
+            self._cond.notify_all()
+
+    def get(self):
+        # Returns None once the queue is closed and drained
+        with self._cond:
+            while len(self._heap) == 0 and not self._closed:
+                self._cond.wait()
+            if len(self._heap) == 0:
+                return None
+            item = heapq.heappop(self._heap)[2]
+            self._cond.notify_all()
+            return item
+
+    def waitItem(self):
+        # Waits until there is an item to get, returns False once the queue is closed and drained
+        with self._cond:
+            while len(self._heap) == 0 and not self._closed:
+                self._cond.wait()
+            return len(self._heap) > 0
+
+    def taskDone(self):
+        with self._cond:
+            self._unfinished -= 1
+            self._cond.notify_all()
+
+    def join(self):
+        # Waits until every item put has been taken and handed over
+        with self._cond:
+            while self._unfinished > 0:
+                self._cond.wait()
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    def __len__(self):
+        with self._cond:
+            return len(self._heap)
+
+class Bulkhead(object):
+    # Caps how many tasks of one method run at once. Tasks over the cap wait
+    # in the bulkhead's own queue (holding no worker) and are handed over to
+    # the worker of a finishing task, or are turned down when queueing is off
+    # or maxQueued are already waiting, so nexus keeps the rest
+    def __init__(self, maxConcurrent, queue=True, maxQueued=0):
+        if maxConcurrent < 1:
+            maxConcurrent = 1
+        if maxQueued <= 0:
+            maxQueued = maxConcurrent
+        self.maxConcurrent = maxConcurrent
+        self.queue = queue
+        self.maxQueued = maxQueued
+        self._lock = threading.Lock()
+        self._running = 0
+        self._queued = deque()
+
+    def enter(self, item):
+        with self._lock:
+            if self._running < self.maxConcurrent:
+                self._running += 1
+                return BulkheadRun
+            if not self.queue or len(self._queued) >= self.maxQueued:
+                return BulkheadBusy
+            self._queued.append(item)
+            return BulkheadQueued
+
+    def tryEnter(self):
+        # Takes a running slot only if one is free, never queueing
+        with self._lock:
+            if self._running < self.maxConcurrent:
+                self._running += 1
+                return True
+            return False
+
+    def leave(self):
+        # Returns the next queued item, which keeps the running slot, or None
+        with self._lock:
+            if len(self._queued) > 0:
+                return self._queued.popleft()
+            self._running -= 1
+            return None
+
+    def running(self):
+        with self._lock:
+            return self._running
+
+    def queued(self):
+        with self._lock:
+            return len(self._queued)
+
+class ProcessTask(object):
+    def __init__(self, params, tags):
+        self.params = params
+        self.tags = tags
+
+def _processContext():
+    # Workers are started from a fresh process instead of forking the service,
+    # whose threads may hold locks at fork time. Python 2 can only fork
+    if not hasattr(multiprocessing, "get_context"):
+        return multiprocessing
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context("forkserver")
+    return multiprocessing.get_context("spawn")
+
+def processable(f):
+    # Functions are sent to spawned workers pickled, by reference to their
+    # module, so only module level ones can run in a process pool
+    try:
+        pickle.dumps(f)
+    except Exception:
+        return False
+    return True
+
+class ProcessPool(object):
+    def __init__(self, f, processes=0, maxTasksPerChild=0):
+        if processes <= 0:
+            processes = multiprocessing.cpu_count()
+        if maxTasksPerChild <= 0:
+            maxTasksPerChild = None
+        self.f = f
+        self.processes = processes
+        self.maxTasksPerChild = maxTasksPerChild
+        self._pool = None
+
+    def start(self):
+        if self._pool == None:
+            self._pool = _processContext().Pool(self.processes, _initProcess, (self.f,), self.maxTasksPerChild)
+
+    def stop(self):
+        if self._pool != None:
+            self._pool.terminate()
+            self._pool.join()
+            self._pool = None
+
+    def call(self, task):
+        res, err, tbck = self._pool.apply(_processCall, (task.params, task.tags))
+        if tbck != None:
+            raise Exception("panic in worker process: {0}".format(tbck))
+        return res, err
+
+_processFunc = None
+
+def _initProcess(f):
+    global _processFunc
+    _processFunc = f
+    # Stops are driven by the parent process
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+def _processCall(params, tags):
+    try:
+        res, err = _processFunc(ProcessTask(params, tags))
+        return res, err, None
+    except Exception:
+        return None, None, traceback.format_exc()
@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+#    nxsugarpy, a Python library for building nexus services with python
+#    Copyright (C) 2016 by the nxsugarpy team
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Lesser General Public License as published
+#    by the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU Lesser General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+
+import threading
+import traceback
+
+from nxsugarpy.log import *
+from nxsugarpy.errors import *
+from nxsugarpy.stats import monotonicTime
+
+try:
+    from Queue import Queue, Full, Empty
+except ImportError:
+    from queue import Queue, Full, Empty
+
+def _executeAll(calls, timeout):
+    # Sends every (conn, method, params) call before waiting for any of them,
+    # so a batch of calls costs a single round trip. Calls still unanswered
+    # after timeout seconds fail with ErrTimeout
+    pending = []
+    for conn, method, params in calls:
+        taskId, channel, err = conn.executeNoWait(method, params)
+        pending.append((conn, taskId, channel, err))
+    deadline = monotonicTime() + timeout
+    errs = []
+    for conn, taskId, channel, err in pending:
+        if err == None:
+            try:
+                res = channel.get(True, max(deadline - monotonicTime(), 0))
+                err = res.get("error")
+            except Empty:
+                err = {"code": ErrTimeout, "message": ErrStr[ErrTimeout]}
+            conn.delId(taskId)
+        errs.append(err)
+    return errs
+
+class ReplySender(object):
+    # Sends the responses of replyTo tasks from threads of its own, so workers
+    # are free as soon as the method returns. Each sender takes up to maxBatch
+    # queued replies, accepts all their tasks at once and then writes or pushes
+    # the replies of the accepted ones at once. When the queue is full the
+    # worker sends its own reply
+    def __init__(self, stats, queueSize=1024, senders=1, maxBatch=32, timeout=30):
+        self.queueSize = max(queueSize, 1)
+        self.senders = max(senders, 1)
+        self.maxBatch = max(maxBatch, 1)
+        self.timeout = timeout
+        self._stats = stats
+        self._queue = Queue(self.queueSize)
+        self._threads = []
+
+    def start(self):
+        for _ in range(self.senders):
+            th = threading.Thread(target=self._run)
+            th.daemon = True
+            th.start()
+            self._threads.append(th)
+
+    def put(self, task, kind, path, reply):
+        item = (task, kind, path, reply, monotonicTime())
+        try:
+            self._queue.put_nowait(item)
+        except Full:
+            self._stats.addRepliesOverflow(1)
+            try:
+                self._send([item])
+            except Exception:
+                log(ErrorLevel, "replyto wrapper", "panic sending reply: {0}", traceback.format_exc())
+                self._stats.addRepliesFailed(1)
+
+    def queued(self):
+        return self._queue.qsize()
+
+    def drain(self):
+        self._queue.join()
+
+    def stop(self, timeout):
+        deadline = monotonicTime() + timeout
+        for _ in self._threads:
+            try:
+                self._queue.put(None, timeout=max(deadline - monotonicTime(), 0))
+            except Full:
+                break
+        for th in self._threads:
+            th.join(max(deadline - monotonicTime(), 0))
+        self._threads = []
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item == None:
+                self._queue.task_done()
+                return
+            items = [item]
+            stopping = False
+            while len(items) < self.maxBatch:
+                try:
+                    item = self._queue.get_nowait()
+                except Empty:
+                    break
+                if item == None:
+                    stopping = True
+                    break
+                items.append(item)
+            try:
+                self._send(items)
+            except Exception:
+                log(ErrorLevel, "replyto wrapper", "panic sending replies: {0}", traceback.format_exc())
+                self._stats.addRepliesFailed(len(items))
+            for _ in range(len(items) + (1 if stopping else 0)):
+                self._queue.task_done()
+            if stopping:
+                return
+
+    def _send(self, items):
+        errs = _executeAll([(task.nexusConn, "task.result", {"taskid": task.taskId, "result": None}) for task, _, _, _, _ in items], self.timeout)
+        accepted = []
+        calls = []
+        for item, err in zip(items, errs):
+            task, kind, path, reply, _ = item
+            if err != None:
+                log(WarnLevel, "replyto wrapper", "could not accept task: {0}", errToStr(err))
+                self._stats.addRepliesFailed(1)
+                continue
+            if kind == "pipe":
+                pipe, err = task.nexusConn.pipeOpen(path)
+                if err != None:
+                    log(WarnLevel, "replyto wrapper", "could not open received pipeId ({0}): {1}", path, errToStr(err))
+                    self._stats.addRepliesFailed(1)
+                    continue
+                calls.append((task.nexusConn, "pipe.write", {"pipeid": pipe.pipeId, "msg": reply}))
+            else:
+                calls.append((task.nexusConn, "task.push", {"method": path, "params": reply, "detach": True, "timeout": 30}))
+            accepted.append(item)
+        errs = _executeAll(calls, self.timeout)
+        now = monotonicTime()
+        for item, err in zip(accepted, errs):
+            task, kind, path, _, queuedAt = item
+            self._stats.observe(getattr(task, "replyMethod", task.method), "reply", now - queuedAt)
+            if err == None:
+                self._stats.addRepliesSent(1)
+                continue
+            self._stats.addRepliesFailed(1)
+            if kind == "pipe":
+                log(WarnLevel, "replyto wrapper", "error writing response to pipe: {0}", errToStr(err))
+            else:
+                log(WarnLevel, "replyto wrapper", "could not push response task to received path ({0}): {1}", path, errToStr(err))
@@ -19,16 +19,37 @@
 #
 ##############################################################################
 
+from __future__ import absolute_import
 from nxsugarpy.log import *
 from nxsugarpy.service import *
 from nxsugarpy.service import _populateOpts
+from nxsugarpy.pool import ThreadBudget
+from nxsugarpy.connpool import ConnPool
 
+import multiprocessing
+import os
+import signal
+import sys
 import threading
+import time
+try:
+    from nxsugarpy.asyncservice import AsyncService
+except (ImportError, SyntaxError):
+    AsyncService = None
 try:
     from Queue import Queue, Empty
 except ImportError:
     from queue import Queue, Empty
 
+def _forkContext():
+    # Workers inherit the configured server instead of receiving it pickled,
+    # which its threads and connections don't allow, so they must be forked
+    if not hasattr(os, "fork"):
+        return None
+    if hasattr(multiprocessing, "get_context"):
+        return multiprocessing.get_context("fork")
+    return multiprocessing
+
 class Server(object):
     def __init__(self, url):
         self.url = url
@@ -39,18 +60,35 @@ class Server(object):
         self.pulls = 1
         self.pullTimeout = 3600
         self.maxThreads = 4
+        self.minThreads = -1
+        self.threadIdleTimeout = 60
         self.logLevel = InfoLevel
         self.statsPeriod = 300
         self.gracefulExit = 20
         self.testing = False
         self.version = "0.0.0"
+        self.workers = 1
+        self.workerRestartDelay = 1
+        self.workerRestartMaxDelay = 30
+        self.threadBudget = 0
+        self.connections = 1
+        self.reconnect = False
 
         self.connState = None
         self._nc = None
+        self._connPool = None
         self._services = {}
         self._addedAsStoppable = False
 
+        # only in pre-fork mode
+        self._workerProcs = None
+        self._workerStop = None
+        self._workerStopReq = None
+        self._workerLock = threading.Lock()
+
     def getConn(self):
+        if self._connPool != None:
+            return self._connPool.conn(0)
         return self._nc
 
     def setUrl(self, url):
@@ -62,6 +100,18 @@ class Server(object):
     def setPassword(self, password):
         self.password = password
 
+    def setWorkers(self, n):
+        self.workers = n
+
+    def setConnections(self, n):
+        self.connections = n
+
+    def setReconnect(self, t):
+        self.reconnect = t
+
+    def setThreadBudget(self, n):
+        self.threadBudget = n
+
     def setLogLevel(self, l):
         self.logLevel = l
 
@@ -92,7 +142,14 @@ class Server(object):
         return self.testing
 
     def addService(self, name, path, opts=None):
-        svc = Service(self.url, path, {"pulls": self.pulls, "pullTimeout": self.pullTimeout, "maxThreads": self.maxThreads, "testing": self.testing})
+        serviceClass = Service
+        if opts != None and "mode" in opts and opts["mode"] == "asyncio":
+            if AsyncService == None:
+                errs = "asyncio mode requires python 3.5 or newer"
+                logWithFields(ErrorLevel, "server", {"type": "invalid_mode"}, errs)
+                return None
+            serviceClass = AsyncService
+        svc = serviceClass(self.url, path, {"pulls": self.pulls, "pullTimeout": self.pullTimeout, "maxThreads": self.maxThreads, "minThreads": self.minThreads, "threadIdleTimeout": self.threadIdleTimeout, "testing": self.testing})
         svc.user = self.user
         svc.password = self.password
         svc.name = name
@@ -104,8 +161,34 @@ class Server(object):
             opts = _populateOpts(opts)
             svc.pulls = opts["pulls"]
             svc.pullTimeout = opts["pullTimeout"]
+            svc.minPulls = opts["minPulls"]
+            svc.maxPulls = opts["maxPulls"]
+            svc.pullsScaleInterval = opts["pullsScaleInterval"]
             svc.maxThreads = opts["maxThreads"]
+            svc.minThreads = opts["minThreads"]
+            svc.threadIdleTimeout = opts["threadIdleTimeout"]
+            svc.batchConcurrency = opts["batchConcurrency"]
+            svc.adaptiveThreads = opts["adaptiveThreads"]
+            svc.adaptiveMinThreads = opts["adaptiveMinThreads"]
+            svc.adaptiveInterval = opts["adaptiveInterval"]
+            svc.adaptiveTolerance = opts["adaptiveTolerance"]
+            svc.adaptiveBackoff = opts["adaptiveBackoff"]
+            svc.shedTarget = opts["shedTarget"]
+            svc.shedInterval = opts["shedInterval"]
+            svc.priorityDispatch = opts["priorityDispatch"]
+            svc.priorityAging = opts["priorityAging"]
+            svc.priorityQueueSize = opts["priorityQueueSize"]
+            svc.replySenders = opts["replySenders"]
+            svc.replyQueueSize = opts["replyQueueSize"]
+            svc.replyBatchSize = opts["replyBatchSize"]
+            svc.reconnect = opts["reconnect"]
+            svc.reconnectMinDelay = opts["reconnectMinDelay"]
+            svc.reconnectMaxDelay = opts["reconnectMaxDelay"]
+            svc.budgetWeight = opts["budgetWeight"]
+            svc.budgetMinThreads = opts["budgetMinThreads"]
             svc.testing = opts["testing"]
+            if serviceClass == AsyncService:
+                svc.maxTasks = opts["maxTasks"]
             svc._preaction = opts["preaction"]
             svc._postaction = opts["postaction"]
         self._services[name] = svc
@@ -116,6 +199,9 @@ class Server(object):
             self.connState(self.getConn(), state)
 
     def serve(self):
+        if self.workers > 1:
+            return self._servePrefork()
+
         self._setState(StateInitializing)
 
         # Check server
@@ -125,11 +211,11 @@ class Server(object):
             return errs
 
         # Dial and login
-        scheme, user, password, host, port = parseNexusUrl(self.url, self.user, self.password)
+        user, password, endpoints = nexusEndpoints(self.url, self.user, self.password)
         self.user = user
         self.password = password
-        self._showurl = "{0}://{1}:{2}".format(scheme, host, port)
-        self._connurl = "{0}://{1}:{2}@{3}:{4}".format(scheme, user, password, host, port)
+        self._connurl = endpoints[0][0]
+        self._showurl = ",".join(showurl for _, showurl in endpoints)
         for _, svc in self._services.items():
             svc.url = self.url
             svc._showurl = self._showurl
@@ -138,23 +224,42 @@ class Server(object):
             svc.password = self.password
 
         self._setState(StateConnecting)
-        try:
-            self._nc = nxpy.Client(self._connurl)
-        except Exception as e:
-            errs = "can't connect to nexus server ({0}): {1}".format(self._showurl, str(e))
-            logWithFields(ErrorLevel, "server", {"type": "connection_error"}, errs)
-            return errs
-        if not self._nc.is_version_compatible:
-            logWithFields(WarnLevel, "server", {"type": "incompatible_version"}, "connecting to an incompatible version of nexus at ({0}): client ({1}) server ({2})", self._showurl, nxpy.__version__, self._nc.nexus_version)
-        if not self._nc.is_logged:
-            errs = "can't login to nexus server ({0}) as ({1}): {2}".format(self._showurl, self.user, errToStr(self._nc.login_error))
-            logWithFields(ErrorLevel, "server", {"type": "login_error"}, errs)
-            return errs
+        reconnect = self.reconnect or any(svc.reconnect for svc in self._services.values())
+        if self.connections > 1 or reconnect or len(endpoints) > 1:
+            # At least a connection per endpoint, so pulls spread over every nexus node
+            connPool = ConnPool(endpoints, max(self.connections, len(endpoints)))
+            connPool.onDown = lambda: self._setState(StateConnecting)
+            connPool.onUp = lambda: self._setState(StateServing)
+            errs = connPool.dial()
+            if errs != None:
+                return errs
+            self._connPool = connPool
+            self._nc = connPool.conn(0)
+        else:
+            try:
+                self._nc = nxpy.Client(self._connurl)
+            except Exception as e:
+                errs = "can't connect to nexus server ({0}): {1}".format(self._showurl, str(e))
+                logWithFields(ErrorLevel, "server", {"type": "connection_error"}, errs)
+                return errs
+            if not self._nc.is_version_compatible:
+                logWithFields(WarnLevel, "server", {"type": "incompatible_version"}, "connecting to an incompatible version of nexus at ({0}): client ({1}) server ({2})", self._showurl, nxpy.__version__, self._nc.nexus_version)
+            if not self._nc.is_logged:
+                errs = "can't login to nexus server ({0}) as ({1}): {2}".format(self._showurl, self.user, errToStr(self._nc.login_error))
+                logWithFields(ErrorLevel, "server", {"type": "login_error"}, errs)
+                return errs
 
-        # Configure services
-        for _, svc in self._services.items():
+        # Configure services, all drawing their workers from the same budget when there is one
+        budget = None
+        if self.threadBudget > 0:
+            budget = ThreadBudget(self.threadBudget)
+        for k, (_, svc) in enumerate(sorted(self._services.items())):
             svc.setLogLevel(self.logLevel)
             svc._setConn(self._nc)
+            svc._setConnPool(self._connPool, k)
+            if self.reconnect:
+                svc.reconnect = True
+            svc._budget = budget
 
         # Serve
         errQ = Queue(len(self._services))
@@ -174,6 +279,9 @@ class Server(object):
         for worker in serviceWorkers:
             worker.join()
 
+        if self._connPool != None:
+            self._connPool.close()
+        self._connPool = None
         self._nc = None
         self._setState(StateStopped)
 
@@ -184,10 +292,165 @@ class Server(object):
         else:
             return firstErr
 
+    def _servePrefork(self):
+        self._setState(StateInitializing)
+
+        # Check server
+        if len(self._services) == 0:
+            errs = "no services to serve"
+            logWithFields(ErrorLevel, "server", {"type": "no_services"}, errs)
+            return errs
+        ctx = _forkContext()
+        if ctx == None:
+            errs = "pre-fork workers require fork, which is not available on this platform"
+            logWithFields(ErrorLevel, "server", {"type": "invalid_workers"}, errs)
+            return errs
+        if logFileRotates():
+            # Each worker would rotate the same file on its own, losing lines
+            errs = "pre-fork workers can't share a rotated log file, set its max size to 0"
+            logWithFields(ErrorLevel, "server", {"type": "invalid_workers"}, errs)
+            return errs
+
+        # Start workers, each one serving every service over its own connection
+        errQ = ctx.Queue()
+        with self._workerLock:
+            self._workerProcs = {}
+            self._workerStop = None
+            self._workerStopReq = None
+        for i in range(self.workers):
+            self._startWorker(ctx, i+1, errQ)
+
+        if not self._addedAsStoppable:
+            addStoppable(self)
+            self._addedAsStoppable = True
+
+        self._setState(StateServing)
+
+        # Supervise workers
+        firstErr = None
+        restarts = {}
+        failures = {}
+        while True:
+            while True:
+                try:
+                    i, errs = errQ.get_nowait()
+                except Empty:
+                    break
+                if errs != None and firstErr == None:
+                    firstErr = errs
+
+            # Stops are only requested by gracefulStop() and stop(), which may
+            # run in a signal handler on this same thread, and sent from here
+            req = self._workerStopReq
+            if req != None and req != self._workerStop:
+                self._sendWorkers(req)
+
+            with self._workerLock:
+                procs = list(self._workerProcs.items())
+                stopping = self._workerStop != None
+            if len(procs) == 0 and len(restarts) == 0:
+                break
+
+            for i, (proc, ctl, started) in procs:
+                if proc.is_alive():
+                    continue
+                proc.join()
+                with self._workerLock:
+                    self._workerProcs.pop(i, None)
+                if stopping:
+                    continue
+                if proc.exitcode == 0:
+                    # A worker finished by itself: stop the rest as a single process server would
+                    logWithFields(WarnLevel, "server", {"type": "worker_done", "worker": i, "pid": proc.pid}, "worker {0} (pid {1}) finished: stopping workers", i, proc.pid)
+                    self.gracefulStop()
+                    stopping = True
+                    continue
+                # Workers that keep failing are restarted less and less often
+                if time.time() - started >= self.workerRestartMaxDelay:
+                    failures[i] = 0
+                failures[i] = failures.get(i, 0) + 1
+                delay = min(self.workerRestartDelay * 2 ** (failures[i] - 1), self.workerRestartMaxDelay)
+                logWithFields(ErrorLevel, "server", {"type": "worker_crash", "worker": i, "pid": proc.pid, "exitcode": proc.exitcode, "retryIn": delay}, "worker {0} (pid {1}) failed with exit code {2}: restarting in {3}", i, proc.pid, proc.exitcode, secondsToStr(delay))
+                restarts[i] = time.time() + delay
+
+            for i, when in list(restarts.items()):
+                if stopping:
+                    restarts.pop(i)
+                elif time.time() >= when:
+                    restarts.pop(i)
+                    self._startWorker(ctx, i, errQ)
+
+            time.sleep(0.1)
+
+        with self._workerLock:
+            self._workerProcs = None
+        self._setState(StateStopped)
+        return firstErr
+
+    def _startWorker(self, ctx, i, errQ):
+        ctlRecv, ctlSend = ctx.Pipe(False)
+        proc = ctx.Process(target=self._serveWorker, args=(i, ctlRecv, errQ))
+        proc.daemon = False
+        proc.start()
+        with self._workerLock:
+            self._workerProcs[i] = (proc, ctlSend, time.time())
+        logWithFields(InfoLevel, "server", {"type": "worker_start", "worker": i, "pid": proc.pid}, "worker {0} started with pid {1}", i, proc.pid)
+
+    def _serveWorker(self, i, ctlRecv, errQ):
+        # SIGINT is handled by the parent, which forwards stops through the control pipe
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        clearStoppables()
+        self.workers = 1
+        self._workerLock = threading.Lock()
+        self._addedAsStoppable = True
+        self._workerProcs = None
+
+        def control():
+            while True:
+                try:
+                    cmd = ctlRecv.recv()
+                except (EOFError, IOError):
+                    return
+                if cmd == "graceful":
+                    self.gracefulStop()
+                elif cmd == "stop":
+                    self.stop()
+        ctl = threading.Thread(target=control)
+        ctl.daemon = True
+        ctl.start()
+
+        errs = self.serve()
+        errQ.put((i, errs))
+        errQ.close()
+        errQ.join_thread()
+        if errs != None:
+            sys.exit(2)
+
+    def _stopWorkers(self, cmd):
+        # A stop overrides a graceful stop already requested, but not the other way round
+        if cmd == "stop" or self._workerStopReq == None:
+            self._workerStopReq = cmd
+
+    def _sendWorkers(self, cmd):
+        with self._workerLock:
+            self._workerStop = cmd
+            procs = list(self._workerProcs.values())
+        for proc, ctl, _ in procs:
+            try:
+                ctl.send(cmd)
+            except (EOFError, IOError, OSError):
+                pass
+
     def gracefulStop(self):
+        if self._workerProcs != None:
+            self._stopWorkers("graceful")
+            return
         for _, svc in self._services.items():
             svc.gracefulStop()
 
     def stop(self):
+        if self._workerProcs != None:
+            self._stopWorkers("stop")
+            return
         for _, svc in self._services.items():
             svc.stop()
\ No newline at end of file
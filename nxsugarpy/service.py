@@ -26,8 +26,14 @@ from nxsugarpy.errors import *
 from nxsugarpy.helpers import *
 from nxsugarpy.stats import *
 from nxsugarpy.signal import  *
+from nxsugarpy.pool import WorkerPool, ProcessPool, processable, AdaptiveLimit, CoDel, DispatchQueue, Bulkhead, BulkheadRun, BulkheadQueued, BulkheadBusy
+from nxsugarpy.cache import ResultCache, SingleFlight
+from nxsugarpy.batch import Batcher
+from nxsugarpy.connpool import ConnPool, connDead
+from nxsugarpy.reply import ReplySender
 from six import string_types
 
+import random
 import time
 import threading
 import traceback
@@ -47,26 +53,85 @@ _connStateStr = {
 
 class Method(object):
     def __init__(self, f, testf = None, inSchema=None, resSchema=None, errSchema=None, pacts=[], methodOpts={}):
-        _populateMethodOpts(methodOpts)
+        methodOpts = _populateMethodOpts(methodOpts)
         self.disablePullLog = methodOpts["disablePullLog"]
         self.enableResponseResultLog = methodOpts["enableResponseResultLog"]
         self.enableResponseErrorLog = methodOpts["enableResponseErrorLog"]
+        self.logSampler = LogSampler(methodOpts["logSampleEvery"], methodOpts["logSampleRate"], methodOpts["logRateLimit"], methodOpts["logRateBurst"])
         self.inSchema = inSchema
         self.resSchema = resSchema
         self.errSchema = errSchema
         self.pacts = pacts
+        self.name = ""
         self.f = f
         self.testf = testf
+        self.processPool = None
+        self.cache = None
+        self.flight = None
+        self.batchf = None
+        self.batcher = None
+        self.inline = methodOpts["inline"]
+        self.priority = methodOpts["priority"]
+        self.bulkhead = None
+        if methodOpts["maxConcurrent"] > 0:
+            self.bulkhead = Bulkhead(methodOpts["maxConcurrent"], methodOpts["busyPolicy"] != "fail", methodOpts["maxQueued"])
 
 def _populateMethodOpts(opts={}):
     if opts == None:
         opts = {}
+    if "processPool" not in opts:
+        opts["processPool"] = False
+    if "processes" not in opts:
+        opts["processes"] = 0
+    if "maxTasksPerChild" not in opts:
+        opts["maxTasksPerChild"] = 0
+    if "cache" not in opts:
+        opts["cache"] = False
+    if "cacheMaxEntries" not in opts:
+        opts["cacheMaxEntries"] = 1024
+    if "cacheMaxBytes" not in opts:
+        opts["cacheMaxBytes"] = 0
+    if "cacheTtl" not in opts:
+        opts["cacheTtl"] = 0
+    if "cacheErrors" not in opts:
+        opts["cacheErrors"] = False
+    if "cacheErrorTtl" not in opts:
+        opts["cacheErrorTtl"] = 0
+    if "cacheExcludeMetadata" not in opts:
+        opts["cacheExcludeMetadata"] = True
+    if "cacheExcludeKeys" not in opts:
+        opts["cacheExcludeKeys"] = []
+    if "inline" not in opts:
+        opts["inline"] = False
+    if "priority" not in opts:
+        opts["priority"] = 0
+    if "maxConcurrent" not in opts:
+        opts["maxConcurrent"] = 0
+    if "busyPolicy" not in opts or opts["busyPolicy"] not in ["queue", "fail"]:
+        opts["busyPolicy"] = "queue"
+    if "maxQueued" not in opts or opts["maxQueued"] <= 0:
+        opts["maxQueued"] = opts["maxConcurrent"]
+    if "coalesce" not in opts:
+        opts["coalesce"] = False
+    if "coalesceExcludeMetadata" not in opts:
+        opts["coalesceExcludeMetadata"] = True
+    if "coalesceExcludeKeys" not in opts:
+        opts["coalesceExcludeKeys"] = []
     if "disablePullLog" not in opts:
         opts["disablePullLog"] = False
     if "enableResponseResultLog" not in opts:
         opts["enableResponseResultLog"] = False
     if "enableResponseErrorLog" not in opts:
         opts["enableResponseErrorLog"] = False
+    if "logSampleEvery" not in opts:
+        opts["logSampleEvery"] = 1
+    if "logSampleRate" not in opts:
+        opts["logSampleRate"] = 1.0
+    if "logRateLimit" not in opts:
+        opts["logRateLimit"] = 0
+    if "logRateBurst" not in opts:
+        opts["logRateBurst"] = 0
+    return opts
 
 def _populateOpts(opts={}):
     if opts == None:
@@ -75,12 +140,64 @@ def _populateOpts(opts={}):
         opts["pulls"] = 1
     if "pullTimeout" not in opts:
         opts["pullTimeout"] = 3600
+    if "minPulls" not in opts or opts["minPulls"] <= 0 or opts["minPulls"] > opts["pulls"]:
+        opts["minPulls"] = -1
+    if "maxPulls" not in opts or opts["maxPulls"] < opts["pulls"]:
+        opts["maxPulls"] = -1
+    if "pullsScaleInterval" not in opts or opts["pullsScaleInterval"] <= 0:
+        opts["pullsScaleInterval"] = 5
     if opts["pullTimeout"] <= 0:
         opts["pullTimeout"] = 0
     if "maxThreads" not in opts or opts["maxThreads"] <= 0:
         opts["maxThreads"] = 1
     if opts["maxThreads"] < opts["pulls"]:
         opts["maxThreads"] = opts["pulls"]
+    if "minThreads" not in opts or opts["minThreads"] < 0 or opts["minThreads"] > opts["maxThreads"]:
+        opts["minThreads"] = opts["maxThreads"]
+    if "threadIdleTimeout" not in opts or opts["threadIdleTimeout"] <= 0:
+        opts["threadIdleTimeout"] = 60
+    if "maxTasks" not in opts or opts["maxTasks"] <= 0:
+        opts["maxTasks"] = 1024
+    if "mode" not in opts:
+        opts["mode"] = "threads"
+    if "batchConcurrency" not in opts or opts["batchConcurrency"] <= 0:
+        opts["batchConcurrency"] = 1
+    if "shedTarget" not in opts or opts["shedTarget"] < 0:
+        opts["shedTarget"] = 0
+    if "shedInterval" not in opts or opts["shedInterval"] <= 0:
+        opts["shedInterval"] = 0.1
+    if "reconnect" not in opts:
+        opts["reconnect"] = False
+    if "reconnectMinDelay" not in opts or opts["reconnectMinDelay"] <= 0:
+        opts["reconnectMinDelay"] = 0.5
+    if "reconnectMaxDelay" not in opts or opts["reconnectMaxDelay"] < opts["reconnectMinDelay"]:
+        opts["reconnectMaxDelay"] = max(30, opts["reconnectMinDelay"])
+    if "budgetWeight" not in opts or opts["budgetWeight"] <= 0:
+        opts["budgetWeight"] = 1
+    if "budgetMinThreads" not in opts or opts["budgetMinThreads"] < 0:
+        opts["budgetMinThreads"] = 0
+    if "priorityDispatch" not in opts:
+        opts["priorityDispatch"] = False
+    if "priorityAging" not in opts or opts["priorityAging"] <= 0:
+        opts["priorityAging"] = 1.0
+    if "priorityQueueSize" not in opts or opts["priorityQueueSize"] < 0:
+        opts["priorityQueueSize"] = 0
+    if "replySenders" not in opts or opts["replySenders"] < 0:
+        opts["replySenders"] = 0
+    if "replyQueueSize" not in opts or opts["replyQueueSize"] <= 0:
+        opts["replyQueueSize"] = 1024
+    if "replyBatchSize" not in opts or opts["replyBatchSize"] <= 0:
+        opts["replyBatchSize"] = 32
+    if "adaptiveThreads" not in opts:
+        opts["adaptiveThreads"] = False
+    if "adaptiveMinThreads" not in opts or opts["adaptiveMinThreads"] <= 0:
+        opts["adaptiveMinThreads"] = 1
+    if "adaptiveInterval" not in opts or opts["adaptiveInterval"] <= 0:
+        opts["adaptiveInterval"] = 1
+    if "adaptiveTolerance" not in opts or opts["adaptiveTolerance"] <= 1:
+        opts["adaptiveTolerance"] = 2.0
+    if "adaptiveBackoff" not in opts or opts["adaptiveBackoff"] <= 0 or opts["adaptiveBackoff"] >= 1:
+        opts["adaptiveBackoff"] = 0.9
     if "testing" not in opts:
         opts["testing"] = False
     if "preaction" not in opts:
@@ -103,7 +220,31 @@ class Service(object):
         self.path = path
         self.pulls = opts["pulls"]
         self.pullTimeout = opts["pullTimeout"]
+        self.minPulls = opts["minPulls"]
+        self.maxPulls = opts["maxPulls"]
+        self.pullsScaleInterval = opts["pullsScaleInterval"]
         self.maxThreads = opts["maxThreads"]
+        self.minThreads = opts["minThreads"]
+        self.threadIdleTimeout = opts["threadIdleTimeout"]
+        self.batchConcurrency = opts["batchConcurrency"]
+        self.shedTarget = opts["shedTarget"]
+        self.shedInterval = opts["shedInterval"]
+        self.reconnect = opts["reconnect"]
+        self.reconnectMinDelay = opts["reconnectMinDelay"]
+        self.reconnectMaxDelay = opts["reconnectMaxDelay"]
+        self.budgetWeight = opts["budgetWeight"]
+        self.budgetMinThreads = opts["budgetMinThreads"]
+        self.priorityDispatch = opts["priorityDispatch"]
+        self.priorityAging = opts["priorityAging"]
+        self.priorityQueueSize = opts["priorityQueueSize"]
+        self.replySenders = opts["replySenders"]
+        self.replyQueueSize = opts["replyQueueSize"]
+        self.replyBatchSize = opts["replyBatchSize"]
+        self.adaptiveThreads = opts["adaptiveThreads"]
+        self.adaptiveMinThreads = opts["adaptiveMinThreads"]
+        self.adaptiveInterval = opts["adaptiveInterval"]
+        self.adaptiveTolerance = opts["adaptiveTolerance"]
+        self.adaptiveBackoff = opts["adaptiveBackoff"]
         self.statsPeriod = 300
         self.gracefulExit = 20
         self.logLevel = InfoLevel
@@ -117,16 +258,33 @@ class Service(object):
         self._stats = None
 
         self._cmdQueue = Queue(self.pulls + 1024)
-        self._threadsSem = None
-        self._taskWorkers = {}
-        self._taskWorkersLock = None
+        self._workerPool = None
         self._statsTicker = None
+        self._adaptive = None
+        self._adaptiveTicker = None
+        self._shedder = None
+        self._dispatchQueue = None
+        self._budget = None
+        self._budgetShare = None
+        self._replySender = None
+        self._pullers = 0
+        self._pullsAlive = set()
+        self._pullsLock = None
+        self._pullWorkers = []
+        self._pullsWindow = None
+        self._pullsTicker = None
         self._stopLock = None
         self._stopping = False
         self._addedAsStoppable = False
+        self._pulledCond = threading.Condition(threading.Lock())
+        self._pulledTasks = 0
 
         self._debugEnabled = False
         self._sharedConn = False
+        self._connPool = None
+        self._connOffset = 0
+        self._reconnectLock = threading.Lock()
+        self._stopEvent = None
         self._connid = ""
 
         # only in nsugar-py
@@ -134,6 +292,8 @@ class Service(object):
         self._postaction = opts["postaction"]
 
     def getConn(self):
+        if self._connPool != None:
+            return self._connPool.conn(0)
         return self._nc
 
     def _setConn(self, conn):
@@ -141,12 +301,64 @@ class Service(object):
         self._sharedConn = True
         self._connid = conn.connid
 
+    def _setConnPool(self, pool, offset):
+        # Pull threads are spread over the pool starting at offset
+        self._connPool = pool
+        self._connOffset = offset
+
+    def _pullConn(self, i):
+        if self._connPool != None:
+            return self._connPool.conn(self._connOffset + i)
+        return self._nc
+
+    def _replaceConn(self, i, conn, err):
+        # Returns whether a pooled connection that died under puller i could be dialed
+        # again. In resilient mode it keeps trying with backoff until the service stops
+        if self._connPool == None or self._isStopping() or not connDead(conn, err):
+            return False
+        lostAt = monotonicTime()
+        with self._reconnectLock:
+            delay = self.reconnectMinDelay
+            while True:
+                _, dialed, errs = self._connPool.replace(self._connOffset + i, conn)
+                if errs == None:
+                    break
+                if not self.reconnect or self._isStopping():
+                    return False
+                # Jitter keeps the services of many processes from redialing in lockstep
+                wait = random.uniform(delay / 2, delay)
+                self.logWithFields(WarnLevel, {"type": "reconnect_error", "retryIn": wait}, "reconnect: {0}: retrying in {1}", errs, secondsToStr(wait))
+                if self._stopEvent.wait(wait):
+                    return False
+                delay = min(delay * 2, self.reconnectMaxDelay)
+        if dialed:
+            downtime = monotonicTime() - lostAt
+            self._connid = self._connPool.conn(0).connid
+            self._stats.addReconnects(1)
+            self._stats.addDowntime(downtime)
+            self.logWithFields(WarnLevel, {"type": "reconnected", "downtime": downtime}, "pull {0}: connection lost: reconnected after {1}", i, secondsToStr(downtime))
+        return True
+
+    def _closeConn(self, i=None, conn=None):
+        # A puller whose pooled connection failed only closes that one
+        if self._connPool != None:
+            if conn != None:
+                self._connPool.discard(self._connOffset + i, conn)
+            else:
+                self._connPool.close()
+        else:
+            self._nc.close()
+
     def addMethod(self, name, f, testf=None, schema=None, methodOpts={}):
+        err = self._checkProcessPool(name, f, methodOpts)
+        if err != None:
+            return err
         if len(self._methods) == 0:
             self._initMethods()
-        method = Method(_defMethodWrapper(f), methodOpts=methodOpts)
+        method = self._newMethod(f, methodOpts)
         if testf != None:
-            method.testf = _defMethodWrapper(testf)
+            method.testf = self._wrapMethod(testf)
+        method.name = name
         self._methods[name] = method
         if schema != None:
             err, errM = self._addSchemaToMethod(name, schema)
@@ -155,10 +367,23 @@ class Service(object):
                 return err
         return None
 
+    def addBatchMethod(self, name, f, maxBatch=100, maxWaitMs=5, testf=None, schema=None, methodOpts={}):
+        # f receives a list of params and returns a list with a (result, error) for each one
+        if len(self._methods) == 0:
+            self._initMethods()
+        err = self.addMethod(name, _batchItemWrapper(f), testf, schema, methodOpts)
+        method = self._methods[name]
+        method.batchf = f
+        method.batcher = Batcher(maxBatch, maxWaitMs / 1000.0)
+        return err
+
     def _initMethods(self):
-        self._methods["@schema"] = Method(self._schemaMethod)
-        self._methods["@info"] = Method(self._infoMethod)
-        self._methods["@ping"] = Method(self._pingMethod)
+        self._methods["@schema"] = Method(self._schemaMethod, methodOpts={"inline": True})
+        self._methods["@info"] = Method(self._infoMethod, methodOpts={"inline": True})
+        self._methods["@ping"] = Method(self._pingMethod, methodOpts={"inline": True})
+        self._methods["@batch"] = Method(self._batchMethod)
+        for name, method in self._methods.items():
+            method.name = name
 
     def _schemaMethod(self, task):
         r = {}
@@ -193,8 +418,113 @@ class Service(object):
     def _pingMethod(self, task):
         task.sendResult("pong")
 
+    def _batchMethod(self, task):
+        if not isinstance(task.params, list):
+            task.sendError(ErrInvalidParams, "params must be a list of {method, params} calls", None)
+            return
+        calls = task.params
+        responses = [None] * len(calls)
+        nextCall = [0]
+        helping = [0]
+        lock = threading.Lock()
+        helpersDone = threading.Condition(lock)
+        def run():
+            while True:
+                with lock:
+                    i = nextCall[0]
+                    if i >= len(calls):
+                        return
+                    nextCall[0] += 1
+                responses[i] = self._runBatchCall(task, calls[i])
+        def helper():
+            try:
+                run()
+            finally:
+                self._workerPool.release()
+                self._stats.addThreadsUsed(-1)
+                with lock:
+                    helping[0] -= 1
+                    helpersDone.notify()
+        # Idle workers of the pool help with the calls, this one runs the rest
+        for _ in range(min(self.batchConcurrency, len(calls)) - 1):
+            if not self._workerPool.tryAcquire():
+                break
+            self._stats.addThreadsUsed(1)
+            with lock:
+                helping[0] += 1
+            self._workerPool.submit(helper)
+        run()
+        with lock:
+            while helping[0] > 0:
+                helpersDone.wait()
+        task.sendResult(responses)
+
+    def _runBatchCall(self, task, call):
+        self._stats.addBatchCalls(1)
+        if not isinstance(call, dict) or "method" not in call or not isinstance(call["method"], string_types):
+            call = _LocalTask(task, "", None)
+            call.sendError(ErrInvalidParams, "each call must be a map with a method", None)
+            return call.response
+        params = None
+        if "params" in call:
+            params = call["params"]
+        call = _LocalTask(task, call["method"], params)
+        if call.method not in self._methods or call.method == "@batch":
+            self._stats.addTasksMethodNotFound(1)
+            call.sendError(ErrMethodNotFound, "", None)
+            return call.response
+        method = self._methods[call.method]
+        cacheKey, cached = self._cacheLookup(method, call)
+        if cached != None:
+            _sendResponse(call, cached[0], cached[1])
+            self._stats.addTasksServed(1)
+        elif not self._bulkheadTryEnter(method):
+            call.sendError(ErrBusy, ErrStr[ErrBusy], None)
+        else:
+            self._runLocalTask(0, method, call, cacheKey)
+            # Tasks queued behind the call take over this thread, as they do a worker
+            queued = self._bulkheadLeave(method)
+            if queued != None:
+                n, task, pulledAt, cacheKey, flightKey = queued
+                self._runBulkheaded(n, method, task, pulledAt, cacheKey, flightKey)
+        if call.response == None:
+            return {"result": None}
+        return call.response
+
+    def _runLocalTask(self, n, method, task, cacheKey):
+        self._runTask(n, method, task, cacheKey)
+
     def setHandler(self, h, methodOpts={}):
-        self._handler = Method(_defMethodWrapper(h), methodOpts=methodOpts)
+        err = self._checkProcessPool("*", h, methodOpts)
+        if err != None:
+            return err
+        self._handler = self._newMethod(h, methodOpts)
+        self._handler.name = "*"
+        return None
+
+    def _checkProcessPool(self, name, f, methodOpts):
+        if methodOpts == None or "processPool" not in methodOpts or not methodOpts["processPool"] or processable(f):
+            return None
+        errs = "method ({0}) can't run in a process pool: its function must be defined at module level".format(name)
+        self.logWithFields(ErrorLevel, {"type": "invalid_method"}, errs)
+        return errs
+
+    def _newMethod(self, f, methodOpts):
+        methodOpts = _populateMethodOpts(methodOpts)
+        processPool = None
+        if methodOpts["processPool"]:
+            processPool = ProcessPool(f, methodOpts["processes"], methodOpts["maxTasksPerChild"])
+            f = processPool.call
+        method = Method(self._wrapMethod(f), methodOpts=methodOpts)
+        method.processPool = processPool
+        if methodOpts["cache"]:
+            method.cache = ResultCache(methodOpts["cacheMaxEntries"], methodOpts["cacheMaxBytes"], methodOpts["cacheTtl"], methodOpts["cacheErrors"], methodOpts["cacheErrorTtl"], methodOpts["cacheExcludeMetadata"], methodOpts["cacheExcludeKeys"])
+        if methodOpts["coalesce"]:
+            method.flight = SingleFlight(methodOpts["coalesceExcludeMetadata"], methodOpts["coalesceExcludeKeys"])
+        return method
+
+    def _wrapMethod(self, f):
+        return _defMethodWrapper(f)
 
     def setDescription(self, description):
         self.description = description
@@ -217,6 +547,69 @@ class Service(object):
     def setMaxThreads(self, maxThreads):
         self.maxThreads = maxThreads
 
+    def setMinThreads(self, minThreads):
+        self.minThreads = minThreads
+
+    def setThreadIdleTimeout(self, t):
+        self.threadIdleTimeout = t
+
+    def setBatchConcurrency(self, batchConcurrency):
+        self.batchConcurrency = batchConcurrency
+
+    def setShedTarget(self, t):
+        self.shedTarget = t
+
+    def setShedInterval(self, t):
+        self.shedInterval = t
+
+    def setReconnect(self, t):
+        self.reconnect = t
+
+    def setReconnectMinDelay(self, t):
+        self.reconnectMinDelay = t
+
+    def setReconnectMaxDelay(self, t):
+        self.reconnectMaxDelay = t
+
+    def setBudgetWeight(self, w):
+        self.budgetWeight = w
+
+    def setBudgetMinThreads(self, n):
+        self.budgetMinThreads = n
+
+    def setPriorityDispatch(self, t):
+        self.priorityDispatch = t
+
+    def setPriorityAging(self, t):
+        self.priorityAging = t
+
+    def setPriorityQueueSize(self, n):
+        self.priorityQueueSize = n
+
+    def setReplySenders(self, n):
+        self.replySenders = n
+
+    def setReplyQueueSize(self, n):
+        self.replyQueueSize = n
+
+    def setReplyBatchSize(self, n):
+        self.replyBatchSize = n
+
+    def setAdaptiveThreads(self, t):
+        self.adaptiveThreads = t
+
+    def setAdaptiveMinThreads(self, minThreads):
+        self.adaptiveMinThreads = minThreads
+
+    def setAdaptiveInterval(self, t):
+        self.adaptiveInterval = t
+
+    def setMinPulls(self, minPulls):
+        self.minPulls = minPulls
+
+    def setMaxPulls(self, maxPulls):
+        self.maxPulls = maxPulls
+
     def setPullTimeout(self, pullTimeout):
         self.pullTimeout = pullTimeout
 
@@ -245,6 +638,12 @@ class Service(object):
     def isTesting(self):
         return self.testing
 
+    def _allMethods(self):
+        methods = list(self._methods.values())
+        if self._handler != None:
+            methods.append(self._handler)
+        return methods
+
     def getMethods(self):
         if self._handler != None:
             return []
@@ -285,8 +684,18 @@ class Service(object):
             self.maxThreads = 1
         if self.pulls < 0:
             self.pulls = 1
+        if self.minPulls <= 0 or self.minPulls > self.pulls:
+            self.minPulls = self.pulls
+        if self.maxPulls < self.pulls:
+            self.maxPulls = self.pulls
+        if self.pullsScaleInterval <= 0:
+            self.pullsScaleInterval = 5
         if self.maxThreads < self.pulls:
             self.maxThreads = self.pulls
+        if self.minThreads < 0 or self.minThreads > self.maxThreads:
+            self.minThreads = self.maxThreads
+        if self.threadIdleTimeout <= 0:
+            self.threadIdleTimeout = 60
         if self.pullTimeout < 0:
             self.pullTimeout = 0
         if self.statsPeriod < 0.1:
@@ -303,24 +712,36 @@ class Service(object):
             self._setState(StateConnecting)
 
             # Dial and login
-            scheme, user, password, host, port = parseNexusUrl(self.url, self.user, self.password)
+            user, password, endpoints = nexusEndpoints(self.url, self.user, self.password)
             self.user = user
             self.password = password
-            self._showurl = "{0}://{1}:{2}".format(scheme, host, port)
-            self._connurl = "{0}://{1}:{2}@{3}:{4}".format(scheme, user, password, host, port)
-
-            try:
-                self._nc = nxpy.Client(self._connurl)
-            except Exception as e:
-                errs = "can't connect to nexus server ({0}): {1}".format(self._showurl, str(e))
-                logWithFields(ErrorLevel, "server", {"type": "connection_error"}, errs)
-                return errs
-            if not self._nc.is_version_compatible:
-                logWithFields(WarnLevel, "server", {"type": "incompatible_version"}, "connecting to an incompatible version of nexus at ({0}): client ({1}) server ({2})", self._showurl, nxpy.__version__, self._nc.nexus_version)
-            if not self._nc.is_logged:
-                errs = "can't login to nexus server ({0}) as ({1}): {2}".format(self._showurl, self.user, errToStr(self._nc.login_error))
-                logWithFields(ErrorLevel, "server", {"type": "login_error"}, errs)
-                return errs
+            self._connurl = endpoints[0][0]
+            self._showurl = ",".join(showurl for _, showurl in endpoints)
+
+            if self.reconnect or len(endpoints) > 1:
+                # A connection per endpoint for pullers to spread over, dialed
+                # again on another endpoint when one dies
+                connPool = ConnPool(endpoints, len(endpoints))
+                connPool.onDown = lambda: self._setState(StateConnecting)
+                connPool.onUp = lambda: self._setState(StateServing)
+                errs = connPool.dial()
+                if errs != None:
+                    return errs
+                self._setConnPool(connPool, 0)
+                self._nc = connPool.conn(0)
+            else:
+                try:
+                    self._nc = nxpy.Client(self._connurl)
+                except Exception as e:
+                    errs = "can't connect to nexus server ({0}): {1}".format(self._showurl, str(e))
+                    logWithFields(ErrorLevel, "server", {"type": "connection_error"}, errs)
+                    return errs
+                if not self._nc.is_version_compatible:
+                    logWithFields(WarnLevel, "server", {"type": "incompatible_version"}, "connecting to an incompatible version of nexus at ({0}): client ({1}) server ({2})", self._showurl, nxpy.__version__, self._nc.nexus_version)
+                if not self._nc.is_logged:
+                    errs = "can't login to nexus server ({0}) as ({1}): {2}".format(self._showurl, self.user, errToStr(self._nc.login_error))
+                    logWithFields(ErrorLevel, "server", {"type": "login_error"}, errs)
+                    return errs
             self._connid = self._nc.connid
 
         self._setState(StateServing)
@@ -332,17 +753,44 @@ class Service(object):
         self._stats = Stats()
         self._stopping = False
         self._stopLock = threading.Lock()
-        if self._threadsSem == None:
-            self._threadsSem = threading.Semaphore(self.maxThreads)
-        self._taskWorkers = {}
-        self._taskWorkersLock = threading.Lock()
-
-        pullWorkers = []
-        for i in range(self.pulls):
-            worker = threading.Thread(target=self._taskPull, args=(i+1,))
-            worker.daemon = True
-            pullWorkers.append(worker)
-            worker.start()
+        self._stopEvent = threading.Event()
+        self._pulledCond = threading.Condition(threading.Lock())
+        self._pulledTasks = 0
+        self._workerPool = WorkerPool(self.maxThreads, self.minThreads, self.threadIdleTimeout)
+        self._workerPool.start()
+        self._budgetShare = None
+        if self._budget != None:
+            self._budgetShare = self._budget.share(self.name, self.budgetWeight, self.budgetMinThreads)
+            self._workerPool.setBudget(self._budgetShare)
+        self._shedder = None
+        if self.shedTarget > 0:
+            self._shedder = CoDel(self.shedTarget, self.shedInterval)
+        self._adaptive = None
+        if self.adaptiveThreads:
+            self._adaptive = AdaptiveLimit(self.adaptiveMinThreads, self.maxThreads, self.adaptiveTolerance, self.adaptiveBackoff)
+            self._workerPool.setLimit(self._adaptive.limit)
+        self._dispatchQueue = None
+        if self.priorityDispatch:
+            queueSize = self.priorityQueueSize
+            if queueSize <= 0:
+                queueSize = self.maxThreads
+            self._dispatchQueue = DispatchQueue(queueSize, self.priorityAging)
+            dispatcher = threading.Thread(target=self._dispatchLoop)
+            dispatcher.daemon = True
+            dispatcher.start()
+        self._replySender = None
+        if self.replySenders > 0:
+            self._replySender = ReplySender(self._stats, self.replyQueueSize, self.replySenders, self.replyBatchSize)
+            self._replySender.start()
+        for method in self._allMethods():
+            if method.processPool != None:
+                method.processPool.start()
+            if method.batcher != None:
+                method.batcher.start(lambda batch, method=method: self._dispatchBatch(method, batch))
+
+        self._pullsLock = threading.Lock()
+        self._pullsWindow = None
+        pullWorkers = self._startPullers()
 
         if not self._sharedConn and not self._addedAsStoppable:
             addStoppable(self)
@@ -353,19 +801,32 @@ class Service(object):
             self._statsTicker = threading.Timer(self.statsPeriod, self._statsTickerHandler)
             self._statsTicker.daemon = True
             self._statsTicker.start()
+        if self._pullsAutoscaled():
+            self._pullsTicker = threading.Timer(self.pullsScaleInterval, self._pullsTickerHandler)
+            self._pullsTicker.daemon = True
+            self._pullsTicker.start()
+        if self._adaptive != None:
+            self._adaptiveTicker = threading.Timer(self.adaptiveInterval, self._adaptiveTickerHandler)
+            self._adaptiveTicker.daemon = True
+            self._adaptiveTicker.start()
 
         graceful = False
         errs = None
         while True:
             cmd, reason = self._cmdQueue.get(block=True, timeout=None)
             if cmd == "stats_ticker":
+                self._logAllSuppressed()
                 if self._debugEnabled:
                     self.logWithFields(DebugLevel, self._logStatsMap(), self._logStatsMsg())
+            elif cmd == "adaptive_ticker":
+                self._adaptThreads()
+            elif cmd == "pulls_ticker":
+                self._scalePulls()
             elif cmd == "graceful" or cmd == "stop":
                 if cmd == "stop":
                     graceful = False
                     self._setStopping()
-                    self._nc.close()
+                    self._closeConn()
                     gracefulTimeout = threading.Timer(1.0, self._gracefulTimeoutHandler)
                     gracefulTimeout.daemon = True
                     gracefulTimeout.start()
@@ -380,7 +841,7 @@ class Service(object):
                     waitWorkers.daemon = True
                     waitWorkers.start()
             elif cmd == "task_workers_done":
-                self._nc.close()
+                self._closeConn()
                 waitPullers = threading.Thread(target=self._waitPullers, args=(pullWorkers,))
                 waitPullers.daemon = True
                 waitPullers.start()
@@ -389,7 +850,7 @@ class Service(object):
                 if not graceful:
                     self.logWithFields(DebugLevel, {"type": "stop"}, "stop: done")
                     break
-                self._nc.close()
+                self._closeConn()
                 errs = "graceful: timeout after {0}".format(secondsToStr(self.gracefulExit))
                 self.logWithFields(ErrorLevel, {"type": "graceful_timeout"}, errs)
                 break
@@ -408,7 +869,30 @@ class Service(object):
             gracefulTimeout.cancel()
         if self._statsTicker != None:
             self._statsTicker.cancel()
+        if self._adaptiveTicker != None:
+            self._adaptiveTicker.cancel()
+        if self._pullsTicker != None:
+            self._pullsTicker.cancel()
+        for method in self._allMethods():
+            if method.batcher != None:
+                method.batcher.stop()
+        if self._dispatchQueue != None:
+            self._dispatchQueue.close()
+        self._workerPool.shutdown()
+        if self._replySender != None:
+            self._replySender.stop(1.0)
+        if self._budgetShare != None:
+            self._budgetShare.close()
+        self._logAllSuppressed()
+        flushLog(self.gracefulExit)
+        for method in self._allMethods():
+            if method.processPool != None:
+                method.processPool.stop()
         self._nc = None
+        if not self._sharedConn:
+            if self._connPool != None:
+                self._connPool.close()
+            self._connPool = None
         self._setState(StateStopped)
 
         if errQueue != None:
@@ -420,25 +904,83 @@ class Service(object):
 
         return errs
 
+    def _startPullers(self):
+        self._pullWorkers = []
+        self._pullsAlive = set()
+        self._setPullers(self.pulls)
+        return self._pullWorkers
+
+    def _setPullers(self, n):
+        # Pullers over n retire after their current pull, missing ones are started
+        with self._pullsLock:
+            self._pullers = n
+            spawn = [i for i in range(1, n+1) if i not in self._pullsAlive]
+            self._pullsAlive.update(spawn)
+            # Forget retired pullers, in place as serve() holds the list to join them
+            self._pullWorkers[:] = [worker for worker in self._pullWorkers if worker.is_alive()]
+        for i in spawn:
+            worker = threading.Thread(target=self._taskPull, args=(i,))
+            worker.daemon = True
+            worker.start()
+            with self._pullsLock:
+                self._pullWorkers.append(worker)
+
+    def _pullerRetires(self, i):
+        with self._pullsLock:
+            if i <= self._pullers:
+                return False
+            self._pullsAlive.discard(i)
+            return True
+
+    def _pullsAutoscaled(self):
+        return self.minPulls < self.maxPulls
+
+    def _pullTimeout(self, i):
+        # Pullers that may be retired use short pulls so they notice it soon
+        if i > self.minPulls and (self.pullTimeout == 0 or self.pullTimeout > self.pullsScaleInterval):
+            return self.pullsScaleInterval
+        return self.pullTimeout
+
+    def _scalePulls(self):
+        stats = self._stats.snapshot()
+        last = self._pullsWindow
+        self._pullsWindow = stats
+        if last == None or self._isStopping():
+            return
+        done = stats["taskPullsDone"] - last["taskPullsDone"]
+        timeouts = stats["taskPullTimeouts"] - last["taskPullTimeouts"]
+        pulled = stats["tasksPulled"] - last["tasksPulled"]
+        timeoutRatio = 0.0
+        if done > 0:
+            timeoutRatio = min(float(timeouts) / done, 1.0)
+        saturated = stats["threadsUsed"] >= self._workerPool.limit()
+
+        # Pulls that keep returning tasks mean there is a backlog in nexus, but more
+        # pullers only help while there are free workers to run what they pull
+        previous = self._pullers
+        pulls = previous
+        if pulled == 0 or timeoutRatio > 0.5:
+            pulls = max(previous - 1, self.minPulls)
+        elif timeoutRatio < 0.1 and pulled >= previous and not saturated:
+            pulls = min(previous + 1, self.maxPulls)
+        if pulls != previous:
+            self.logWithFields(DebugLevel, {"type": "pulls_scale", "pulls": pulls, "previous": previous, "pulled": pulled, "timeoutRatio": timeoutRatio}, "pulls: scaling {0} -> {1} (pulled={2} timeouts={3:.0f}%)", previous, pulls, pulled, timeoutRatio * 100)
+            self._setPullers(pulls)
+
     def _taskPull(self, i):
         while True:
-            if self._isStopping():
-                return
-            self._threadsSem.acquire()
-            self._stats.addThreadsUsed(1)
-            if self._isStopping():
-                self._threadsSem.release()
-                self._stats.addThreadsUsed(-1)
+            if self._isStopping() or self._pullerRetires(i):
                 return
 
             # Make a task pull
             self._stats.addTaskPullsDone(1)
-            task, err = self._nc.taskPull(self.path, self.pullTimeout)
+            conn = self._pullConn(i)
+            task, err = conn.taskPull(self.path, self._pullTimeout(i))
             if err != None:
                 if isNexusErrCode(err, ErrTimeout):
                     self._stats.addTaskPullsTimeouts(1)
-                    self._threadsSem.release()
-                    self._stats.addThreadsUsed(-1)
+                    continue
+                if self._replaceConn(i, conn, err):
                     continue
 
                 if not self._isStopping() or not (isNexusErrCode(err, ErrCancel) or isNexusErrCode(err, ErrConnClosed)):
@@ -449,131 +991,443 @@ class Service(object):
                     except Full:
                         log(PanicLevel, "queue", "cmdQueue is full")
                         pass
-                self._nc.close()
-                self._threadsSem.release()
-                self._stats.addThreadsUsed(-1)
+                self._closeConn(i, conn)
                 return
 
-            # A task has been pulled
-            self._stats.addTasksPulled(1)
-            
-            # Get method or global handler
-            method = self._handler
-            if method == None:
-                if task.method not in self._methods:
-                    task.sendError(ErrMethodNotFound, "", None)
-                    self._stats.addTasksMethodNotFound(1)
-                    self._threadsSem.release()
-                    self._stats.addThreadsUsed(-1)
-                    continue
-                method = self._methods[task.method]
-
-            # Log the task
-            if not method.disablePullLog:
-                self.logWithFields(InfoLevel, {"type": "pull", "path": task.path, "method": task.method, "params": task.params, "tags": task.tags}, "pull {0}: task[ path={1} method={2} params={3} tags={4} ]", i, task.path, task.method, task.params, task.tags)
-
-            # Execute the task
-            taskExecute = threading.Thread(target=self._taskExecute, args=(i, method, task))
-            taskExecute.daemon = True
-            taskExecute.start()
-
-    def _taskExecute(self, n, method, task):
-        self._taskWorkersLock.acquire()
-        th = threading.current_thread()
-        self._taskWorkers[th] = True
-        self._taskWorkersLock.release()
+            # A task has been pulled, graceful stops wait for it until it's
+            # handed over to a worker or, for inline methods, answered
+            self._pulledBegin()
+            try:
+                self._dispatchPulled(i, task)
+            finally:
+                self._pulledDone()
+
+    def _dispatchPulled(self, i, task):
+        self._stats.addTasksPulled(1)
+        pulledAt = monotonicTime()
+
+        # Get method or global handler
+        method = self._handler
+        if method == None:
+            if task.method not in self._methods:
+                task.sendError(ErrMethodNotFound, "", None)
+                self._stats.addTasksMethodNotFound(1)
+                return
+            method = self._methods[task.method]
+        if self._replySender != None:
+            task.replySender = self._replySender
+            task.replyMethod = method.name
+
+        # Log the task
+        if not method.disablePullLog:
+            self._logPull(i, method, task)
+
+        # Tasks still waiting when their deadline passes are dropped before running
+        _setTaskDeadline(task, pulledAt)
+
+        # Answer from the results cache without taking a worker
+        cacheKey, cached = self._cacheLookup(method, task)
+        if cached != None:
+            _sendResponse(task, cached[0], cached[1])
+            self._stats.addTasksServed(1)
+            return
+
+        # Wait for the response of an identical task already running
+        flightKey, joined = self._flightJoin(method, task)
+        if joined:
+            return
+
+        # Run trivial methods right here so they never wait for a worker
+        if method.inline:
+            self._runInline(i, method, task, cacheKey, flightKey)
+            return
+
+        # Queue the task into the method's next batch, the puller runs it once it's full
+        if method.batcher != None and not _isMockTask(task):
+            batch = method.batcher.add((task, pulledAt, cacheKey, flightKey))
+            if batch != None:
+                self._workerPool.acquire()
+                self._stats.addThreadsUsed(1)
+                self._workerPool.submit(self._batchExecute, i, method, batch)
+            return
+
+        # Respect the method's own concurrency limit
+        state = self._bulkheadEnter(i, method, task, pulledAt, cacheKey, flightKey)
+        if state == BulkheadBusy:
+            task.sendError(ErrBusy, ErrStr[ErrBusy], None)
+            self._flightDone(method, task, flightKey, {"code": ErrBusy, "message": ErrStr[ErrBusy]})
+        if state != BulkheadRun:
+            return
+
+        # Let the dispatcher pick the most urgent task when a worker frees up
+        if self._dispatchQueue != None:
+            priority = _taskPriority(method, task)
+            self._dispatchQueue.put((self._taskExecute, (i, method, task, pulledAt, cacheKey, flightKey), priority, pulledAt), priority)
+            return
+
+        # Execute the task
+        self._workerPool.acquire()
+        self._stats.addThreadsUsed(1)
+        self._workerPool.submit(self._taskExecute, i, method, task, pulledAt, cacheKey, flightKey)
+
+    def _cacheLookup(self, method, task):
+        # Returns the cache key to store the response with and, on a hit, the cached (result, error)
+        if method.cache == None or _isMockTask(task):
+            return None, None
+        cacheKey = method.cache.key(task.params)
+        found, res, err, evicted = method.cache.get(cacheKey)
+        if evicted > 0:
+            self._stats.addCacheEvictions(evicted)
+        if found:
+            self._stats.addCacheHits(1)
+            return cacheKey, (res, err)
+        self._stats.addCacheMisses(1)
+        return cacheKey, None
+
+    def _cacheStore(self, method, task, cacheKey):
+        if cacheKey == None or "@local-repliedTo" in task.tags:
+            return
+        res = task.tags.get("@local-response-result")
+        err = task.tags.get("@local-response-error")
+        if res == None and err == None:
+            return
+        evicted = method.cache.put(cacheKey, res, err)
+        if evicted > 0:
+            self._stats.addCacheEvictions(evicted)
+
+    def _flightJoin(self, method, task):
+        # Returns the flight key the task leads, or whether it joined another task's flight
+        if method.flight == None or _isMockTask(task):
+            return None, False
+        flightKey = method.flight.key(task.params)
+        if method.flight.join(flightKey, task):
+            return flightKey, False
+        self._stats.addTasksCoalesced(1)
+        return None, True
+
+    def _flightLeave(self, method, task, flightKey, failErr=None):
+        # Returns the tasks waiting on the leader and the response to give them
+        if flightKey == None:
+            return [], None, None
+        waiters = method.flight.leave(flightKey)
+        if failErr != None:
+            return waiters, None, failErr
+        return waiters, task.tags.get("@local-response-result"), task.tags.get("@local-response-error")
+
+    def _flightDone(self, method, task, flightKey, failErr=None):
+        waiters, res, err = self._flightLeave(method, task, flightKey, failErr)
+        for waiter in waiters:
+            _sendResponse(waiter, res, err)
+        if failErr == None:
+            self._stats.addTasksServed(len(waiters))
+
+    def _bulkheadEnter(self, n, method, task, pulledAt, cacheKey, flightKey):
+        # Returns whether the task can run now, was queued or must be turned down as busy
+        if method.bulkhead == None or method.inline:
+            return BulkheadRun
+        state = method.bulkhead.enter((n, task, pulledAt, cacheKey, flightKey))
+        if state == BulkheadQueued:
+            self._stats.addTasksQueued(1)
+        elif state == BulkheadBusy:
+            self._stats.addTasksBusy(1)
+        return state
+
+    def _bulkheadTryEnter(self, method):
+        # Calls run on behalf of another task can't wait in the bulkhead's queue
+        if method.bulkhead == None or method.inline:
+            return True
+        if method.bulkhead.tryEnter():
+            return True
+        self._stats.addTasksBusy(1)
+        return False
+
+    def _bulkheadLeave(self, method):
+        # A queued task of the same method takes over the finishing task's worker
+        if method.bulkhead == None or method.inline:
+            return None
+        return method.bulkhead.leave()
+
+    def _runInline(self, n, method, task, cacheKey=None, flightKey=None):
+        self._stats.addTasksInline(1)
         self._stats.addTasksRunning(1)
+        self._runTask(n, method, task, cacheKey, flightKey)
+        self._stats.addTasksRunning(-1)
+
+    def _taskExecute(self, n, method, task, pulledAt=None, cacheKey=None, flightKey=None):
+        self._runBulkheaded(n, method, task, pulledAt, cacheKey, flightKey)
+        self._workerPool.release()
+        self._stats.addThreadsUsed(-1)
+
+    def _runBulkheaded(self, n, method, task, pulledAt=None, cacheKey=None, flightKey=None):
+        # Runs the task and then the ones queued behind it in the method's bulkhead
+        while True:
+            if pulledAt != None and self._observeWait(method, pulledAt):
+                task.sendError(ErrOverloaded, ErrStr[ErrOverloaded], None)
+                self._flightDone(method, task, flightKey, {"code": ErrOverloaded, "message": ErrStr[ErrOverloaded]})
+            else:
+                self._stats.addTasksRunning(1)
+                started = monotonicTime()
+                self._runTask(n, method, task, cacheKey, flightKey)
+                self._adaptiveSample(method, monotonicTime() - started)
+                self._stats.addTasksRunning(-1)
+            queued = self._bulkheadLeave(method)
+            if queued == None:
+                break
+            n, task, pulledAt, cacheKey, flightKey = queued
+
+    def _dispatchLoop(self):
+        # Takes a worker slot before picking so the task picked is the most urgent
+        # one when a slot frees up, but only once there is a task, so an empty
+        # queue doesn't hold a slot that counts as load
+        while True:
+            if not self._dispatchQueue.waitItem():
+                return
+            self._workerPool.acquire()
+            item = self._dispatchQueue.get()
+            f, args, priority, pulledAt = item
+            self._stats.observe("priority:" + str(priority), "wait", monotonicTime() - pulledAt)
+            self._stats.addThreadsUsed(1)
+            self._workerPool.submit(f, *args)
+            self._dispatchQueue.taskDone()
+
+    def _observeWait(self, method, pulledAt):
+        # Returns whether the task must be shed instead of run to bring waits back under target
+        now = monotonicTime()
+        wait = now - pulledAt
+        self._stats.observe(method.name, "wait", wait)
+        if self._shedder == None:
+            return False
+        self._shedder.observe(wait, now)
+        if self._shedder.admit(now):
+            return False
+        self._stats.addTasksShed(1)
+        return True
+
+    def _adaptiveSample(self, method, secs):
+        if self._adaptive != None:
+            self._adaptive.sample(method.name, secs)
+
+    def _adaptThreads(self):
+        previous = self._workerPool.limit()
+        limit = self._workerPool.setLimit(self._adaptive.update(self._workerPool.takePeak()))
+        if limit != previous:
+            self.logWithFields(DebugLevel, {"type": "adaptive_threads", "threadsLimit": limit, "previous": previous, "gradient": self._adaptive.gradient}, "adaptive: threads limit {0} -> {1} (latency gradient {2:.2f})", previous, limit, self._adaptive.gradient)
+
+    def _dispatchBatch(self, method, batch):
+        if len(batch) == 0:
+            return
+        self._workerPool.acquire()
+        self._stats.addThreadsUsed(1)
+        self._workerPool.submit(self._batchExecute, 0, method, batch)
+
+    def _flushBatches(self):
+        for method in self._allMethods():
+            if method.batcher != None:
+                self._dispatchBatch(method, method.batcher.flush())
+
+    def _batchExecute(self, n, method, batch):
+        now = monotonicTime()
+        for _, pulledAt, _, _ in batch:
+            self._stats.observe(method.name, "wait", now - pulledAt)
+        self._stats.addTasksRunning(len(batch))
+        started = monotonicTime()
+        self._runBatch(n, method, batch)
+        self._adaptiveSample(method, monotonicTime() - started)
+        self._workerPool.release()
+        self._stats.addThreadsUsed(-1)
+        self._stats.addTasksRunning(-len(batch))
 
+    def _runBatch(self, n, method, batch):
+        batch = [item for item in batch if not self._expireTask(method, item[0], item[3])]
+        if len(batch) == 0:
+            return
+        tasks = [item[0] for item in batch]
+        started = monotonicTime()
+        for task in tasks:
+            self._runPreaction(n, task)
+        handlerStarted = monotonicTime()
         try:
-            metadata = {}
-            if isinstance(task.params, dict) and "@metadata" in task.params:
-                metadata = task.params["@metadata"]
+            results = _batchResults(method.batchf([task.params for task in tasks]), len(tasks))
+        except Exception:
+            self._stats.addTaskPanic(len(tasks))
+            tbck = traceback.format_exc()
+            self.logWithFields(ErrorLevel, {"type": "task_exception"}, "pull {0}: panic serving batch of {1} tasks: {2}", n, len(tasks), tbck)
+            for task, _, _, flightKey in batch:
+                task.sendError(ErrInternal, tbck, None)
+                self._flightDone(method, task, flightKey, {"code": ErrInternal, "message": tbck})
+            return
+        handlerDone = monotonicTime()
+        self._stats.addBatches(1)
 
-            if self._preaction != None:
-                try:
-                    self._preaction(task)
-                except Exception:
-                    tbck = traceback.format_exc()
-                    self.log(ErrorLevel, {"type": "task_exception"}, "pull {0}: panic serving task on preaction: {1}", n, tbck)
+        served = 0
+        for item, result in zip(batch, results):
+            task, _, cacheKey, flightKey = item
+            try:
+                res, err = result
+                _sendResponse(task, res, err)
+                self._logResponse(n, method, task)
+                self._checkResponseSchemas(method, task)
+                self._cacheStore(method, task, cacheKey)
+                self._runPostaction(n, task)
+            except Exception:
+                tbck = self._taskPanic(n, task)
+                self._flightDone(method, task, flightKey, {"code": ErrInternal, "message": tbck})
+                continue
+            self._flightDone(method, task, flightKey)
+            served += 1
+        self._observeTask(method, started, handlerStarted, handlerDone, monotonicTime())
+        self._stats.addTasksServed(served)
+
+    def _expireTask(self, method, task, flightKey):
+        # Returns whether the task's deadline passed while it waited, after replying it
+        if not _taskExpired(task):
+            return False
+        self._stats.addTasksExpired(1)
+        task.sendError(ErrTtlExpired, "", None)
+        self._flightDone(method, task, flightKey, {"code": ErrTtlExpired, "message": ErrStr[ErrTtlExpired]})
+        return True
+
+    def _runTask(self, n, method, task, cacheKey=None, flightKey=None):
+        if self._expireTask(method, task, flightKey):
+            return
+        try:
+            metadata = _taskMetadata(task)
+            started = monotonicTime()
+            self._runPreaction(n, task)
+            handlerStarted = monotonicTime()
 
             # Pact: return mock
             if "pact" in metadata and metadata["pact"]:
-                pactOk = False
-                for pact in method.pacts:
-                    if isinstance(pact.input, dict):
-                        pact.input["@metadata"] = metadata
-                        if pact.input == task.params:
-                            pactOk = True
-                            task.sendResult(pact.output)
-                            break
-                if not pactOk:
-                    task.SendError(ErrPactNotDefined, ErrStr[ErrPactNotDefined], None)
+                self._sendPact(method, task, metadata)
             else:
-                errReturned = False
                 # Validate input schema
                 if method.inSchema != None:
                     self.log(InfoLevel, "not implemented: we should check the following input schema here: {0}", method.inSchema)
                     # Implement json schema validation!
 
                 # Execute the task
-                if not errReturned:
-                    if "testing" in metadata and metadata["testing"]:
-                        if method.testf == None:
-                            task.sendError(ErrTestingMethodNotProvided, ErrStr[ErrTestingMethodNotProvided], None)
-                            errReturned = True
-                        else:
-                            method.testf(task)
+                errReturned = False
+                if "testing" in metadata and metadata["testing"]:
+                    if method.testf == None:
+                        task.sendError(ErrTestingMethodNotProvided, ErrStr[ErrTestingMethodNotProvided], None)
+                        errReturned = True
                     else:
-                        method.f(task)
+                        method.testf(task)
+                else:
+                    method.f(task)
 
-                # Log response
-                if method.enableResponseResultLog and task.tags and "@local-response-result" in task.tags and task.tags["@local-response-result"] != None:
-                    self.logWithFields(InfoLevel, {"type": "response_result", "path": task.path, "method": task.method}, "pull {0}: task[ path={1} method={2} result={3} ]", n, task.path, task.method, task.tags["@local-response-result"])
-                if method.enableResponseErrorLog and task.tags and "@local-response-error" in task.tags and task.tags["@local-response-error"] != None:
-                    self.logWithFields(InfoLevel, {"type": "response_error", "path": task.path, "method": task.method}, "pull {0}: task[ path={1} method={2} error={3} ]", n, task.path, task.method, task.tags["@local-response-error"])
-
-                # Validate result and error schema
+                self._logResponse(n, method, task)
                 if not errReturned:
-                    if method.resSchema != None and "@local-response-result" in task.tags and task.tags["@local-response-result"] != None:
-                        self.log(InfoLevel, "not implemented: we should check the following result schema here: {0}", method.resSchema)
-                        # Implement jscon schema validation!
-                    if method.errSchema != None and "@local-response-error" in task.tags and task.tags["@local-response-error"] != None:
-                        self.log(InfoLevel, "not implemented: we should check the following error schema here: {0}", method.errSchema)
-                        # Implement jscon schema validation!
-
-            if self._postaction != None:
-                try:
-                    self._postaction(task)
-                except Exception:
-                    tbck = traceback.format_exc()
-                    self.log(ErrorLevel, {"type": "task_exception"}, "pull {0}: panic serving task on postaction: {1}", n, tbck)
+                    self._checkResponseSchemas(method, task)
+                    self._cacheStore(method, task, cacheKey)
 
+            handlerDone = monotonicTime()
+            self._runPostaction(n, task)
+            self._observeTask(method, started, handlerStarted, handlerDone, monotonicTime())
             self._stats.addTasksServed(1)
 
         except Exception:
-            self._stats.addTaskPanic(1)
-            tbck = traceback.format_exc()
-            self.logWithFields(ErrorLevel, {"type": "task_exception"}, "pull {0}: panic serving task: {1}", n, tbck)
-            task.sendError(ErrInternal, tbck, None)
-
-        self._taskWorkersLock.acquire()
-        th = threading.current_thread()
-        if th in self._taskWorkers:
-            self._taskWorkers.pop(th, None)
-        self._taskWorkersLock.release()
-        self._threadsSem.release()
-        self._stats.addThreadsUsed(-1)
-        self._stats.addTasksRunning(-1)
+            tbck = self._taskPanic(n, task)
+            self._flightDone(method, task, flightKey, {"code": ErrInternal, "message": tbck})
+            return
+        self._flightDone(method, task, flightKey)
+
+    def _observeTask(self, method, started, handlerStarted, handlerDone, done):
+        if self._preaction != None:
+            self._stats.observe(method.name, "preaction", handlerStarted - started)
+        self._stats.observe(method.name, "handler", handlerDone - handlerStarted)
+        if self._postaction != None:
+            self._stats.observe(method.name, "postaction", done - handlerDone)
+
+    def _runPreaction(self, n, task):
+        if self._preaction != None:
+            try:
+                self._preaction(task)
+            except Exception:
+                tbck = traceback.format_exc()
+                self.logWithFields(ErrorLevel, {"type": "task_exception"}, "pull {0}: panic serving task on preaction: {1}", n, tbck)
+
+    def _runPostaction(self, n, task):
+        if self._postaction != None:
+            try:
+                self._postaction(task)
+            except Exception:
+                tbck = traceback.format_exc()
+                self.logWithFields(ErrorLevel, {"type": "task_exception"}, "pull {0}: panic serving task on postaction: {1}", n, tbck)
+
+    def _sendPact(self, method, task, metadata):
+        for pact in method.pacts:
+            if isinstance(pact.input, dict):
+                pact.input["@metadata"] = metadata
+                if pact.input == task.params:
+                    task.sendResult(pact.output)
+                    return
+        task.sendError(ErrPactNotDefined, ErrStr[ErrPactNotDefined], None)
+
+    def _logPull(self, n, method, task):
+        if self._logAllowed(method, "pull"):
+            self.logWithFields(InfoLevel, {"type": "pull", "path": task.path, "method": task.method, "params": task.params, "tags": task.tags}, "pull {0}: task[ path={1} method={2} params={3} tags={4} ]", n, task.path, task.method, task.params, task.tags)
+
+    def _logAllowed(self, method, key):
+        if not isLogLevelEnabled(InfoLevel):
+            return False
+        ok, suppressed = method.logSampler.allow(key)
+        if suppressed > 0:
+            self._logSuppressed(method, key, suppressed)
+        return ok
+
+    def _logSuppressed(self, method, key, suppressed):
+        self.logWithFields(InfoLevel, {"type": "log_suppressed", "method": method.name, "log": key, "suppressed": suppressed}, "suppressed {0} {1} log lines for method {2}", suppressed, key, method.name)
+
+    def _logAllSuppressed(self):
+        for method in self._allMethods():
+            for key, suppressed in method.logSampler.takeSuppressed().items():
+                self._logSuppressed(method, key, suppressed)
+
+    def _logResponse(self, n, method, task):
+        if method.enableResponseResultLog and task.tags and "@local-response-result" in task.tags and task.tags["@local-response-result"] != None and self._logAllowed(method, "response_result"):
+            self.logWithFields(InfoLevel, {"type": "response_result", "path": task.path, "method": task.method}, "pull {0}: task[ path={1} method={2} result={3} ]", n, task.path, task.method, task.tags["@local-response-result"])
+        if method.enableResponseErrorLog and task.tags and "@local-response-error" in task.tags and task.tags["@local-response-error"] != None and self._logAllowed(method, "response_error"):
+            self.logWithFields(InfoLevel, {"type": "response_error", "path": task.path, "method": task.method}, "pull {0}: task[ path={1} method={2} error={3} ]", n, task.path, task.method, task.tags["@local-response-error"])
+
+    def _checkResponseSchemas(self, method, task):
+        if method.resSchema != None and "@local-response-result" in task.tags and task.tags["@local-response-result"] != None:
+            self.log(InfoLevel, "not implemented: we should check the following result schema here: {0}", method.resSchema)
+            # Implement jscon schema validation!
+        if method.errSchema != None and "@local-response-error" in task.tags and task.tags["@local-response-error"] != None:
+            self.log(InfoLevel, "not implemented: we should check the following error schema here: {0}", method.errSchema)
+            # Implement jscon schema validation!
+
+    def _taskPanic(self, n, task):
+        self._stats.addTaskPanic(1)
+        tbck = traceback.format_exc()
+        self.logWithFields(ErrorLevel, {"type": "task_exception"}, "pull {0}: panic serving task: {1}", n, tbck)
+        task.sendError(ErrInternal, tbck, None)
+        return tbck
+
+    def _pulledBegin(self):
+        with self._pulledCond:
+            self._pulledTasks += 1
+
+    def _pulledDone(self):
+        with self._pulledCond:
+            self._pulledTasks -= 1
+            if self._pulledTasks == 0:
+                self._pulledCond.notify_all()
+
+    def _waitPulled(self):
+        with self._pulledCond:
+            while self._pulledTasks > 0:
+                self._pulledCond.wait()
 
     def _waitWorkers(self):
-        while True:
-            self._taskWorkersLock.acquire()
-            wlist = list(self._taskWorkers.keys())
-            self._taskWorkersLock.release()
-            if len(wlist) == 0:
-                break
-            for worker in wlist:
-                worker.join()
+        self._waitPulled()
+        self._flushBatches()
+        if self._dispatchQueue != None:
+            self._dispatchQueue.join()
+        self._workerPool.wait()
+        if self._replySender != None:
+            self._replySender.drain()
         try:
             self._cmdQueue.put_nowait(("task_workers_done", ""))
         except Full:
@@ -581,6 +1435,8 @@ class Service(object):
             pass
 
     def _waitPullers(self, pullers):
+        with self._pullsLock:
+            pullers = list(pullers)
         for worker in pullers:
             worker.join()
         try:
@@ -606,10 +1462,31 @@ class Service(object):
         self._statsTicker.daemon = True
         self._statsTicker.start()
 
+    def _pullsTickerHandler(self):
+        try:
+            self._cmdQueue.put_nowait(("pulls_ticker", ""))
+        except Full:
+            log(PanicLevel, "queue", "cmdQueue is full")
+            pass
+        self._pullsTicker = threading.Timer(self.pullsScaleInterval, self._pullsTickerHandler)
+        self._pullsTicker.daemon = True
+        self._pullsTicker.start()
+
+    def _adaptiveTickerHandler(self):
+        try:
+            self._cmdQueue.put_nowait(("adaptive_ticker", ""))
+        except Full:
+            log(PanicLevel, "queue", "cmdQueue is full")
+            pass
+        self._adaptiveTicker = threading.Timer(self.adaptiveInterval, self._adaptiveTickerHandler)
+        self._adaptiveTicker.daemon = True
+        self._adaptiveTicker.start()
+
     def _setStopping(self):
         self._stopLock.acquire()
         self._stopping = True
         self._stopLock.release()
+        self._stopEvent.set()
 
     def _isStopping(self):
         self._stopLock.acquire()
@@ -641,50 +1518,251 @@ class Service(object):
             "pulls":        self.pulls,
             "pullTimeout":  secondsToStr(self.pullTimeout),
             "maxThreads":   self.maxThreads,
+            "minThreads":   self.minThreads,
             "logLevel":     self.logLevel,
             "statsPeriod":  secondsToStr(self.statsPeriod),
             "gracefulExit": secondsToStr(self.gracefulExit),
+            "adaptiveThreads": self.adaptiveThreads,
+            "shedTarget":   secondsToStr(self.shedTarget),
+            "priorityDispatch": self.priorityDispatch,
         }
 
 
     def __repr__(self):
-        tup = (self.url, self.user, self._connid, self.version, self.path, self.pulls, secondsToStr(self.pullTimeout), self.maxThreads, self.logLevel, secondsToStr(self.statsPeriod), secondsToStr(self.gracefulExit))
-        return "config: url={0} user={1} connid={2} version={3} path={4} pulls={5} pullTimeout={6} maxThreads={7} logLevel={8} statsPeriod={9} gracefulExit={10}".format(*tup)
+        tup = (self.url, self.user, self._connid, self.version, self.path, self.pulls, secondsToStr(self.pullTimeout), self.maxThreads, self.minThreads, self.logLevel, secondsToStr(self.statsPeriod), secondsToStr(self.gracefulExit))
+        return "config: url={0} user={1} connid={2} version={3} path={4} pulls={5} pullTimeout={6} maxThreads={7} minThreads={8} logLevel={9} statsPeriod={10} gracefulExit={11}".format(*tup)
 
 
     def _logStatsMap(self):
+        stats = self._stats.snapshot()
         return {
-            "threadsUsed": self._stats.threadsUsed,
+            "threadsUsed": stats["threadsUsed"],
             "threadsMax": self.maxThreads,
-            "taskPullsDone": self._stats.taskPullsDone,
-            "taskPullTimeouts": self._stats.taskPullTimeouts,
-            "tasksPulled": self._stats.tasksPulled,
-            "tasksPanic": self._stats.tasksPanic,
-            "tasksMethodNotFound": self._stats.tasksMethodNotFound,
-            "tasksServed": self._stats.tasksServed,
-            "tasksRunning": self._stats.tasksRunning,
+            "threadsSpawned": self._workerPool.workers(),
+            "threadsLimit": self._workerPool.limit(),
+            "pulls": self._pullers,
+            "taskPullsDone": stats["taskPullsDone"],
+            "taskPullTimeouts": stats["taskPullTimeouts"],
+            "tasksPulled": stats["tasksPulled"],
+            "tasksPanic": stats["tasksPanic"],
+            "tasksMethodNotFound": stats["tasksMethodNotFound"],
+            "tasksServed": stats["tasksServed"],
+            "tasksRunning": stats["tasksRunning"],
+            "cacheHits": stats["cacheHits"],
+            "cacheMisses": stats["cacheMisses"],
+            "cacheEvictions": stats["cacheEvictions"],
+            "tasksCoalesced": stats["tasksCoalesced"],
+            "batches": stats["batches"],
+            "batchCalls": stats["batchCalls"],
+            "tasksInline": stats["tasksInline"],
+            "tasksExpired": stats["tasksExpired"],
+            "tasksShed": stats["tasksShed"],
+            "shedding": self._shedder != None and self._shedder.shedding(),
+            "dispatchQueued": len(self._dispatchQueue) if self._dispatchQueue != None else 0,
+            "repliesSent": stats["repliesSent"],
+            "repliesFailed": stats["repliesFailed"],
+            "repliesOverflow": stats["repliesOverflow"],
+            "repliesQueued": self._replySender.queued() if self._replySender != None else 0,
+            "budget": self._logBudgetMap(),
+            "conns": self._logConnsMap(),
+            "reconnects": stats["reconnects"],
+            "downtime": stats["downtime"],
+            "tasksQueued": stats["tasksQueued"],
+            "tasksBusy": stats["tasksBusy"],
+            "bulkheads": self._logBulkheadsMap(),
+            "logDrops": getLogDrops(),
+            "latency": self._logLatencyMap(),
         }
 
+    def _logBulkheadsMap(self):
+        r = {}
+        for method in self._allMethods():
+            if method.bulkhead != None:
+                r[method.name] = {"running": method.bulkhead.running(), "queued": method.bulkhead.queued(), "max": method.bulkhead.maxConcurrent}
+        return r
+
+    def _logConnsMap(self):
+        if self._connPool == None:
+            return {}
+        return {"size": self._connPool.size, "alive": self._connPool.alive(), "replaced": self._connPool.replaced, "endpoints": self._connPool.health()}
+
+    def _logBudgetMap(self):
+        share = self._budgetShare
+        if share == None:
+            return {}
+        return {"used": share.used, "min": share.minimum, "weight": share.weight, "total": share.budget.total}
+
+    def _logLatencyMap(self):
+        r = {}
+        for name, phases in self._stats.latencies().items():
+            r[name] = {}
+            for phase, hist in phases.items():
+                r[name][phase] = hist.summary()
+        return r
+
     def _logStatsMsg(self):
-        tup = (self._stats.threadsUsed, self.maxThreads, self._stats.taskPullsDone, self._stats.taskPullTimeouts, self._stats.tasksPulled, self._stats.tasksPanic, self._stats.tasksMethodNotFound, self._stats.tasksServed, self._stats.tasksRunning)
-        return "stats: threads[ {0}/{1} ] task_pulls[ done={2} timeouts={3} ] tasks[ pulled={4} panic={5} errmethod={6} served={7} running={8} ]".format(*tup)
+        stats = self._stats.snapshot()
+        limit = ""
+        if self._adaptive != None:
+            limit = " limit={0}".format(self._workerPool.limit())
+        pullers = ""
+        if self._pullsAutoscaled():
+            pullers = " pullers={0}".format(self._pullers)
+        tup = (stats["threadsUsed"], self.maxThreads, limit, self._workerPool.workers(), stats["taskPullsDone"], stats["taskPullTimeouts"], pullers, stats["tasksPulled"], stats["tasksPanic"], stats["tasksMethodNotFound"], stats["tasksServed"], stats["tasksRunning"], stats["tasksInline"])
+        msg = "stats: threads[ {0}/{1}{2} spawned={3} ] task_pulls[ done={4} timeouts={5}{6} ] tasks[ pulled={7} panic={8} errmethod={9} served={10} running={11} inline={12} ]".format(*tup)
+        if stats["cacheHits"] > 0 or stats["cacheMisses"] > 0:
+            msg += " cache[ hits={0} misses={1} evictions={2} ]".format(stats["cacheHits"], stats["cacheMisses"], stats["cacheEvictions"])
+        if stats["tasksCoalesced"] > 0:
+            msg += " coalesced[ tasks={0} ]".format(stats["tasksCoalesced"])
+        if stats["batches"] > 0 or stats["batchCalls"] > 0:
+            msg += " batches[ run={0} calls={1} ]".format(stats["batches"], stats["batchCalls"])
+        if stats["tasksQueued"] > 0 or stats["tasksBusy"] > 0 or stats["tasksExpired"] > 0 or stats["tasksShed"] > 0:
+            msg += " saturation[ queued={0} busy={1} expired={2} shed={3} ]".format(stats["tasksQueued"], stats["tasksBusy"], stats["tasksExpired"], stats["tasksShed"])
+        if self._dispatchQueue != None:
+            msg += " dispatch[ queued={0} ]".format(len(self._dispatchQueue))
+        if self._replySender != None:
+            msg += " replies[ sent={0} failed={1} overflow={2} queued={3} ]".format(stats["repliesSent"], stats["repliesFailed"], stats["repliesOverflow"], self._replySender.queued())
+        if stats["reconnects"] > 0:
+            msg += " reconnects[ count={0} downtime={1} ]".format(stats["reconnects"], secondsToStr(stats["downtime"]))
+        conns = self._logConnsMap()
+        if conns:
+            msg += " conns[ alive={0}/{1} replaced={2} ]".format(conns["alive"], conns["size"], conns["replaced"])
+            if len(conns["endpoints"]) > 1:
+                for showurl, endpoint in sorted(conns["endpoints"].items()):
+                    msg += " endpoint[ {0} conns={1}{2} ]".format(showurl, endpoint["conns"], " down" if endpoint["down"] else "")
+        budget = self._logBudgetMap()
+        if budget:
+            msg += " budget[ used={0}/{1} min={2} weight={3} ]".format(budget["used"], budget["total"], budget["min"], budget["weight"])
+        for name, bulkhead in sorted(self._logBulkheadsMap().items()):
+            msg += " bulkhead[ {0} {1}/{2} queued={3} ]".format(name, bulkhead["running"], bulkhead["max"], bulkhead["queued"])
+        for name, phases in sorted(self._stats.latencies().items()):
+            lat = []
+            for phase in ["wait", "preaction", "handler", "postaction", "reply"]:
+                if phase in phases:
+                    lat.append("{0}={1:.3f}/{2:.3f}/{3:.3f}".format(phase, phases[phase].percentile(50) * 1000, phases[phase].percentile(99) * 1000, phases[phase].max * 1000))
+            msg += " latency[ {0} p50/p99/max ms: {1} ]".format(name, " ".join(lat))
+        return msg
+
+class _LocalTask(object):
+    # A call run in-process on behalf of another task: its response is kept
+    # instead of being sent to nexus
+    local = True
+
+    def __init__(self, parent, method, params):
+        self.nexusConn = parent.nexusConn
+        self.taskId = parent.taskId
+        self.path = parent.path
+        self.method = method
+        self.params = params
+        self.tags = {}
+        if isinstance(parent.tags, dict):
+            self.tags = dict((k, v) for k, v in parent.tags.items() if not k.startswith("@local-"))
+            if "@local-deadline" in parent.tags:
+                self.tags["@local-deadline"] = parent.tags["@local-deadline"]
+        self.priority = getattr(parent, "priority", 0)
+        self.detach = False
+        self.user = getattr(parent, "user", None)
+        self.response = None
+
+    def sendResult(self, result):
+        if self.response == None:
+            self.response = {"result": result}
+        return None, None
+
+    def sendError(self, code, message, data):
+        if code < 0 and code in ErrStr:
+            if message != "":
+                message = "%s:[%s]" % (ErrStr[code], message)
+            else:
+                message = ErrStr[code]
+        if self.response == None:
+            self.response = {"error": {"code": code, "message": message, "data": data}}
+        return None, None
+
+    def accept(self):
+        return None, None
+
+    def reject(self):
+        return None, None
+
+def _taskMetadata(task):
+    if isinstance(task.params, dict) and "@metadata" in task.params and isinstance(task.params["@metadata"], dict):
+        return task.params["@metadata"]
+    return {}
+
+def _setTaskDeadline(task, pulledAt):
+    # A deadline (unix time) or a timeout (seconds since the task was pulled) can
+    # come as @deadline/@timeout tags or as deadline/timeout in @metadata
+    if not isinstance(task.tags, dict):
+        return
+    metadata = _taskMetadata(task)
+    deadline = None
+    for src, prefix in [(task.tags, "@"), (metadata, "")]:
+        try:
+            if prefix + "deadline" in src:
+                deadline = pulledAt + float(src[prefix + "deadline"]) - time.time()
+            elif prefix + "timeout" in src:
+                deadline = pulledAt + float(src[prefix + "timeout"])
+        except (TypeError, ValueError):
+            continue
+        if deadline != None:
+            break
+    if deadline != None:
+        task.tags["@local-deadline"] = deadline
+
+def _taskPriority(method, task):
+    # A @priority tag overrides the method's priority, higher runs first
+    if isinstance(task.tags, dict) and "@priority" in task.tags:
+        try:
+            return int(task.tags["@priority"])
+        except (TypeError, ValueError):
+            pass
+    return method.priority
+
+def _taskExpired(task):
+    left = taskTimeLeft(task)
+    return left != None and left <= 0
+
+def taskTimeLeft(task):
+    # Returns the seconds left until the task's deadline, or None when it has none
+    if not isinstance(task.tags, dict) or "@local-deadline" not in task.tags:
+        return None
+    return task.tags["@local-deadline"] - monotonicTime()
+
+def _isMockTask(task):
+    metadata = _taskMetadata(task)
+    return ("testing" in metadata and metadata["testing"]) or ("pact" in metadata and metadata["pact"])
+
+def _batchItemWrapper(f):
+    # Runs a single task through a batch function, for tasks that are not batched
+    def wrapped(task):
+        return _batchResults(f([task.params]), 1)[0]
+    return wrapped
+
+def _batchResults(results, n):
+    if not isinstance(results, (list, tuple)) or len(results) != n:
+        raise Exception("batch method must return a list with {0} (result, error) items".format(n))
+    return results
 
 def _defMethodWrapper(f):
     def wrapped(task):
         res, err = f(task)
-        if res != None:
-            task.tags["@local-response-result"] = res
-        if err != None:
-            task.tags["@local-response-error"] = err
-        if "@local-repliedTo" in task.tags:
-            return
-        if err != None:
-            err = formatAsJsonRpcErr(err)
-            task.sendError(err["code"], err["message"], err["data"])
-        else:
-            task.sendResult(res)
+        _sendResponse(task, res, err)
     return wrapped
 
+def _sendResponse(task, res, err):
+    if res != None:
+        task.tags["@local-response-result"] = res
+    if err != None:
+        task.tags["@local-response-error"] = err
+    if "@local-repliedTo" in task.tags:
+        return
+    if err != None:
+        err = formatAsJsonRpcErr(err)
+        task.sendError(err["code"], err["message"], err["data"])
+    else:
+        task.sendResult(res)
+
 def replyToWrapper(f):
     def wrapped(task):
         if isinstance(task.params, dict) and "replyTo" in task.params and isinstance(task.params["replyTo"], dict):
@@ -692,6 +1770,11 @@ def replyToWrapper(f):
             if "path" in replyTo and isinstance(replyTo["path"], string_types) and "type" in replyTo and isinstance(replyTo["type"], string_types) and replyTo["type"] in ["pipe", "service"]:
                 res, errm = f(task)
                 task.tags["@local-repliedTo"] = True
+                sender = getattr(task, "replySender", None)
+                if sender != None:
+                    # Leave the round trips to the service's reply senders
+                    sender.put(task, replyTo["type"], replyTo["path"], {"result": res, "error": errm, "task": {"path": task.path, "method": task.method, "params": task.params, "tags": dict(task.tags)}})
+                    return res, errm
                 _, err = task.accept()
                 if err != None:
                     log(WarnLevel, "replyto wrapper", "could not accept task: {0}", errToStr(err))
@@ -19,56 +19,271 @@
 #
 ##############################################################################
 
+import math
 import threading
+import time
 
+try:
+    monotonicTime = time.monotonic
+except AttributeError:
+    monotonicTime = time.time
+
+_counters = [
+    "taskPullsDone",
+    "taskPullTimeouts",
+    "tasksPulled",
+    "tasksPanic",
+    "tasksServed",
+    "tasksMethodNotFound",
+    "tasksRunning",
+    "threadsUsed",
+    "cacheHits",
+    "cacheMisses",
+    "cacheEvictions",
+    "tasksCoalesced",
+    "batches",
+    "batchCalls",
+    "tasksInline",
+    "tasksQueued",
+    "tasksBusy",
+    "tasksExpired",
+    "tasksShed",
+    "reconnects",
+    "downtime",
+    "repliesSent",
+    "repliesFailed",
+    "repliesOverflow",
+]
+
+# Latencies are kept in microseconds: exact up to 16us and then 8 log-spaced
+# buckets per power of two (~6% error), which covers up to ~71 minutes
+_histLinear = 16
+_histSubBuckets = 8
+_histBuckets = _histLinear + (32 - 4) * _histSubBuckets
+
+def _histBucket(us):
+    if us < _histLinear:
+        return us
+    m, e = math.frexp(us)
+    i = _histLinear + (e - 5) * _histSubBuckets + int((m - 0.5) * 2 * _histSubBuckets)
+    if i >= _histBuckets:
+        return _histBuckets - 1
+    return i
+
+def _histBucketValue(i):
+    if i < _histLinear:
+        return i
+    i -= _histLinear
+    e = i // _histSubBuckets + 5
+    sub = i % _histSubBuckets
+    low = math.ldexp(0.5 + sub / (2.0 * _histSubBuckets), e)
+    high = math.ldexp(0.5 + (sub + 1) / (2.0 * _histSubBuckets), e)
+    return (low + high) / 2
+
+class Histogram(object):
+    __slots__ = ["counts", "count", "total", "max"]
+
+    def __init__(self):
+        self.counts = [0] * _histBuckets
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, secs):
+        if secs < 0:
+            secs = 0
+        self.counts[_histBucket(int(secs * 1000000))] += 1
+        self.count += 1
+        self.total += secs
+        if secs > self.max:
+            self.max = secs
+
+    def merge(self, other):
+        counts = self.counts
+        for i, c in enumerate(other.counts):
+            if c:
+                counts[i] += c
+        self.count += other.count
+        self.total += other.total
+        if other.max > self.max:
+            self.max = other.max
+
+    def percentile(self, p):
+        if self.count == 0:
+            return 0.0
+        rank = int(math.ceil(self.count * p / 100.0))
+        seen = 0
+        for i, c in enumerate(self.counts):
+            seen += c
+            if seen >= rank:
+                return min(_histBucketValue(i) / 1000000.0, self.max)
+        return self.max
+
+    def summary(self):
+        # Milliseconds, to keep stats output readable
+        return {
+            "count": self.count,
+            "avg": round(self.total * 1000 / self.count, 3) if self.count else 0.0,
+            "p50": round(self.percentile(50) * 1000, 3),
+            "p90": round(self.percentile(90) * 1000, 3),
+            "p99": round(self.percentile(99) * 1000, 3),
+            "max": round(self.max * 1000, 3),
+        }
+
+class _Shard(object):
+    __slots__ = _counters + ["hists"]
+
+    def __init__(self):
+        for name in _counters:
+            setattr(self, name, 0)
+        self.hists = {}
+
+def _counterProperty(name):
+    def get(self):
+        return self._sum(name)
+    return property(get)
+
+# Every thread adds to its own shard without locking; shards are only summed
+# when the counters are read, which happens once per stats period or @info call
 class Stats(object):
     def __init__(self):
         self._lock = threading.Lock()
-        self.taskPullsDone = 0
-        self.taskPullTimeouts = 0
-        self.tasksPulled = 0
-        self.tasksPanic = 0
-        self.tasksServed = 0
-        self.tasksMethodNotFound = 0
-        self.tasksRunning = 0
-        self.threadsUsed = 0
+        self._local = threading.local()
+        self._shards = []
+        self._base = _Shard()
 
-    def addTaskPullsDone(self, n):
+    def _shard(self):
+        try:
+            return self._local.shard
+        except AttributeError:
+            shard = _Shard()
+            self._local.shard = shard
+            self._lock.acquire()
+            self._shards.append((threading.current_thread(), shard))
+            self._lock.release()
+            return shard
+
+    def _liveShards(self):
+        # Fold the shards of finished threads into the base shard so they don't pile up
         self._lock.acquire()
-        self.taskPullsDone += n
+        live = []
+        for th, shard in self._shards:
+            if th.is_alive():
+                live.append((th, shard))
+            else:
+                for name in _counters:
+                    setattr(self._base, name, getattr(self._base, name) + getattr(shard, name))
+                for key, hist in list(shard.hists.items()):
+                    if key not in self._base.hists:
+                        self._base.hists[key] = Histogram()
+                    self._base.hists[key].merge(hist)
+        self._shards = live
+        shards = [self._base] + [shard for _, shard in live]
         self._lock.release()
+        return shards
+
+    def _sum(self, name):
+        return sum(getattr(shard, name) for shard in self._liveShards())
+
+    def snapshot(self):
+        shards = self._liveShards()
+        snap = {}
+        for name in _counters:
+            snap[name] = sum(getattr(shard, name) for shard in shards)
+        return snap
+
+    def latencies(self):
+        merged = {}
+        for shard in self._liveShards():
+            for key, hist in list(shard.hists.items()):
+                method, phase = key
+                if method not in merged:
+                    merged[method] = {}
+                if phase not in merged[method]:
+                    merged[method][phase] = Histogram()
+                merged[method][phase].merge(hist)
+        return merged
+
+    def observe(self, method, phase, secs):
+        hists = self._shard().hists
+        key = (method, phase)
+        hist = hists.get(key)
+        if hist == None:
+            hist = Histogram()
+            hists[key] = hist
+        hist.record(secs)
+
+    def addTaskPullsDone(self, n):
+        self._shard().taskPullsDone += n
 
     def addTaskPullsTimeouts(self, n):
-        self._lock.acquire()
-        self.taskPullTimeouts += n
-        self._lock.release()
+        self._shard().taskPullTimeouts += n
 
     def addTasksPulled(self, n):
-        self._lock.acquire()
-        self.tasksPulled += n
-        self._lock.release()
+        self._shard().tasksPulled += n
 
     def addTaskPanic(self, n):
-        self._lock.acquire()
-        self.tasksPanic += n
-        self._lock.release()
+        self._shard().tasksPanic += n
 
     def addTasksServed(self, n):
-        self._lock.acquire()
-        self.tasksServed += n
-        self._lock.release()
+        self._shard().tasksServed += n
 
     def addTasksMethodNotFound(self, n):
-        self._lock.acquire()
-        self.tasksMethodNotFound += n
-        self._lock.release()
+        self._shard().tasksMethodNotFound += n
 
     def addTasksRunning(self, n):
-        self._lock.acquire()
-        self.tasksRunning += n
-        self._lock.release()
+        self._shard().tasksRunning += n
 
     def addThreadsUsed(self, n):
-        self._lock.acquire()
-        self.threadsUsed += n
-        self._lock.release()
\ No newline at end of file
+        self._shard().threadsUsed += n
+
+    def addCacheHits(self, n):
+        self._shard().cacheHits += n
+
+    def addCacheMisses(self, n):
+        self._shard().cacheMisses += n
+
+    def addCacheEvictions(self, n):
+        self._shard().cacheEvictions += n
+
+    def addTasksCoalesced(self, n):
+        self._shard().tasksCoalesced += n
+
+    def addBatches(self, n):
+        self._shard().batches += n
+
+    def addBatchCalls(self, n):
+        self._shard().batchCalls += n
+
+    def addTasksInline(self, n):
+        self._shard().tasksInline += n
+
+    def addTasksQueued(self, n):
+        self._shard().tasksQueued += n
+
+    def addTasksBusy(self, n):
+        self._shard().tasksBusy += n
+
+    def addTasksExpired(self, n):
+        self._shard().tasksExpired += n
+
+    def addTasksShed(self, n):
+        self._shard().tasksShed += n
+
+    def addReconnects(self, n):
+        self._shard().reconnects += n
+
+    def addDowntime(self, secs):
+        self._shard().downtime += secs
+
+    def addRepliesSent(self, n):
+        self._shard().repliesSent += n
+
+    def addRepliesFailed(self, n):
+        self._shard().repliesFailed += n
+
+    def addRepliesOverflow(self, n):
+        self._shard().repliesOverflow += n
+
+for _name in _counters:
+    setattr(Stats, _name, _counterProperty(_name))
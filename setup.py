@@ -51,6 +51,9 @@ setup(
     packages=['nxsugarpy'],
     install_requires=[
         'pynexus',
-        'strict-rfc3339'
+        'six'
     ],
+    extras_require={
+        'fastjson': ['orjson'],
+    },
 )
@@ -0,0 +1,226 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+#    nxsugarpy, build microservices over Nexus
+#    Copyright (C) 2016 by the pynexus team
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Lesser General Public License as published
+#    by the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU Lesser General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+try:
+    from queue import Queue
+except ImportError:
+    from Queue import Queue
+
+try:
+    import asyncio
+    from nxsugarpy.asyncservice import AsyncService, asyncExecute
+except (ImportError, SyntaxError):
+    AsyncService = None
+
+import nxsugarpy.config as config
+from nxsugarpy.service import Service
+from nxsugarpy.stats import Stats
+
+class Channel(Queue):
+    # Counts the threads blocked waiting for a response
+    def __init__(self):
+        Queue.__init__(self)
+        self.getting = 0
+
+    def get(self, *args, **kwargs):
+        self.getting += 1
+        try:
+            return Queue.get(self, *args, **kwargs)
+        finally:
+            self.getting -= 1
+
+class FakeConn(object):
+    # Answers every request from another thread, as pynexus' reader thread does
+    def __init__(self, delay=0, err=None):
+        self.delay = delay
+        self.err = err
+        self.requests = []
+        self.deleted = []
+        self.channels = []
+
+    def executeNoWait(self, method, params, taskId=None):
+        if self.err != None:
+            return 0, None, self.err
+        channel = Channel()
+        self.channels.append(channel)
+        taskId = len(self.requests) + 1
+        self.requests.append((method, params))
+        def answer():
+            time.sleep(self.delay)
+            channel.put({"id": taskId, "result": {"method": method, "params": params}})
+        if self.delay > 0:
+            th = threading.Thread(target=answer)
+            th.daemon = True
+            th.start()
+        else:
+            answer()
+        return taskId, channel, None
+
+    def delId(self, taskId):
+        self.deleted.append(taskId)
+
+class LocalTask(object):
+    local = True
+
+    def __init__(self, method, params):
+        self.nexusConn = None
+        self.taskId = 1
+        self.path = "test.async"
+        self.method = method
+        self.params = params
+        self.tags = {}
+        self.response = None
+
+    def sendResult(self, result):
+        self.response = {"result": result}
+        return None, None
+
+    def sendError(self, code, message, data):
+        self.response = {"error": {"code": code, "message": message}}
+        return None, None
+
+@unittest.skipIf(AsyncService == None, "asyncio mode requires python 3.5 or newer")
+class TestAsyncExecute(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+
+    def tearDown(self):
+        self.loop.close()
+
+    def test_response_arriving_later(self):
+        conn = FakeConn(delay=0.05)
+        res, err = self.loop.run_until_complete(asyncExecute(conn, "task.push", {"a": 1}))
+        self.assertEqual(err, None)
+        self.assertEqual(res, {"method": "task.push", "params": {"a": 1}})
+        self.assertEqual(conn.deleted, [1])
+
+    def test_response_already_received(self):
+        conn = FakeConn()
+        res, err = self.loop.run_until_complete(asyncExecute(conn, "task.push", {"a": 2}))
+        self.assertEqual(err, None)
+        self.assertEqual(res["params"], {"a": 2})
+
+    def test_many_concurrent_requests(self):
+        conn = FakeConn(delay=0.01)
+        rs = self.loop.run_until_complete(asyncio.gather(*[asyncExecute(conn, "m", n) for n in range(50)]))
+        self.assertEqual([r["params"] for r, _ in rs], list(range(50)))
+
+    def test_cancelled_request_frees_waiter(self):
+        conn = FakeConn(delay=60)
+        async def cancelled():
+            fut = asyncio.ensure_future(asyncExecute(conn, "m", None))
+            await asyncio.sleep(0.05)
+            fut.cancel()
+            try:
+                await fut
+            except asyncio.CancelledError:
+                pass
+        self.loop.run_until_complete(cancelled())
+        self.assertEqual(conn.deleted, [1])
+        deadline = time.time() + 1
+        while conn.channels[0].getting > 0 and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(conn.channels[0].getting, 0)
+
+    def test_connection_closed(self):
+        conn = FakeConn(err={"code": -32007, "message": "Connection is closed"})
+        res, err = self.loop.run_until_complete(asyncExecute(conn, "m", None))
+        self.assertEqual(res, None)
+        self.assertEqual(err["code"], -32007)
+
+@unittest.skipIf(AsyncService == None, "asyncio mode requires python 3.5 or newer")
+class TestBlockingActions(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+
+    def tearDown(self):
+        self.loop.close()
+
+    def runTask(self, service, method, task):
+        service._loop = self.loop
+        service._stats = Stats()
+        ticks = [0]
+        def tick():
+            ticks[0] += 1
+            self.loop.call_later(0.01, tick)
+        self.loop.call_soon(tick)
+        self.loop.run_until_complete(service._runTaskAsync(0, service._methods[method], task))
+        return ticks[0]
+
+    def test_preaction_does_not_block_loop(self):
+        s = AsyncService("localhost", "test.async", {"preaction": lambda task: time.sleep(0.2), "postaction": lambda task: time.sleep(0.2)})
+        s.addMethod("m", lambda task: (task.params, None))
+        task = LocalTask("m", 1)
+        ticks = self.runTask(s, "m", task)
+        self.assertEqual(task.response, {"result": 1})
+        self.assertTrue(ticks >= 20, ticks)
+
+    def test_sync_testf_does_not_block_loop(self):
+        s = AsyncService("localhost", "test.async")
+        def testf(task):
+            time.sleep(0.2)
+            return "test", None
+        s.addMethod("m", lambda task: (task.params, None), testf=testf)
+        task = LocalTask("m", {"@metadata": {"testing": True}})
+        ticks = self.runTask(s, "m", task)
+        self.assertEqual(task.response, {"result": "test"})
+        self.assertTrue(ticks >= 10, ticks)
+
+@unittest.skipIf(AsyncService == None, "asyncio mode requires python 3.5 or newer")
+class TestServiceFromConfig(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.configFile = config.configFile
+        config.configFile = os.path.join(self.dir, "config.json")
+        config._configParsed = False
+        with open(config.configFile, "w") as f:
+            json.dump({"server": {"url": "localhost", "user": "root", "pass": "root"}, "services": {
+                "threaded": {"path": "test.threaded"},
+                "async": {"path": "test.async", "mode": "asyncio", "max-tasks": 64, "pulls": 2},
+            }}, f)
+
+    def tearDown(self):
+        config.configFile = self.configFile
+        config._configParsed = False
+        shutil.rmtree(self.dir)
+
+    def test_mode(self):
+        s, err = config.newServiceFromConfig("async")
+        self.assertEqual(err, None)
+        self.assertTrue(isinstance(s, AsyncService))
+        self.assertEqual((s.path, s.maxTasks, s.pulls, s.name), ("test.async", 64, 2, "async"))
+        s, err = config.newServiceFromConfig("threaded")
+        self.assertEqual(err, None)
+        self.assertFalse(isinstance(s, AsyncService))
+        self.assertTrue(isinstance(s, config.ServiceFromConfig))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+#    nxsugarpy, build microservices over Nexus
+#    Copyright (C) 2016 by the pynexus team
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Lesser General Public License as published
+#    by the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU Lesser General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+
+import threading
+import time
+import unittest
+
+from nxsugarpy.service import Service
+from nxsugarpy.stats import Stats
+from nxsugarpy.pool import WorkerPool
+from nxsugarpy.batch import Batcher
+
+class FakeTask(object):
+    def __init__(self, method, params):
+        self.nexusConn = None
+        self.taskId = 1
+        self.path = "test.batch"
+        self.method = method
+        self.params = params
+        self.tags = {}
+        self.result = None
+        self.error = None
+
+    def sendResult(self, result):
+        self.result = result
+        return None, None
+
+    def sendError(self, code, message, data):
+        self.error = {"code": code, "message": message, "data": data}
+        return None, None
+
+class TestBatchMethod(unittest.TestCase):
+    def setUp(self):
+        self.running = 0
+        self.peak = 0
+        self.lock = threading.Lock()
+        self.service = Service("localhost", "test.batch", {"maxThreads": 3, "batchConcurrency": 8})
+        self.service.addMethod("slow", self.slow)
+        self.service._stats = Stats()
+        self.service._workerPool = WorkerPool(3)
+        self.service._workerPool.start()
+
+    def tearDown(self):
+        self.service._workerPool.shutdown()
+
+    def slow(self, task):
+        with self.lock:
+            self.running += 1
+            self.peak = max(self.peak, self.running)
+        time.sleep(0.05)
+        with self.lock:
+            self.running -= 1
+        return task.params, None
+
+    def runBatch(self, params):
+        # The batch task itself holds a worker, as when it is pulled
+        self.service._workerPool.acquire()
+        task = FakeTask("@batch", params)
+        self.service._batchMethod(task)
+        self.service._workerPool.release()
+        return task
+
+    def test_responses_in_order(self):
+        task = self.runBatch([{"method": "slow", "params": n} for n in range(6)] + [{"method": "nope"}])
+        self.assertEqual(task.result[:6], [{"result": n} for n in range(6)])
+        self.assertEqual(task.result[6]["error"]["code"], -32601)
+
+    def test_concurrency_bounded_by_pool(self):
+        self.runBatch([{"method": "slow", "params": n} for n in range(12)])
+        self.assertEqual(self.peak, 3)
+        self.assertEqual(self.service._workerPool.pending(), 0)
+
+    def test_runs_alone_when_pool_is_busy(self):
+        for _ in range(2):
+            self.service._workerPool.acquire()
+        task = self.runBatch([{"method": "slow", "params": n} for n in range(4)])
+        self.assertEqual(task.result, [{"result": n} for n in range(4)])
+        self.assertEqual(self.peak, 1)
+
+    def test_invalid_params(self):
+        task = self.runBatch({"method": "slow"})
+        self.assertEqual(task.error["code"], -32602)
+
+    def test_bulkhead_busy_calls(self):
+        self.service.addMethod("limited", self.slow, methodOpts={"maxConcurrent": 1})
+        task = self.runBatch([{"method": "limited", "params": n} for n in range(3)])
+        self.assertEqual(self.peak, 1)
+        busy = [r for r in task.result if "error" in r]
+        self.assertEqual(len(busy), 2)
+        self.assertEqual([r["error"]["code"] for r in busy], [20002, 20002])
+        self.assertIn({"result": 0}, task.result)
+        self.assertEqual(self.service._methods["limited"].bulkhead.running(), 0)
+
+    def test_bulkhead_queued_task_taken_over(self):
+        queued = FakeTask("limited", "queued")
+        def limited(task):
+            # A pulled task arrives while the call holds the method's only slot
+            if task is not queued:
+                self.service._methods["limited"].bulkhead.enter((0, queued, None, None, None))
+            return task.params, None
+        self.service.addMethod("limited", limited, methodOpts={"maxConcurrent": 1})
+        task = self.runBatch([{"method": "limited", "params": 1}])
+        self.assertEqual(task.result, [{"result": 1}])
+        self.assertEqual(queued.result, "queued")
+        self.assertEqual(self.service._methods["limited"].bulkhead.running(), 0)
+
+class TestBatcher(unittest.TestCase):
+    def test_full_batch_returned_to_caller(self):
+        b = Batcher(maxBatch=3, maxWait=10)
+        self.assertEqual(b.add(1), None)
+        self.assertEqual(b.add(2), None)
+        self.assertEqual(b.add(3), [1, 2, 3])
+        self.assertEqual(b.pending(), 0)
+
+    def test_timed_out_batch_dispatched(self):
+        b = Batcher(maxBatch=100, maxWait=0.05)
+        got = []
+        done = threading.Event()
+        def dispatch(items):
+            got.append((items, time.time()))
+            done.set()
+        b.start(dispatch)
+        try:
+            start = time.time()
+            b.add(1)
+            b.add(2)
+            self.assertTrue(done.wait(2))
+            self.assertEqual(got[0][0], [1, 2])
+            self.assertGreaterEqual(got[0][1] - start, 0.04)
+            self.assertEqual(b.pending(), 0)
+        finally:
+            b.stop()
+
+    def test_deadline_restarts_after_full_batch(self):
+        b = Batcher(maxBatch=2, maxWait=0.05)
+        got = []
+        done = threading.Event()
+        def dispatch(items):
+            got.append(items)
+            done.set()
+        b.start(dispatch)
+        try:
+            b.add(1)
+            self.assertEqual(b.add(2), [1, 2])
+            b.add(3)
+            self.assertTrue(done.wait(2))
+            self.assertEqual(got, [[3]])
+        finally:
+            b.stop()
+
+    def test_flush(self):
+        b = Batcher(maxBatch=0, maxWait=-1)
+        self.assertEqual(b.maxBatch, 1)
+        self.assertEqual(b.maxWait, 0)
+        b = Batcher(maxBatch=10, maxWait=10)
+        b.add(1)
+        self.assertEqual(b.flush(), [1])
+        self.assertEqual(b.flush(), [])
+
+    def test_dispatch_panic_keeps_running(self):
+        b = Batcher(maxBatch=100, maxWait=0.01)
+        got = []
+        done = threading.Event()
+        def dispatch(items):
+            if items == ["panic"]:
+                raise Exception("panic")
+            got.append(items)
+            done.set()
+        b.start(dispatch)
+        try:
+            b.add("panic")
+            time.sleep(0.1)
+            b.add("ok")
+            self.assertTrue(done.wait(2))
+            self.assertEqual(got, [["ok"]])
+        finally:
+            b.stop()
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+#    nxsugarpy, build microservices over Nexus
+#    Copyright (C) 2016 by the pynexus team
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Lesser General Public License as published
+#    by the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU Lesser General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+
+import time
+import unittest
+
+from nxsugarpy.cache import ResultCache, SingleFlight, paramsKey
+
+class TestResultCache(unittest.TestCase):
+    def test_hit_and_miss(self):
+        c = ResultCache()
+        k = c.key({"a": 1})
+        self.assertEqual(c.get(k), (False, None, None, 0))
+        c.put(k, "res", None)
+        self.assertEqual(c.get(k), (True, "res", None, 0))
+
+    def test_key_ignores_metadata_and_order(self):
+        c = ResultCache(excludeKeys=["nonce"])
+        self.assertEqual(c.key({"a": 1, "b": 2}), c.key({"b": 2, "a": 1}))
+        self.assertEqual(c.key({"a": 1}), c.key({"a": 1, "@metadata": {"x": 1}, "nonce": 3}))
+        self.assertNotEqual(paramsKey({"a": 1}), paramsKey({"a": 1, "@metadata": {}}, excludeMetadata=False))
+
+    def test_ttl(self):
+        c = ResultCache(ttl=0.05)
+        k = c.key(1)
+        c.put(k, "res", None)
+        self.assertTrue(c.get(k)[0])
+        time.sleep(0.1)
+        self.assertEqual(c.get(k), (False, None, None, 1))
+        self.assertEqual(len(c), 0)
+
+    def test_errors(self):
+        c = ResultCache(ttl=10)
+        k = c.key(1)
+        c.put(k, None, {"code": 1})
+        self.assertFalse(c.get(k)[0])
+        c = ResultCache(ttl=10, cacheErrors=True, errorTtl=0.05)
+        c.put(k, None, {"code": 1})
+        self.assertEqual(c.get(k), (True, None, {"code": 1}, 0))
+        time.sleep(0.1)
+        self.assertFalse(c.get(k)[0])
+
+    def test_lru_eviction(self):
+        c = ResultCache(maxEntries=2)
+        c.put("a", 1, None)
+        c.put("b", 2, None)
+        c.get("a")
+        self.assertEqual(c.put("c", 3, None), 1)
+        self.assertTrue(c.get("a")[0])
+        self.assertFalse(c.get("b")[0])
+        self.assertTrue(c.get("c")[0])
+
+    def test_bytes_eviction(self):
+        c = ResultCache(maxEntries=0, maxBytes=40)
+        self.assertEqual(c.put("a", "x" * 100, None), 0)
+        self.assertEqual(len(c), 0)
+        c.put("a", "x" * 10, None)
+        c.put("b", "y" * 10, None)
+        self.assertEqual(c.put("c", "z" * 10, None), 1)
+        self.assertFalse(c.get("a")[0])
+        self.assertEqual(len(c), 2)
+        self.assertLessEqual(c._bytes, 40)
+
+    def test_overwrite(self):
+        c = ResultCache(maxBytes=1000)
+        c.put("a", "x" * 10, None)
+        size = c._bytes
+        c.put("a", "y" * 10, None)
+        self.assertEqual(c._bytes, size)
+        self.assertEqual(c.get("a")[1], "y" * 10)
+        c.clear()
+        self.assertEqual(len(c), 0)
+        self.assertEqual(c._bytes, 0)
+
+class TestSingleFlight(unittest.TestCase):
+    def test_leader_and_waiters(self):
+        f = SingleFlight()
+        k = f.key({"a": 1})
+        self.assertTrue(f.join(k, "t1"))
+        self.assertFalse(f.join(k, "t2"))
+        self.assertFalse(f.join(f.key({"a": 1, "@metadata": {}}), "t3"))
+        self.assertTrue(f.join(f.key({"a": 2}), "u1"))
+        self.assertEqual(len(f), 2)
+        self.assertEqual(f.leave(k), ["t2", "t3"])
+        self.assertEqual(len(f), 1)
+        self.assertTrue(f.join(k, "t4"))
+        self.assertEqual(f.leave(k), [])
+
+    def test_leave_unknown(self):
+        self.assertEqual(SingleFlight().leave("nope"), [])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+#    nxsugarpy, build microservices over Nexus
+#    Copyright (C) 2016 by the pynexus team
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Lesser General Public License as published
+#    by the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU Lesser General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import nxsugarpy.config as config
+from nxsugarpy.log import setLogFile
+
+class TestParseArgs(unittest.TestCase):
+    def setUp(self):
+        self.productionMode = config.productionMode
+        self.configFile = config.configFile
+
+    def tearDown(self):
+        config.productionMode = self.productionMode
+        config.configFile = self.configFile
+
+    def test_known_options(self):
+        unknown = config._parseArgs(["--production", "-c", "a.json", "-q"])
+        self.assertEqual(unknown, [])
+        self.assertTrue(config.productionMode)
+        self.assertEqual(config.configFile, "a.json")
+
+    def test_unknown_options_returned(self):
+        unknown = config._parseArgs(["--producton", "--config=b.json", "--tb=short", "-v"])
+        self.assertEqual(unknown, ["--producton", "--tb=short"])
+        self.assertFalse(config.productionMode)
+        self.assertEqual(config.configFile, "b.json")
+
+    def test_unknown_options_warned(self):
+        dir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(dir, "log")
+            setLogFile(path)
+            config._warnUnknownArgs(["--producton"])
+            setLogFile(None)
+            with open(path) as f:
+                self.assertIn("ignoring unknown option --producton", f.read())
+        finally:
+            shutil.rmtree(dir)
+
+if __name__ == "__main__":
+    unittest.main()
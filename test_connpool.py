@@ -0,0 +1,271 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+#    nxsugarpy, build microservices over Nexus
+#    Copyright (C) 2016 by the pynexus team
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Lesser General Public License as published
+#    by the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU Lesser General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+
+import threading
+import time
+import unittest
+
+from nxsugarpy import connpool
+from nxsugarpy.connpool import ConnPool, connDead
+from nxsugarpy.helpers import nexusEndpoints
+from nxsugarpy.service import Service
+from nxsugarpy.stats import Stats
+
+class FakeConn(object):
+    dials = []
+    down = set()
+
+    def __init__(self, url):
+        if url in FakeConn.down:
+            raise Exception("connection refused")
+        FakeConn.dials.append(url)
+        self.url = url
+        self.connid = "{0}-{1}".format(url, len(FakeConn.dials))
+        self.is_version_compatible = True
+        self.is_logged = True
+        self.closed = False
+        self.pings = 0
+
+    def close(self):
+        self.closed = True
+
+    def ping(self, timeout):
+        self.pings += 1
+        if self.closed:
+            return {"code": -32007, "message": "connection closed"}
+        return None
+
+    def taskPull(self, prefix, timeout=0, taskId=None):
+        self.close()
+        return None, {"code": -32007, "message": "connection closed"}
+
+class TestNexusEndpoints(unittest.TestCase):
+    def test_comma_separated(self):
+        user, password, endpoints = nexusEndpoints("tcp://u:p@a:1717, b:1718,ssl://c")
+        self.assertEqual((user, password), ("u", "p"))
+        self.assertEqual(endpoints, [
+            ("tcp://u:p@a:1717", "tcp://a:1717"),
+            ("tcp://u:p@b:1718", "tcp://b:1718"),
+            ("ssl://u:p@c:1718", "ssl://c:1718"),
+        ])
+
+    def test_list(self):
+        user, password, endpoints = nexusEndpoints(["a", "b"], "u", "p")
+        self.assertEqual([showurl for _, showurl in endpoints], ["tcp://a:1717", "tcp://b:1717"])
+        self.assertEqual(endpoints[1][0], "tcp://u:p@b:1717")
+
+    def test_empty(self):
+        _, _, endpoints = nexusEndpoints("")
+        self.assertEqual(endpoints, [("tcp://:@localhost:1717", "tcp://localhost:1717")])
+
+class TestConnDead(unittest.TestCase):
+    def test_conn_closed_error(self):
+        conn = FakeConn("a")
+        self.assertTrue(connDead(conn, {"code": -32007, "message": "connection closed"}))
+        self.assertEqual(conn.pings, 0)
+
+    def test_ping(self):
+        conn = FakeConn("a")
+        self.assertFalse(connDead(conn, {"code": -32010, "message": "permission denied"}))
+        self.assertFalse(connDead(conn))
+        conn.close()
+        self.assertTrue(connDead(conn))
+        self.assertEqual(conn.pings, 3)
+
+class TestConnPool(unittest.TestCase):
+    def setUp(self):
+        self.client = connpool.nxpy.Client
+        connpool.nxpy.Client = FakeConn
+        FakeConn.dials = []
+        FakeConn.down = set()
+        self.pool = ConnPool([("a", "a"), ("b", "b")], 3)
+        self.assertEqual(self.pool.dial(), None)
+
+    def tearDown(self):
+        self.pool.close()
+        connpool.nxpy.Client = self.client
+
+    def test_dial_spreads_over_endpoints(self):
+        self.assertEqual([self.pool.conn(i).url for i in range(3)], ["a", "b", "a"])
+        self.assertEqual(self.pool.alive(), 3)
+
+    def test_dial_fails_over(self):
+        self.pool.close()
+        FakeConn.down = set(["a"])
+        self.pool = ConnPool([("a", "a"), ("b", "b")], 2)
+        self.assertEqual(self.pool.dial(), None)
+        self.assertEqual([self.pool.conn(i).url for i in range(2)], ["b", "b"])
+        self.assertEqual(self.pool.health(), {"a": {"conns": 0, "down": True}, "b": {"conns": 2, "down": False}})
+
+    def test_dial_fails_when_all_down(self):
+        self.pool.close()
+        FakeConn.down = set(["a", "b"])
+        self.pool = ConnPool([("a", "a"), ("b", "b")], 2)
+        self.assertNotEqual(self.pool.dial(), None)
+
+    def test_discard_only_closes_failed_conn(self):
+        failed = self.pool.conn(1)
+        self.pool.discard(1, failed)
+        self.assertTrue(failed.closed)
+        self.assertFalse(self.pool.conn(0).closed)
+        self.assertFalse(self.pool.conn(2).closed)
+        self.assertEqual(self.pool.alive(), 2)
+        self.assertTrue(self.pool.health()["b"]["down"])
+
+    def test_replace_only_failed_conn(self):
+        siblings = [self.pool.conn(0), self.pool.conn(2)]
+        failed = self.pool.conn(1)
+        failed.close()
+        conn, dialed, errs = self.pool.replace(1, failed)
+        self.assertEqual(errs, None)
+        self.assertTrue(dialed)
+        # Its node is tried last, so the slot fails over to the other one
+        self.assertEqual(conn.url, "a")
+        self.assertIs(self.pool.conn(1), conn)
+        self.assertEqual([self.pool.conn(0), self.pool.conn(2)], siblings)
+        self.assertFalse(any(c.closed for c in siblings))
+        self.assertEqual(self.pool.replaced, 1)
+        self.assertEqual(self.pool.alive(), 3)
+
+    def test_replace_dead_replacement(self):
+        failed = self.pool.conn(1)
+        conn, _, _ = self.pool.replace(1, failed)
+        self.pool.discard(1, conn)
+        again, dialed, errs = self.pool.replace(1, failed)
+        self.assertTrue(dialed)
+        self.assertIsNot(again, conn)
+        self.assertTrue(conn.closed)
+        self.assertEqual(self.pool.alive(), 3)
+
+    def test_replace_already_replaced(self):
+        failed = self.pool.conn(1)
+        failed.close()
+        conn, dialed, _ = self.pool.replace(1, failed)
+        again, dialed, errs = self.pool.replace(1, failed)
+        self.assertIs(again, conn)
+        self.assertFalse(dialed)
+        self.assertEqual(self.pool.replaced, 1)
+
+    def test_replace_fails_when_all_down(self):
+        FakeConn.down = set(["a", "b"])
+        failed = self.pool.conn(0)
+        failed.close()
+        conn, dialed, errs = self.pool.replace(0, failed)
+        self.assertEqual(conn, None)
+        self.assertNotEqual(errs, None)
+        self.assertFalse(self.pool.conn(1).closed)
+
+    def test_close(self):
+        conns = [self.pool.conn(i) for i in range(3)]
+        self.pool.close()
+        self.assertTrue(all(c.closed for c in conns))
+        _, _, errs = self.pool.replace(0, conns[0])
+        self.assertEqual(errs, "connection pool closed")
+
+    def test_failed_puller_leaves_siblings_open(self):
+        service = Service("localhost", "test.connpool", {"pulls": 1})
+        service._setConnPool(self.pool, 1)
+        service._pullers = 1
+        service._stats = Stats()
+        service._pullsLock = threading.Lock()
+        service._stopLock = threading.Lock()
+        service._stopEvent = threading.Event()
+        FakeConn.down = set(["a", "b"])
+        failed = self.pool.conn(2)
+        service._taskPull(1)
+        self.assertTrue(failed.closed)
+        self.assertFalse(self.pool.conn(0).closed)
+        self.assertFalse(self.pool.conn(1).closed)
+        self.assertEqual(service._cmdQueue.get_nowait()[0], "connection_ended")
+
+class RecordingEvent(object):
+    # Records the backoff waits instead of sleeping them, and brings the
+    # nodes back up after a number of them
+    def __init__(self, upAfter):
+        self.waits = []
+        self.upAfter = upAfter
+        self.event = threading.Event()
+
+    def wait(self, timeout):
+        self.waits.append(timeout)
+        if len(self.waits) == self.upAfter:
+            FakeConn.down = set()
+        return self.event.wait(0)
+
+    def set(self):
+        self.event.set()
+
+class TestReconnect(unittest.TestCase):
+    def setUp(self):
+        self.client = connpool.nxpy.Client
+        connpool.nxpy.Client = FakeConn
+        FakeConn.dials = []
+        FakeConn.down = set()
+        self.pool = ConnPool([("a", "a"), ("b", "b")], 2)
+        self.assertEqual(self.pool.dial(), None)
+        self.service = Service("localhost", "test.reconnect", {"reconnect": True, "reconnectMinDelay": 0.1, "reconnectMaxDelay": 0.4})
+        self.service._setConnPool(self.pool, 0)
+        self.service._stats = Stats()
+        self.service._stopLock = threading.Lock()
+        self.service._stopEvent = threading.Event()
+
+    def tearDown(self):
+        self.pool.close()
+        connpool.nxpy.Client = self.client
+
+    def test_backoff_until_up(self):
+        self.service._stopEvent = RecordingEvent(5)
+        failed = self.pool.conn(1)
+        FakeConn.down = set(["a", "b"])
+        self.assertTrue(self.service._replaceConn(1, failed, {"code": -32007, "message": "connection closed"}))
+        waits = self.service._stopEvent.waits
+        self.assertEqual(len(waits), 5)
+        for wait, delay in zip(waits, [0.1, 0.2, 0.4, 0.4, 0.4]):
+            self.assertTrue(delay / 2 <= wait <= delay, (wait, delay))
+        self.assertIsNot(self.pool.conn(1), failed)
+        self.assertFalse(self.pool.conn(0).closed)
+        self.assertEqual(self.service._stats.reconnects, 1)
+
+    def test_live_conn_not_replaced(self):
+        conn = self.pool.conn(1)
+        self.assertFalse(self.service._replaceConn(1, conn, {"code": -32010, "message": "permission denied"}))
+        self.assertIs(self.pool.conn(1), conn)
+
+    def test_single_attempt_without_reconnect(self):
+        self.service.reconnect = False
+        FakeConn.down = set(["a", "b"])
+        self.assertFalse(self.service._replaceConn(1, self.pool.conn(1), {"code": -32007, "message": "connection closed"}))
+
+    def test_stop_interrupts(self):
+        FakeConn.down = set(["a", "b"])
+        failed = self.pool.conn(1)
+        result = []
+        def replace():
+            result.append(self.service._replaceConn(1, failed, {"code": -32007, "message": "connection closed"}))
+        th = threading.Thread(target=replace)
+        th.start()
+        time.sleep(0.05)
+        self.service._setStopping()
+        th.join(2)
+        self.assertEqual(result, [False])
+
+if __name__ == "__main__":
+    unittest.main()
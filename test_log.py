@@ -0,0 +1,241 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+#    nxsugarpy, build microservices over Nexus
+#    Copyright (C) 2016 by the pynexus team
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Lesser General Public License as published
+#    by the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU Lesser General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+
+import os
+import re
+import shutil
+import signal
+import tempfile
+import threading
+import time
+import unittest
+
+from nxsugarpy.log import LogSampler, log, InfoLevel, setLogFile, logFileRotates, OverflowBlock, OverflowDrop, setLogTimeMillis, _timestamp, _AsyncWriter, _RotatingFile
+
+secondsFormat = re.compile(r"^\d{4}-\d\d-\d\dT\d\d:\d\d:\d\dZ$")
+millisFormat = re.compile(r"^\d{4}-\d\d-\d\dT\d\d:\d\d:\d\d\.\d{3}Z$")
+
+def waitFor(cond, timeout=2):
+    deadline = time.time() + timeout
+    while not cond():
+        if time.time() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+class SlowOut(object):
+    def __init__(self):
+        self.chunks = []
+        self.gate = threading.Event()
+
+    def write(self, data):
+        self.gate.wait()
+        self.chunks.append(data)
+
+    def flush(self):
+        pass
+
+class TestAsyncWriter(unittest.TestCase):
+    def test_writes_in_order(self):
+        out = SlowOut()
+        out.gate.set()
+        w = _AsyncWriter(out, 100)
+        for n in range(50):
+            w.write("{0}\n".format(n))
+        self.assertTrue(w.flush(2))
+        w.close(2)
+        self.assertEqual("".join(out.chunks), "".join("{0}\n".format(n) for n in range(50)))
+
+    def test_drop_on_overflow(self):
+        out = SlowOut()
+        w = _AsyncWriter(out, 2, OverflowDrop)
+        w.write("a\n")
+        self.assertTrue(waitFor(lambda: len(w._buf) == 0))
+        for line in ["b\n", "c\n", "d\n", "e\n"]:
+            w.write(line)
+        self.assertEqual(w.dropped, 2)
+        self.assertFalse(w.flush(0.05))
+        out.gate.set()
+        self.assertTrue(w.flush(2))
+        w.close(2)
+        data = "".join(out.chunks)
+        self.assertTrue(data.startswith("a\nb\nc\n"))
+        self.assertIn("dropped 2 log lines", data)
+
+    def test_block_on_overflow(self):
+        out = SlowOut()
+        w = _AsyncWriter(out, 1, OverflowBlock)
+        w.write("a\n")
+        self.assertTrue(waitFor(lambda: len(w._buf) == 0))
+        w.write("b\n")
+        done = threading.Event()
+        def write():
+            w.write("c\n")
+            done.set()
+        threading.Thread(target=write).start()
+        self.assertFalse(done.wait(0.1))
+        out.gate.set()
+        self.assertTrue(done.wait(2))
+        w.close(2)
+        self.assertEqual("".join(out.chunks), "a\nb\nc\n")
+        self.assertEqual(w.dropped, 0)
+
+class TestRotatingFile(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, "svc.log")
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def read(self, path):
+        with open(path) as f:
+            return f.read()
+
+    def test_rotates_and_keeps_backups(self):
+        f = _RotatingFile(self.path, 10, 2)
+        for line in ["aaaaaaaa\n", "bbbbbbbb\n", "cccccccc\n", "dddddddd\n"]:
+            f.write(line)
+        f.close()
+        self.assertEqual(self.read(self.path), "dddddddd\n")
+        self.assertEqual(self.read(self.path + ".1"), "cccccccc\n")
+        self.assertEqual(self.read(self.path + ".2"), "bbbbbbbb\n")
+        self.assertFalse(os.path.exists(self.path + ".3"))
+
+    def test_no_backups_truncates(self):
+        f = _RotatingFile(self.path, 10, 0)
+        f.write("aaaaaaaa\n")
+        f.write("bbbbbbbb\n")
+        f.close()
+        self.assertEqual(self.read(self.path), "bbbbbbbb\n")
+        self.assertEqual(os.listdir(self.dir), ["svc.log"])
+
+    def test_appends_to_existing(self):
+        with open(self.path, "w") as f:
+            f.write("old\n")
+        f = _RotatingFile(self.path)
+        f.write("new\n")
+        f.close()
+        self.assertEqual(self.read(self.path), "old\nnew\n")
+
+@unittest.skipIf(not hasattr(os, "register_at_fork"), "no fork hooks")
+class TestLogFileFork(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, "svc.log")
+
+    def tearDown(self):
+        setLogFile(None)
+        shutil.rmtree(self.dir)
+
+    def test_child_logs_while_parent_writes(self):
+        setLogFile(self.path)
+        stop = threading.Event()
+        def writer():
+            n = 0
+            while not stop.is_set():
+                log(InfoLevel, "parent", "line {0}", n)
+                n += 1
+        th = threading.Thread(target=writer)
+        th.start()
+        pids = []
+        try:
+            for _ in range(10):
+                time.sleep(0.01)
+                pid = os.fork()
+                if pid == 0:
+                    log(InfoLevel, "child", "from {0}", os.getpid())
+                    os._exit(0)
+                pids.append(pid)
+            exited = [waitFor(lambda: os.waitpid(pid, os.WNOHANG)[0] == pid, 5) for pid in pids]
+        finally:
+            stop.set()
+            th.join()
+        for pid, ok in zip(pids, exited):
+            if not ok:
+                os.kill(pid, signal.SIGKILL)
+                os.waitpid(pid, 0)
+        self.assertTrue(all(exited), "a forked child deadlocked logging")
+        setLogFile(None)
+        lines = self.read()
+        for pid in pids:
+            self.assertIn("from {0}".format(pid), lines)
+        parent = [line for line in lines.splitlines() if "[parent]" in line]
+        self.assertEqual(len(parent), len(set(parent)))
+
+    def test_rotates(self):
+        self.assertFalse(logFileRotates())
+        setLogFile(self.path, 100)
+        self.assertTrue(logFileRotates())
+        setLogFile(self.path)
+        self.assertFalse(logFileRotates())
+
+    def read(self):
+        with open(self.path) as f:
+            return f.read()
+
+class TestTimestamp(unittest.TestCase):
+    def tearDown(self):
+        setLogTimeMillis(False)
+
+    def test_whole_seconds_by_default(self):
+        self.assertTrue(secondsFormat.match(_timestamp()))
+
+    def test_millis(self):
+        setLogTimeMillis(True)
+        self.assertTrue(millisFormat.match(_timestamp()))
+        setLogTimeMillis(False)
+        self.assertTrue(secondsFormat.match(_timestamp()))
+
+class TestLogSampler(unittest.TestCase):
+    def test_passthrough(self):
+        s = LogSampler()
+        for _ in range(100):
+            self.assertEqual(s.allow("k"), (True, 0))
+
+    def test_every(self):
+        s = LogSampler(every=3)
+        allowed = [s.allow("k")[0] for _ in range(9)]
+        self.assertEqual(allowed, [True, False, False] * 3)
+        self.assertTrue(s.allow("other")[0])
+
+    def test_rate_zero(self):
+        s = LogSampler(rate=0)
+        self.assertFalse(any(s.allow("k")[0] for _ in range(50)))
+
+    def test_limit_counts_suppressed(self):
+        s = LogSampler(limit=1, burst=2)
+        self.assertEqual(s.allow("k"), (True, 0))
+        self.assertEqual(s.allow("k"), (True, 0))
+        self.assertEqual(s.allow("k"), (False, 0))
+        self.assertEqual(s.allow("k"), (False, 0))
+        self.assertEqual(s.takeSuppressed(), {"k": 2})
+        self.assertEqual(s.takeSuppressed(), {})
+
+    def test_limit_reports_suppressed_on_next_allowed(self):
+        s = LogSampler(limit=1, burst=1)
+        self.assertTrue(s.allow("k")[0])
+        self.assertFalse(s.allow("k")[0])
+        s._buckets["k"][1] -= 1
+        self.assertEqual(s.allow("k"), (True, 1))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,390 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+#    nxsugarpy, build microservices over Nexus
+#    Copyright (C) 2016 by the pynexus team
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Lesser General Public License as published
+#    by the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU Lesser General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+
+import threading
+import time
+import unittest
+
+import os
+
+from nxsugarpy.pool import WorkerPool, AdaptiveLimit, CoDel, ThreadBudget, DispatchQueue, Bulkhead, BulkheadRun, BulkheadQueued, BulkheadBusy, ProcessPool, processable
+
+def processDouble(task):
+    if task.params == "panic":
+        raise Exception("panic")
+    return {"value": task.params * 2, "pid": os.getpid(), "tags": task.tags}, None
+
+def waitFor(cond, timeout=2):
+    deadline = time.time() + timeout
+    while not cond():
+        if time.time() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+class TestWorkerPool(unittest.TestCase):
+    def test_runs_submitted_tasks(self):
+        pool = WorkerPool(4)
+        pool.start()
+        done = []
+        lock = threading.Lock()
+        def work(n):
+            with lock:
+                done.append(n)
+            pool.release()
+        for n in range(20):
+            pool.acquire()
+            pool.submit(work, n)
+        pool.wait()
+        pool.shutdown()
+        self.assertEqual(sorted(done), list(range(20)))
+
+    def test_slots(self):
+        pool = WorkerPool(2)
+        self.assertTrue(pool.tryAcquire())
+        self.assertTrue(pool.tryAcquire())
+        self.assertFalse(pool.tryAcquire())
+        pool.release()
+        self.assertTrue(pool.tryAcquire())
+
+    def test_set_limit(self):
+        pool = WorkerPool(4)
+        self.assertEqual(pool.setLimit(10), 4)
+        self.assertEqual(pool.setLimit(0), 1)
+        self.assertEqual(pool.setLimit(2), 2)
+        self.assertTrue(pool.tryAcquire())
+        self.assertTrue(pool.tryAcquire())
+        self.assertFalse(pool.tryAcquire())
+        self.assertEqual(pool.takePeak(), 2)
+
+    def test_set_limit_wakes_waiters(self):
+        pool = WorkerPool(2)
+        pool.setLimit(1)
+        pool.acquire()
+        acquired = threading.Event()
+        def waiter():
+            pool.acquire()
+            acquired.set()
+        th = threading.Thread(target=waiter)
+        th.daemon = True
+        th.start()
+        self.assertFalse(acquired.wait(0.1))
+        pool.setLimit(2)
+        self.assertTrue(acquired.wait(2))
+
+    def test_reaps_idle_workers(self):
+        pool = WorkerPool(4, 1, idleTimeout=0.05)
+        pool.start()
+        self.assertEqual(pool.workers(), 1)
+        gate = threading.Event()
+        def work():
+            gate.wait()
+            pool.release()
+        for _ in range(4):
+            pool.acquire()
+            pool.submit(work)
+        self.assertEqual(pool.workers(), 4)
+        gate.set()
+        pool.wait()
+        self.assertTrue(waitFor(lambda: pool.workers() == 1))
+        pool.shutdown()
+
+class TestAdaptiveLimit(unittest.TestCase):
+    def test_slow_start_doubles_while_saturated(self):
+        a = AdaptiveLimit(1, 16)
+        self.assertEqual(a.update(1), 1)
+        for want in [2, 4, 8, 16, 16]:
+            a.sample("m", 0.01)
+            self.assertEqual(a.update(a.limit), want)
+
+    def test_no_growth_when_not_saturated(self):
+        a = AdaptiveLimit(2, 16)
+        a.sample("m", 0.01)
+        self.assertEqual(a.update(1), 2)
+
+    def test_backs_off_then_grows_by_one(self):
+        a = AdaptiveLimit(1, 100, tolerance=2.0, backoff=0.5)
+        a.limit = 20
+        a.sample("m", 0.01)
+        a.update(0)
+        a.sample("m", 0.05)
+        self.assertEqual(a.update(20), 10)
+        self.assertAlmostEqual(a.gradient, 5.0, delta=0.3)
+        a.sample("m", 0.01)
+        self.assertEqual(a.update(10), 11)
+        for _ in range(20):
+            a.sample("m", 1)
+            a.update(100)
+        self.assertEqual(a.limit, 1)
+
+    def test_baseline_per_method(self):
+        a = AdaptiveLimit(4, 16)
+        a.sample("fast", 0.001)
+        a.sample("slow", 1.0)
+        a.update(0)
+        # A shift in the mix towards the slow method isn't a slowdown
+        for _ in range(10):
+            a.sample("slow", 1.0)
+        self.assertEqual(a.update(4), 8)
+        self.assertAlmostEqual(a.gradient, 1.0)
+
+class TestCoDel(unittest.TestCase):
+    def test_no_shedding_under_target(self):
+        c = CoDel(0.01, 0.1)
+        for i in range(100):
+            c.observe(0.005, i * 0.01)
+            self.assertTrue(c.admit(i * 0.01))
+        self.assertFalse(c.shedding())
+
+    def test_sheds_after_an_interval_above_target(self):
+        c = CoDel(0.01, 0.1)
+        c.observe(0.05, 0.0)
+        self.assertTrue(c.admit(0.05))
+        c.observe(0.05, 0.1)
+        self.assertTrue(c.shedding())
+        self.assertFalse(c.admit(0.1))
+        self.assertTrue(c.admit(0.15))
+        self.assertFalse(c.admit(0.2))
+        # The next shed comes sooner: interval / sqrt(count)
+        self.assertTrue(c.admit(0.27))
+        self.assertFalse(c.admit(0.28))
+
+    def test_stops_when_wait_recovers(self):
+        c = CoDel(0.01, 0.1)
+        c.observe(0.05, 0.0)
+        c.observe(0.05, 0.1)
+        self.assertTrue(c.shedding())
+        c.observe(0.0, 0.15)
+        c.observe(0.0, 0.2)
+        self.assertFalse(c.shedding())
+        self.assertTrue(c.admit(0.2))
+
+    def test_idle_interval_resets(self):
+        c = CoDel(0.01, 0.1)
+        c.observe(0.05, 0.0)
+        c.observe(0.05, 0.1)
+        self.assertTrue(c.shedding())
+        c.observe(0.05, 0.5)
+        self.assertFalse(c.shedding())
+        self.assertTrue(c.admit(0.5))
+
+class TestThreadBudget(unittest.TestCase):
+    def test_total(self):
+        b = ThreadBudget(2)
+        a = b.share("a")
+        c = b.share("c")
+        self.assertTrue(a.tryAcquire())
+        self.assertTrue(a.tryAcquire())
+        self.assertFalse(c.tryAcquire())
+        a.release()
+        self.assertTrue(c.tryAcquire())
+
+    def test_minimum_is_clamped(self):
+        b = ThreadBudget(4)
+        self.assertEqual(b.share("a", minimum=3).minimum, 3)
+        self.assertEqual(b.share("c", minimum=3).minimum, 1)
+        self.assertEqual(b.share("d", minimum=3).minimum, 0)
+
+    def test_waiting_minimum_goes_first(self):
+        b = ThreadBudget(2)
+        a = b.share("a")
+        c = b.share("c", minimum=1)
+        a.acquire()
+        a.acquire()
+        got = threading.Event()
+        def acquire():
+            c.acquire()
+            got.set()
+        threading.Thread(target=acquire).start()
+        self.assertTrue(waitFor(lambda: c.waiting == 1))
+        a.release()
+        self.assertFalse(a.tryAcquire())
+        self.assertTrue(got.wait(2))
+        self.assertEqual(c.used, 1)
+
+    def test_weighted_part_while_others_wait(self):
+        b = ThreadBudget(4)
+        a = b.share("a", weight=3)
+        c = b.share("c", weight=1)
+        c.waiting = 1
+        for _ in range(3):
+            self.assertTrue(a.tryAcquire())
+        self.assertFalse(a.tryAcquire())
+        c.waiting = 0
+        self.assertTrue(a.tryAcquire())
+
+    def test_close_wakes_waiters(self):
+        b = ThreadBudget(1)
+        a = b.share("a")
+        c = b.share("c")
+        a.acquire()
+        got = threading.Event()
+        def acquire():
+            c.acquire()
+            got.set()
+        threading.Thread(target=acquire).start()
+        self.assertTrue(waitFor(lambda: c.waiting == 1))
+        a.release()
+        a.close()
+        self.assertTrue(got.wait(2))
+        self.assertEqual(b._shares, [c])
+
+    def test_worker_pool_budget(self):
+        b = ThreadBudget(1)
+        p1 = WorkerPool(2)
+        p2 = WorkerPool(2)
+        p1.setBudget(b.share("p1"))
+        p2.setBudget(b.share("p2"))
+        self.assertTrue(p1.tryAcquire())
+        self.assertFalse(p2.tryAcquire())
+        self.assertEqual(p2._used, 0)
+        p1.release()
+        self.assertTrue(p2.tryAcquire())
+
+class TestDispatchQueue(unittest.TestCase):
+    def test_priority_order(self):
+        q = DispatchQueue(aging=10)
+        q.put("low", 0)
+        q.put("high", 5)
+        q.put("mid", 2)
+        q.put("mid2", 2)
+        self.assertEqual([q.get() for _ in range(4)], ["high", "mid", "mid2", "low"])
+
+    def test_aging(self):
+        q = DispatchQueue(aging=0.05)
+        q.put("old", 0)
+        time.sleep(0.2)
+        q.put("new", 2)
+        self.assertEqual(q.get(), "old")
+        self.assertEqual(q.get(), "new")
+
+    def test_max_size_blocks(self):
+        q = DispatchQueue(maxSize=1)
+        q.put(1, 0)
+        done = threading.Event()
+        def put():
+            q.put(2, 0)
+            done.set()
+        threading.Thread(target=put).start()
+        self.assertFalse(done.wait(0.1))
+        self.assertEqual(q.get(), 1)
+        self.assertTrue(done.wait(2))
+        self.assertEqual(len(q), 1)
+        q.put(3, 0, block=False)
+        self.assertEqual(len(q), 2)
+
+    def test_wait_item(self):
+        q = DispatchQueue()
+        waited = []
+        th = threading.Thread(target=lambda: waited.append(q.waitItem()))
+        th.start()
+        th.join(0.1)
+        self.assertEqual(waited, [])
+        q.put(1, 0)
+        th.join(2)
+        self.assertEqual(waited, [True])
+        self.assertEqual(len(q), 1)
+        self.assertEqual(q.get(), 1)
+        q.close()
+        self.assertFalse(q.waitItem())
+
+    def test_join_and_close(self):
+        q = DispatchQueue()
+        q.put(1, 0)
+        joined = threading.Event()
+        def join():
+            q.join()
+            joined.set()
+        threading.Thread(target=join).start()
+        self.assertEqual(q.get(), 1)
+        self.assertFalse(joined.wait(0.1))
+        q.taskDone()
+        self.assertTrue(joined.wait(2))
+        q.put(2, 0)
+        q.close()
+        self.assertEqual(q.get(), 2)
+        self.assertEqual(q.get(), None)
+
+class TestBulkhead(unittest.TestCase):
+    def test_queues_up_to_max_concurrent_by_default(self):
+        b = Bulkhead(2)
+        self.assertEqual(b.enter(1), BulkheadRun)
+        self.assertEqual(b.enter(2), BulkheadRun)
+        self.assertEqual(b.enter(3), BulkheadQueued)
+        self.assertEqual(b.enter(4), BulkheadQueued)
+        self.assertEqual(b.enter(5), BulkheadBusy)
+        self.assertEqual((b.running(), b.queued()), (2, 2))
+
+    def test_max_queued(self):
+        b = Bulkhead(1, maxQueued=3)
+        self.assertEqual(b.enter(1), BulkheadRun)
+        for n in range(3):
+            self.assertEqual(b.enter(n), BulkheadQueued)
+        self.assertEqual(b.enter(4), BulkheadBusy)
+
+    def test_no_queue(self):
+        b = Bulkhead(1, queue=False)
+        self.assertEqual(b.enter(1), BulkheadRun)
+        self.assertEqual(b.enter(2), BulkheadBusy)
+
+    def test_leave_hands_over_queued(self):
+        b = Bulkhead(1)
+        b.enter("a")
+        b.enter("b")
+        self.assertEqual(b.leave(), "b")
+        self.assertEqual(b.running(), 1)
+        self.assertEqual(b.leave(), None)
+        self.assertEqual(b.running(), 0)
+        self.assertEqual(b.enter("c"), BulkheadRun)
+
+class ProcessCall(object):
+    def __init__(self, params, tags=None):
+        self.params = params
+        self.tags = tags if tags != None else {}
+
+class TestProcessPool(unittest.TestCase):
+    def test_runs_in_other_processes(self):
+        pool = ProcessPool(processDouble, processes=2, maxTasksPerChild=2)
+        pool.start()
+        try:
+            pids = set()
+            for n in range(6):
+                res, err = pool.call(ProcessCall(n, {"n": n}))
+                self.assertEqual(err, None)
+                self.assertEqual(res["value"], n * 2)
+                self.assertEqual(res["tags"], {"n": n})
+                pids.add(res["pid"])
+            self.assertNotIn(os.getpid(), pids)
+            # Workers are recycled every two tasks
+            self.assertTrue(len(pids) >= 3)
+            self.assertRaises(Exception, pool.call, ProcessCall("panic"))
+        finally:
+            pool.stop()
+
+    def test_processable(self):
+        def nested(task):
+            return None, None
+        self.assertTrue(processable(processDouble))
+        self.assertFalse(processable(nested))
+        self.assertFalse(processable(lambda task: (None, None)))
+
+if __name__ == "__main__":
+    unittest.main()
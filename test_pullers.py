@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+#    nxsugarpy, build microservices over Nexus
+#    Copyright (C) 2016 by the pynexus team
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Lesser General Public License as published
+#    by the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU Lesser General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+
+import threading
+import time
+import unittest
+
+from nxsugarpy.service import Service
+
+def waitFor(cond, timeout=2):
+    deadline = time.time() + timeout
+    while not cond():
+        if time.time() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+class TestPullers(unittest.TestCase):
+    def setUp(self):
+        self.service = Service("localhost", "test.pullers", {"pulls": 1, "minPulls": 1, "maxPulls": 8})
+        self.service._pullsLock = threading.Lock()
+        self.service._stopLock = threading.Lock()
+        self.stop = threading.Event()
+        def taskPull(i):
+            # Stands in for a pull loop, checking for retirement after every pull
+            while not self.stop.is_set() and not self.service._pullerRetires(i):
+                time.sleep(0.005)
+        self.service._taskPull = taskPull
+
+    def tearDown(self):
+        self.stop.set()
+
+    def alive(self):
+        return len([w for w in self.service._pullWorkers if w.is_alive()])
+
+    def test_scale_up_and_down(self):
+        workers = self.service._startPullers()
+        self.assertEqual(self.alive(), 1)
+        self.service._setPullers(5)
+        self.assertEqual(self.alive(), 5)
+        self.assertEqual(self.service._pullsAlive, set([1, 2, 3, 4, 5]))
+        self.service._setPullers(2)
+        self.assertTrue(waitFor(lambda: self.alive() == 2))
+        self.assertEqual(self.service._pullsAlive, set([1, 2]))
+        self.assertTrue(workers is self.service._pullWorkers)
+
+    def test_retired_pullers_are_forgotten(self):
+        workers = self.service._startPullers()
+        for _ in range(20):
+            self.service._setPullers(8)
+            self.service._setPullers(1)
+            self.assertTrue(waitFor(lambda: self.alive() == 1))
+        self.service._setPullers(8)
+        self.assertTrue(len(workers) <= 9, len(workers))
+        self.assertEqual(self.alive(), 8)
+
+if __name__ == "__main__":
+    unittest.main()
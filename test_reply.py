@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+#    nxsugarpy, build microservices over Nexus
+#    Copyright (C) 2016 by the pynexus team
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Lesser General Public License as published
+#    by the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU Lesser General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+
+import threading
+import time
+import unittest
+
+try:
+    from Queue import Queue
+except ImportError:
+    from queue import Queue
+
+from nxsugarpy.reply import ReplySender, _executeAll
+from nxsugarpy.stats import Stats
+
+class FakeConn(object):
+    def __init__(self, answer=True, errors={}):
+        self.answer = answer
+        self.errors = errors
+        self.calls = []
+        self.deleted = []
+        self.ids = 0
+        self.lock = threading.Lock()
+
+    def executeNoWait(self, method, params, taskId=None):
+        with self.lock:
+            self.ids += 1
+            taskId = self.ids
+            self.calls.append((method, params))
+        channel = Queue()
+        if self.answer:
+            if method in self.errors:
+                channel.put({"id": taskId, "error": self.errors[method]})
+            else:
+                channel.put({"id": taskId, "result": None})
+        return taskId, channel, None
+
+    def delId(self, taskId):
+        with self.lock:
+            self.deleted.append(taskId)
+
+    def pipeOpen(self, pipeId):
+        return FakePipe(pipeId), None
+
+    def methods(self):
+        with self.lock:
+            return [method for method, _ in self.calls]
+
+class FakePipe(object):
+    def __init__(self, pipeId):
+        self.pipeId = pipeId
+
+class FakeTask(object):
+    def __init__(self, conn, taskId):
+        self.nexusConn = conn
+        self.taskId = taskId
+        self.method = "m"
+
+class TestExecuteAll(unittest.TestCase):
+    def test_all_sent(self):
+        conn = FakeConn(errors={"b": {"code": 1, "message": "b"}})
+        errs = _executeAll([(conn, "a", 1), (conn, "b", 2), (conn, "c", 3)], 1)
+        self.assertEqual(errs, [None, {"code": 1, "message": "b"}, None])
+        self.assertEqual(conn.methods(), ["a", "b", "c"])
+        self.assertEqual(sorted(conn.deleted), [1, 2, 3])
+
+    def test_timeout(self):
+        conn = FakeConn(answer=False)
+        start = time.time()
+        errs = _executeAll([(conn, "a", 1), (conn, "b", 2)], 0.1)
+        self.assertLess(time.time() - start, 1)
+        self.assertEqual([err["code"] for err in errs], [-32000, -32000])
+        self.assertEqual(sorted(conn.deleted), [1, 2])
+
+class TestReplySender(unittest.TestCase):
+    def setUp(self):
+        self.stats = Stats()
+        self.conn = FakeConn()
+
+    def test_accepts_batch_before_replying(self):
+        sender = ReplySender(self.stats)
+        sender._send([
+            (FakeTask(self.conn, 1), "pipe", "pipe1", {"result": 1}, 0),
+            (FakeTask(self.conn, 2), "push", "test.reply.method", {"result": 2}, 0),
+        ])
+        self.assertEqual(self.conn.methods(), ["task.result", "task.result", "pipe.write", "task.push"])
+        self.assertEqual(self.conn.calls[2][1], {"pipeid": "pipe1", "msg": {"result": 1}})
+        self.assertEqual(self.stats.repliesSent, 2)
+
+    def test_not_accepted_not_replied(self):
+        self.conn.errors = {"task.result": {"code": -32001, "message": "cancel"}}
+        sender = ReplySender(self.stats)
+        sender._send([(FakeTask(self.conn, 1), "push", "test.reply.method", {}, 0)])
+        self.assertEqual(self.conn.methods(), ["task.result"])
+        self.assertEqual(self.stats.repliesFailed, 1)
+
+    def test_batches(self):
+        sender = ReplySender(self.stats, queueSize=16, maxBatch=3)
+        batches = []
+        send = sender._send
+        def record(items):
+            batches.append(len(items))
+            send(items)
+        sender._send = record
+        for n in range(7):
+            sender.put(FakeTask(self.conn, n), "push", "test.reply.method", {})
+        sender.start()
+        sender.drain()
+        sender.stop(1)
+        self.assertEqual(batches, [3, 3, 1])
+        self.assertEqual(self.stats.repliesSent, 7)
+        self.assertEqual(self.conn.methods().count("task.push"), 7)
+
+    def test_overflow_sent_by_caller(self):
+        sender = ReplySender(self.stats, queueSize=1)
+        sender.put(FakeTask(self.conn, 1), "push", "test.reply.method", {})
+        sender.put(FakeTask(self.conn, 2), "push", "test.reply.method", {})
+        self.assertEqual(self.stats.repliesOverflow, 1)
+        self.assertEqual(self.stats.repliesSent, 1)
+        self.assertEqual(sender.queued(), 1)
+        sender.start()
+        sender.drain()
+        sender.stop(1)
+        self.assertEqual(self.stats.repliesSent, 2)
+
+    def test_overflow_send_errors_counted(self):
+        sender = ReplySender(self.stats, queueSize=1)
+        def fail(items):
+            raise Exception("boom")
+        sender._send = fail
+        sender.put(FakeTask(self.conn, 1), "push", "test.reply.method", {})
+        sender.put(FakeTask(self.conn, 2), "push", "test.reply.method", {})
+        self.assertEqual(self.stats.repliesOverflow, 1)
+        self.assertEqual(self.stats.repliesFailed, 1)
+
+    def test_latency_under_method_entry(self):
+        task = FakeTask(self.conn, 1)
+        task.replyMethod = "handler"
+        sender = ReplySender(self.stats)
+        sender._send([(task, "push", "test.reply.method", {}, 0)])
+        self.assertEqual(list(self.stats.latencies().keys()), ["handler"])
+        self.assertIn("reply", self.stats.latencies()["handler"])
+
+    def test_timeout(self):
+        conn = FakeConn(answer=False)
+        sender = ReplySender(self.stats, timeout=0.1)
+        sender.start()
+        sender.put(FakeTask(conn, 1), "push", "test.reply.method", {})
+        sender.drain()
+        sender.stop(1)
+        self.assertEqual(self.stats.repliesFailed, 1)
+        self.assertEqual(conn.deleted, [1])
+
+if __name__ == "__main__":
+    unittest.main()
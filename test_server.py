@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+#    nxsugarpy, build microservices over Nexus
+#    Copyright (C) 2016 by the pynexus team
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Lesser General Public License as published
+#    by the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU Lesser General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+from nxsugarpy import server
+from nxsugarpy.server import Server
+from nxsugarpy.log import setLogFile
+
+class ScriptedServer(Server):
+    # Pre-fork server whose workers follow a script instead of serving nexus:
+    # each run of a worker takes the next step, "crash" exits abruptly,
+    # "wait" runs until the worker is stopped and anything else is returned
+    # as the worker's error
+    def __init__(self, url, runs, script):
+        Server.__init__(self, url)
+        self.runs = runs
+        self.script = script
+        self.worker = 0
+        self.stopped = None
+
+    def _serveWorker(self, i, ctlRecv, errQ):
+        self.worker = i
+        self.stopped = threading.Event()
+        Server._serveWorker(self, i, ctlRecv, errQ)
+
+    def gracefulStop(self):
+        if self.stopped != None:
+            self.stopped.set()
+            return
+        Server.gracefulStop(self)
+
+    def serve(self):
+        if self.workers > 1:
+            return Server.serve(self)
+        path = os.path.join(self.runs, str(self.worker))
+        with open(path, "a") as f:
+            f.write("x")
+        with open(path) as f:
+            run = len(f.read()) - 1
+        step = self.script[min(run, len(self.script) - 1)]
+        if step == "crash":
+            os._exit(3)
+        if step == "wait":
+            self.stopped.wait(10)
+            return None
+        return step
+
+@unittest.skipIf(server._forkContext() == None, "fork not available")
+class TestPrefork(unittest.TestCase):
+    def setUp(self):
+        self.runs = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.runs)
+
+    def newServer(self, script):
+        s = ScriptedServer("localhost", self.runs, script)
+        s.workerRestartDelay = 0.1
+        s.addService("svc", "test.prefork")
+        s.setWorkers(2)
+        return s
+
+    def runsOf(self, worker):
+        with open(os.path.join(self.runs, str(worker))) as f:
+            return len(f.read())
+
+    def test_fork_context(self):
+        self.assertEqual(server._forkContext().get_start_method(), "fork")
+
+    def test_restarts_crashed_workers(self):
+        self.assertEqual(self.newServer(["crash", None]).serve(), None)
+        self.assertEqual(sorted(os.listdir(self.runs)), ["1", "2"])
+
+    def test_restarts_failed_workers_with_backoff(self):
+        start = time.time()
+        self.assertEqual(self.newServer(["boom", "boom", None]).serve(), "boom")
+        # Restarted after 0.1s and then 0.2s
+        self.assertGreaterEqual(time.time() - start, 0.3)
+        self.assertEqual(self.runsOf(1), 3)
+        self.assertEqual(self.runsOf(2), 3)
+
+    def test_graceful_stop(self):
+        s = self.newServer(["wait"])
+        threading.Timer(0.3, s.gracefulStop).start()
+        self.assertEqual(s.serve(), None)
+        self.assertEqual(self.runsOf(1), 1)
+        self.assertEqual(self.runsOf(2), 1)
+
+    def test_stop_requests_dont_take_the_lock(self):
+        # As in a signal handler interrupting the supervise loop while it holds the lock
+        s = self.newServer(["wait"])
+        s._workerProcs = {}
+        with s._workerLock:
+            s.gracefulStop()
+            s.stop()
+            s.gracefulStop()
+        self.assertEqual(s._workerStopReq, "stop")
+        self.assertEqual(s._workerStop, None)
+
+    def test_rejects_rotated_log_file(self):
+        setLogFile(os.path.join(self.runs, "svc.log"), 1024)
+        try:
+            errs = self.newServer([None]).serve()
+        finally:
+            setLogFile(None)
+        self.assertIn("rotated log file", errs)
+        self.assertFalse(os.path.exists(os.path.join(self.runs, "1")))
+
+    def test_requires_fork(self):
+        forkContext = server._forkContext
+        server._forkContext = lambda: None
+        try:
+            errs = self.newServer([None]).serve()
+        finally:
+            server._forkContext = forkContext
+        self.assertIn("require fork", errs)
+        self.assertEqual(os.listdir(self.runs), [])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+#    nxsugarpy, build microservices over Nexus
+#    Copyright (C) 2016 by the pynexus team
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Lesser General Public License as published
+#    by the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU Lesser General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+
+import threading
+import unittest
+
+from nxsugarpy.stats import Stats, Histogram, _histBucket, _histBucketValue, _histBuckets, _histLinear
+
+class TestHistogram(unittest.TestCase):
+    def test_exact_below_linear(self):
+        for us in range(_histLinear):
+            self.assertEqual(_histBucket(us), us)
+            self.assertEqual(_histBucketValue(us), us)
+
+    def test_bucket_error(self):
+        us = _histLinear
+        while us < 2 ** 32:
+            value = _histBucketValue(_histBucket(us))
+            self.assertLess(abs(value - us) / float(us), 0.07)
+            us = int(us * 1.3) + 1
+
+    def test_range(self):
+        # The last bucket ends at 2^32us, ~71 minutes
+        self.assertEqual(_histBucket(2 ** 32 - 1), _histBuckets - 1)
+        self.assertEqual(_histBucket(2 ** 40), _histBuckets - 1)
+
+    def test_percentiles(self):
+        h = Histogram()
+        for ms in range(1, 101):
+            h.record(ms / 1000.0)
+        self.assertEqual(h.count, 100)
+        self.assertAlmostEqual(h.max, 0.1)
+        self.assertAlmostEqual(h.percentile(50), 0.05, delta=0.05 * 0.07)
+        self.assertAlmostEqual(h.percentile(99), 0.099, delta=0.099 * 0.07)
+        self.assertLessEqual(h.percentile(100), h.max)
+        summary = h.summary()
+        self.assertEqual(summary["count"], 100)
+        self.assertAlmostEqual(summary["avg"], 50.5, places=3)
+        self.assertAlmostEqual(summary["max"], 100.0, places=3)
+
+    def test_empty(self):
+        h = Histogram()
+        self.assertEqual(h.percentile(99), 0.0)
+        self.assertEqual(h.summary()["avg"], 0.0)
+
+    def test_negative(self):
+        h = Histogram()
+        h.record(-1)
+        self.assertEqual(h.counts[0], 1)
+        self.assertEqual(h.max, 0)
+
+    def test_merge(self):
+        a = Histogram()
+        b = Histogram()
+        a.record(0.001)
+        b.record(0.002)
+        b.record(0.5)
+        a.merge(b)
+        self.assertEqual(a.count, 3)
+        self.assertAlmostEqual(a.total, 0.503)
+        self.assertEqual(a.max, 0.5)
+        self.assertEqual(sum(a.counts), 3)
+
+class TestStats(unittest.TestCase):
+    def test_threads_sum(self):
+        stats = Stats()
+        def work():
+            for _ in range(1000):
+                stats.addTasksServed(1)
+            stats.observe("m", "run", 0.001)
+        threads = [threading.Thread(target=work) for _ in range(8)]
+        for th in threads:
+            th.start()
+        self.assertLessEqual(stats.tasksServed, 8000)
+        for th in threads:
+            th.join()
+        self.assertEqual(stats.tasksServed, 8000)
+        self.assertEqual(stats.snapshot()["tasksServed"], 8000)
+        self.assertEqual(stats.latencies()["m"]["run"].count, 8)
+
+    def test_finished_threads_are_folded(self):
+        stats = Stats()
+        stats.addTasksPulled(1)
+        def work():
+            stats.addTasksPulled(2)
+            stats.observe("m", "run", 0.5)
+        for _ in range(10):
+            th = threading.Thread(target=work)
+            th.start()
+            th.join()
+        self.assertEqual(stats.tasksPulled, 21)
+        self.assertEqual(len(stats._shards), 1)
+        self.assertEqual(stats.latencies()["m"]["run"].count, 10)
+        self.assertEqual(stats.tasksPulled, 21)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+#    nxsugarpy, build microservices over Nexus
+#    Copyright (C) 2016 by the pynexus team
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Lesser General Public License as published
+#    by the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU Lesser General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+
+import threading
+import time
+import unittest
+
+from nxsugarpy.errors import ErrTtlExpired
+from nxsugarpy.service import Service, taskTimeLeft
+from nxsugarpy.stats import Stats
+from nxsugarpy.pool import WorkerPool, DispatchQueue
+
+def waitFor(cond, timeout=2):
+    deadline = time.time() + timeout
+    while not cond():
+        if time.time() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+class FakeTask(object):
+    def __init__(self, conn, taskId, method, params, tags):
+        self.nexusConn = conn
+        self.taskId = taskId
+        self.path = "test.pull"
+        self.method = method
+        self.params = params
+        self.tags = tags
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+
+    def sendResult(self, result):
+        self.result = result
+        self.done.set()
+        return None, None
+
+    def sendError(self, code, message, data):
+        self.error = {"code": code, "message": message, "data": data}
+        self.done.set()
+        return None, None
+
+class FakeConn(object):
+    # Hands out the queued tasks and then fails the pull as a closed
+    # connection, as if the service was being stopped
+    def __init__(self, tasks, onEmpty):
+        self.tasks = [FakeTask(self, n, method, params, tags) for n, (method, params, tags) in enumerate(tasks)]
+        self.pending = list(self.tasks)
+        self.connid = "fake"
+        self.onEmpty = onEmpty
+
+    def taskPull(self, prefix, timeout=0, taskId=None):
+        if len(self.pending) > 0:
+            return self.pending.pop(0), None
+        self.onEmpty()
+        return None, {"code": -32007, "message": "connection closed"}
+
+    def close(self):
+        pass
+
+class TaskPullTest(unittest.TestCase):
+    def setUp(self):
+        self.service = Service("localhost", "test.pull", {"maxThreads": 2})
+        self.service._stats = Stats()
+        self.service._workerPool = WorkerPool(2)
+        self.service._workerPool.start()
+        self.service._pullers = 1
+        self.service._pullsLock = threading.Lock()
+        self.service._stopLock = threading.Lock()
+        self.service._stopEvent = threading.Event()
+
+    def tearDown(self):
+        self.service._workerPool.shutdown()
+
+    def pull(self, tasks):
+        conn = FakeConn(tasks, self.service._setStopping)
+        self.service._nc = conn
+        self.service._taskPull(1)
+        for task in conn.tasks:
+            self.assertTrue(task.done.wait(2))
+        return conn.tasks
+
+class TestInline(TaskPullTest):
+    def test_runs_on_pull_thread(self):
+        threads = []
+        def handler(task):
+            threads.append(threading.current_thread())
+            return task.params, None
+        self.service.addMethod("inline", handler, methodOpts={"inline": True})
+        self.service.addMethod("pooled", handler)
+        tasks = self.pull([("inline", 1, {}), ("pooled", 2, {})])
+        self.assertEqual([task.result for task in tasks], [1, 2])
+        self.assertIs(threads[0], threading.current_thread())
+        self.assertIsNot(threads[1], threading.current_thread())
+        self.assertEqual(self.service._stats.tasksInline, 1)
+        self.assertEqual(self.service._stats.tasksServed, 2)
+
+    def test_inline_without_free_workers(self):
+        self.service.addMethod("inline", lambda task: ("ok", None), methodOpts={"inline": True})
+        self.service._workerPool.acquire()
+        self.service._workerPool.acquire()
+        tasks = self.pull([("inline", None, {})])
+        self.assertEqual(tasks[0].result, "ok")
+
+    def test_builtin_methods_are_inline(self):
+        self.service.addMethod("pooled", lambda task: (None, None))
+        tasks = self.pull([("@ping", None, {})])
+        self.assertEqual(tasks[0].result, "pong")
+        self.assertEqual(self.service._stats.tasksInline, 1)
+
+class TestGracefulStop(TaskPullTest):
+    def startPuller(self, tasks):
+        conn = FakeConn(tasks, self.service._setStopping)
+        self.service._nc = conn
+        puller = threading.Thread(target=self.service._taskPull, args=(1,))
+        puller.daemon = True
+        puller.start()
+        return conn
+
+    def test_waits_for_inline_methods(self):
+        started = threading.Event()
+        def slow(task):
+            started.set()
+            time.sleep(0.3)
+            return "done", None
+        self.service.addMethod("slow", slow, methodOpts={"inline": True})
+        conn = self.startPuller([("slow", None, {})])
+        self.assertTrue(started.wait(2))
+        self.service._waitWorkers()
+        self.assertTrue(conn.tasks[0].done.is_set())
+        self.assertEqual(self.service._cmdQueue.get_nowait()[0], "task_workers_done")
+
+    def test_waits_for_tasks_waiting_for_a_worker(self):
+        release = threading.Event()
+        self.service.addMethod("slow", lambda task: (release.wait(2), None))
+        self.service.addMethod("m", lambda task: ("done", None))
+        self.service._workerPool.setLimit(1)
+        conn = self.startPuller([("slow", None, {}), ("m", None, {})])
+        self.assertTrue(waitFor(lambda: self.service._pulledTasks == 1))
+        threading.Timer(0.1, release.set).start()
+        self.service._waitWorkers()
+        self.assertEqual(conn.tasks[1].result, "done")
+
+class TestDeadline(TaskPullTest):
+    def setUp(self):
+        TaskPullTest.setUp(self)
+        self.ran = []
+        self.left = []
+        def handler(task):
+            self.ran.append(task.params)
+            self.left.append(taskTimeLeft(task))
+            return task.params, None
+        self.service.addMethod("m", handler)
+
+    def test_expired_before_running(self):
+        tasks = self.pull([
+            ("m", 1, {"@timeout": 0}),
+            ("m", 2, {"@deadline": time.time() - 1}),
+            ("m", 3, {}),
+        ])
+        self.assertEqual([task.error["code"] if task.error else None for task in tasks], [ErrTtlExpired, ErrTtlExpired, None])
+        self.assertEqual(self.ran, [3])
+        self.assertEqual(self.left, [None])
+        self.assertEqual(self.service._stats.tasksExpired, 2)
+
+    def test_time_left(self):
+        tasks = self.pull([
+            ("m", 1, {"@timeout": 10}),
+            ("m", 2, {"@deadline": time.time() + 10}),
+            ("m", {"@metadata": {"timeout": 10}}, {}),
+            ("m", 4, {"@timeout": "bad"}),
+        ])
+        self.assertTrue(all(task.error == None for task in tasks))
+        for left in self.left[:3]:
+            self.assertTrue(9 < left <= 10, left)
+        self.assertEqual(self.left[3], None)
+
+    def test_expires_waiting_for_worker(self):
+        release = threading.Event()
+        self.service.addMethod("slow", lambda task: (release.wait(2), None))
+        self.service._workerPool.setLimit(1)
+        conn = FakeConn([("slow", None, {}), ("m", 1, {"@timeout": 0.05})], self.service._setStopping)
+        self.service._nc = conn
+        puller = threading.Thread(target=self.service._taskPull, args=(1,))
+        puller.start()
+        time.sleep(0.1)
+        release.set()
+        puller.join(2)
+        self.assertTrue(conn.tasks[1].done.wait(2))
+        self.assertEqual(conn.tasks[1].error["code"], ErrTtlExpired)
+        self.assertEqual(self.ran, [])
+
+class TestDispatcher(TaskPullTest):
+    def test_idle_dispatcher_holds_no_worker(self):
+        self.service._dispatchQueue = DispatchQueue()
+        dispatcher = threading.Thread(target=self.service._dispatchLoop)
+        dispatcher.start()
+        time.sleep(0.1)
+        self.assertEqual(self.service._workerPool.takePeak(), 0)
+        ran = threading.Event()
+        def run():
+            ran.set()
+            self.service._workerPool.release()
+        self.service._dispatchQueue.put((run, (), 0, 0), 0)
+        self.assertTrue(ran.wait(2))
+        self.service._dispatchQueue.close()
+        dispatcher.join(2)
+        self.assertFalse(dispatcher.is_alive())
+        self.assertEqual(self.service._workerPool.takePeak(), 1)
+
+if __name__ == "__main__":
+    unittest.main()